@@ -1,3 +1,4 @@
+import logging
 import numpy as np
 import pandas as pd
 import numba
@@ -5,21 +6,33 @@ from numba import prange
 import requests
 import os
 import json
+import tempfile
+import threading
 import time
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import scipy.spatial
+from scipy.cluster.vq import kmeans2
+from scipy.interpolate import RBFInterpolator
+from scipy.stats import qmc
 
 
 @numba.njit
-def find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, inv_eff, n_dis, n_chg, dod_max,
-                           diesel_price, end_year, start_year, pv_cost, charge_controller, pv_inverter,
-                           pv_om, diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost, diesel_life,
-                           pv_life, battery_cost, discount_rate, lpsp_max, diesel_limit, full_life_cycles):
+def find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, peak_load, inv_eff, n_dis, n_chg,
+                           dod_max, diesel_price, pv_cost, charge_controller, pv_inverter, pv_om, diesel_cost,
+                           diesel_om, battery_inverter_life, battery_inverter_cost, diesel_life, pv_life, battery_cost,
+                           lpsp_max, diesel_limit, full_life_cycles, lcoe_factors, hour_weights=None):
     pv = float(configuration[0])
     battery = float(configuration[1])
     usable_battery = battery * dod_max  # ensure the battery never goes below max depth of discharge
     diesel = float(configuration[2])
 
-    annual_demand = load_curve.sum()
+    # The hourly series may be a reduced set of representative hours, in which case they are weighted by the number
+    # of hours of the year they represent
+    if hour_weights is None:
+        annual_demand = load_curve.sum()
+    else:
+        annual_demand = (load_curve * hour_weights).sum()
 
     # First the PV generation and net load (load - pv generation) is calculated for each hour of the year
     net_load, pv_gen = pv_generation(temp, ghi, pv, load_curve, inv_eff)
@@ -29,7 +42,8 @@ def find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, i
         excess_gen_share, battery_soc_curve, diesel_gen_curve = \
         year_simulation(battery_size=usable_battery, diesel_capacity=diesel, net_load=net_load,
                         hour_numbers=hour_numbers, inv_eff=inv_eff, n_dis=n_dis, n_chg=n_chg,
-                        annual_demand=annual_demand, full_life_cycles=full_life_cycles, dod_max=dod_max)
+                        annual_demand=annual_demand, full_life_cycles=full_life_cycles, dod_max=dod_max,
+                        lpsp_max=lpsp_max, diesel_limit=diesel_limit, hour_weights=hour_weights)
 
     # If the system could meet the demand in a satisfactory manner (i.e. with high enough reliability and low enough
     # share of the generation coming from the diesel generator), then the LCOE is calculated. Else 99 is returned.
@@ -41,46 +55,930 @@ def find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, i
         npc = 0
     else:
         lcoe, investment, battery_investment, fuel_cost, \
-            om_cost, npc = calculate_hybrid_lcoe(diesel_price=diesel_price,
-                                                 end_year=end_year,
-                                                 start_year=start_year,
-                                                 annual_demand=annual_demand,
-                                                 fuel_usage=annual_fuel_consumption,
-                                                 pv_panel_size=pv,
-                                                 pv_cost=pv_cost,
-                                                 charge_controller=charge_controller,
-                                                 pv_inverter_cost=pv_inverter,
-                                                 pv_om=pv_om,
-                                                 diesel_capacity=diesel,
-                                                 diesel_cost=diesel_cost,
-                                                 diesel_om=diesel_om,
-                                                 battery_inverter_cost=battery_inverter_cost,
-                                                 battery_inverter_life=battery_inverter_life,
-                                                 load_curve=load_curve,
-                                                 diesel_life=diesel_life,
-                                                 pv_life=pv_life,
-                                                 battery_life=battery_life,
-                                                 battery_size=battery,
-                                                 battery_cost=battery_cost,
-                                                 discount_rate=discount_rate)
+            om_cost, npc = calculate_hybrid_lcoe_annuity(diesel_price=diesel_price,
+                                                         annual_demand=annual_demand,
+                                                         fuel_usage=annual_fuel_consumption,
+                                                         pv_panel_size=pv,
+                                                         pv_cost=pv_cost,
+                                                         charge_controller=charge_controller,
+                                                         pv_inverter_cost=pv_inverter,
+                                                         pv_om=pv_om,
+                                                         diesel_capacity=diesel,
+                                                         diesel_cost=diesel_cost,
+                                                         diesel_om=diesel_om,
+                                                         battery_inverter_cost=battery_inverter_cost,
+                                                         battery_inverter_life=battery_inverter_life,
+                                                         peak_load=peak_load,
+                                                         diesel_life=diesel_life,
+                                                         pv_life=pv_life,
+                                                         battery_life=battery_life,
+                                                         battery_size=battery,
+                                                         battery_cost=battery_cost,
+                                                         lcoe_factors=lcoe_factors)
 
     return lcoe, unmet_demand_share, diesel_generation_share, investment, fuel_cost, om_cost, battery, \
         battery_life, pv, diesel, npc
 
+
+@numba.njit(parallel=True)
+def find_least_cost_option_batch(configurations, temp, ghi, hour_numbers, load_curve, peak_load, inv_eff, n_dis, n_chg,
+                                 dod_max, diesel_price, pv_cost, charge_controller, pv_inverter, pv_om, diesel_cost,
+                                 diesel_om, battery_inverter_life, battery_inverter_cost, diesel_life, pv_life,
+                                 battery_cost, lpsp_max, diesel_limit, full_life_cycles, lcoe_factors,
+                                 hour_weights=None):
+    # Evaluates the LCOE of a whole population of (pv, battery, diesel) configurations (one per row) in one call,
+    # with the candidates spread over all available cores. Used as the vectorized objective of the optimizer
+    n_candidates = configurations.shape[0]
+    lcoe = np.empty(n_candidates)
+
+    for i in prange(n_candidates):
+        lcoe[i] = find_least_cost_option(configurations[i], temp, ghi, hour_numbers, load_curve, peak_load, inv_eff,
+                                         n_dis, n_chg, dod_max, diesel_price, pv_cost, charge_controller, pv_inverter,
+                                         pv_om, diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
+                                         diesel_life, pv_life, battery_cost, lpsp_max, diesel_limit,
+                                         full_life_cycles, lcoe_factors, hour_weights)[0]
+
+    return lcoe
+
+
+# Technical and economic specifications of a PV-hybrid mini-grid, in the order they are passed to
+# find_least_cost_option. Kernels receive them as a one-element structured array (see pv_hybrid_specs_record)
+PV_HYBRID_SPECS_DTYPE = np.dtype([('inv_eff', np.float64), ('n_dis', np.float64), ('n_chg', np.float64),
+                                  ('dod_max', np.float64), ('pv_cost', np.float64), ('charge_controller', np.float64),
+                                  ('pv_inverter', np.float64), ('pv_om', np.float64), ('diesel_cost', np.float64),
+                                  ('diesel_om', np.float64), ('battery_inverter_life', np.float64),
+                                  ('battery_inverter_cost', np.float64), ('diesel_life', np.float64),
+                                  ('pv_life', np.float64), ('battery_cost', np.float64), ('lpsp_max', np.float64),
+                                  ('diesel_limit', np.float64), ('full_life_cycles', np.float64)])
+
+
+def pv_hybrid_specs_record(mg_pv_hybrid_specs):
+    """
+    Packs the PV-hybrid specifications (a dict such as mg_pv_hybrid_specs, with at least the fields of
+    PV_HYBRID_SPECS_DTYPE) into the one-element record array taken by the compiled optimizer
+    """
+    specs = np.zeros(1, dtype=PV_HYBRID_SPECS_DTYPE)
+    for name in PV_HYBRID_SPECS_DTYPE.names:
+        specs[name] = mg_pv_hybrid_specs[name]
+    return specs
+
+
+@numba.njit
+def find_least_cost_option_specs(configuration, temp, ghi, hour_numbers, load_curve, peak_load, diesel_price, specs,
+                                 lcoe_factors, hour_weights=None):
+    # Same as find_least_cost_option, with the specifications taken from a PV_HYBRID_SPECS_DTYPE record array
+    s = specs[0]
+    return find_least_cost_option(configuration, temp, ghi, hour_numbers, load_curve, peak_load, s.inv_eff, s.n_dis,
+                                  s.n_chg, s.dod_max, diesel_price, s.pv_cost, s.charge_controller, s.pv_inverter,
+                                  s.pv_om, s.diesel_cost, s.diesel_om, s.battery_inverter_life,
+                                  s.battery_inverter_cost, s.diesel_life, s.pv_life, s.battery_cost, s.lpsp_max,
+                                  s.diesel_limit, s.full_life_cycles, lcoe_factors, hour_weights)
+
+
+@numba.njit
+def differential_evolution_jit(temp, ghi, hour_numbers, load_curve, peak_load, diesel_price, specs, lcoe_factors,
+                               min_bounds, max_bounds, seed, popsize=15, maxiter=1000, tol=0.01, hour_weights=None,
+                               init=None):
+    # Differential evolution (best/1/bin strategy with dithered mutation) of the (pv, battery, diesel) sizing, run
+    # entirely in compiled code. Follows scipy's differential_evolution with the default settings used in
+    # optimize_mini_grid, without the final polishing. init is an optional initial population of configurations
+    # (e.g. from warm_start_population), replacing the latin hypercube. Returns the best configuration, its LCOE and
+    # the number of evaluations
+    np.random.seed(seed)
+    n_dim = 3
+    mutation_min, mutation_max = 0.5, 1.
+    recombination = 0.7
+    scale = max_bounds - min_bounds
+
+    if init is None:
+        # Latin hypercube initialization of the population, in the unit cube
+        n_pop = popsize * n_dim
+        population = np.empty((n_pop, n_dim))
+        for d in range(n_dim):
+            segments = (np.random.random(n_pop) + np.arange(n_pop)) / n_pop
+            population[:, d] = segments[np.random.permutation(n_pop)]
+    else:
+        # The given configurations, scaled to the unit cube
+        n_pop = len(init)
+        population = np.empty((n_pop, n_dim))
+        for i in range(n_pop):
+            for d in range(n_dim):
+                population[i, d] = min(max((init[i, d] - min_bounds[d]) / scale[d], 0.), 1.)
+
+    energies = np.empty(n_pop)
+    for i in range(n_pop):
+        energies[i] = find_least_cost_option_specs(min_bounds + population[i] * scale, temp, ghi, hour_numbers,
+                                                   load_curve, peak_load, diesel_price, specs, lcoe_factors,
+                                                   hour_weights)[0]
+    n_evaluations = n_pop
+
+    trials = np.empty((n_pop, n_dim))
+    trial_energies = np.empty(n_pop)
+    for generation in range(maxiter):
+        best = np.argmin(energies)
+        mutation = mutation_min + np.random.random() * (mutation_max - mutation_min)
+
+        # A new trial is created for every member of the population before any of them is replaced
+        for i in range(n_pop):
+            r1 = np.random.randint(n_pop)
+            while r1 == i:
+                r1 = np.random.randint(n_pop)
+            r2 = np.random.randint(n_pop)
+            while r2 == i or r2 == r1:
+                r2 = np.random.randint(n_pop)
+
+            fill_point = np.random.randint(n_dim)
+            for d in range(n_dim):
+                if (np.random.random() < recombination) or (d == fill_point):
+                    trials[i, d] = population[best, d] + mutation * (population[r1, d] - population[r2, d])
+                else:
+                    trials[i, d] = population[i, d]
+                # Parameters outside of the bounds are replaced with random values inside the bounds
+                if (trials[i, d] < 0) or (trials[i, d] > 1):
+                    trials[i, d] = np.random.random()
+
+        for i in range(n_pop):
+            trial_energies[i] = find_least_cost_option_specs(min_bounds + trials[i] * scale, temp, ghi, hour_numbers,
+                                                             load_curve, peak_load, diesel_price, specs,
+                                                             lcoe_factors, hour_weights)[0]
+        n_evaluations += n_pop
+
+        for i in range(n_pop):
+            if trial_energies[i] < energies[i]:
+                energies[i] = trial_energies[i]
+                population[i] = trials[i]
+
+        if np.std(energies) <= tol * np.abs(np.mean(energies)):
+            break
+
+    best = np.argmin(energies)
+    return min_bounds + population[best] * scale, energies[best], n_evaluations
+
+
+@numba.njit
+def smallest_feasible_diesel(pv, battery, temp, ghi, hour_numbers, load_curve, peak_load, diesel_price, specs,
+                             lcoe_factors, low, high, max_diesel, n_bisections=3, hour_weights=None):
+    # For a given PV and battery size the unmet demand never increases with the diesel capacity, while the diesel
+    # share never decreases. The cheapest feasible configuration is therefore (close to) the smallest diesel capacity
+    # that meets the reliability constraint, which is found by bisection between low and high. Returns the diesel
+    # capacity, its LCOE (99 if no diesel capacity up to max_diesel gives a feasible system) and the number of
+    # evaluations
+    lpsp_max = specs[0].lpsp_max
+    configuration = np.array([pv, battery, high])
+
+    result = find_least_cost_option_specs(configuration, temp, ghi, hour_numbers, load_curve, peak_load, diesel_price,
+                                          specs, lcoe_factors, hour_weights)
+    n_evaluations = 1
+    if (result[1] > lpsp_max) and (high < max_diesel):
+        # The bracket is too narrow, so the search continues above it
+        low = high
+        high = max_diesel
+        configuration[2] = high
+        result = find_least_cost_option_specs(configuration, temp, ghi, hour_numbers, load_curve, peak_load,
+                                              diesel_price, specs, lcoe_factors, hour_weights)
+        n_evaluations += 1
+    if result[1] > lpsp_max:
+        # If the largest diesel generator can not meet the demand, no smaller one can
+        return high, 99., n_evaluations
+
+    lcoe = result[0]
+    for i in range(n_bisections):
+        configuration[2] = (low + high) / 2
+        result = find_least_cost_option_specs(configuration, temp, ghi, hour_numbers, load_curve, peak_load,
+                                              diesel_price, specs, lcoe_factors, hour_weights)
+        n_evaluations += 1
+        if result[1] > lpsp_max:
+            low = configuration[2]
+        else:
+            high = configuration[2]
+            lcoe = result[0]
+
+    # If the diesel share is too high at the smallest capacity meeting the demand, it is too high for all of them
+    return high, lcoe, n_evaluations
+
+
+@numba.njit
+def grid_bisection_search(temp, ghi, hour_numbers, load_curve, peak_load, diesel_price, specs, lcoe_factors,
+                          min_bounds, max_bounds, n_grid=7, n_levels=4, n_bisections=3, hour_weights=None):
+    # Sizing search exploiting the structure of the problem: the (pv, battery) plane is searched on a grid that is
+    # refined around the best point found in each level, and for every grid point only the smallest feasible diesel
+    # capacity is evaluated (see smallest_feasible_diesel). The diesel bracket is narrowed around the best capacity
+    # in the same way. Returns the best configuration, its LCOE and the number of evaluations
+    best_x = np.array([min_bounds[0], min_bounds[1], max_bounds[2]])
+    best_lcoe = np.inf
+    n_evaluations = 0
+
+    low = min_bounds.copy()
+    high = max_bounds.copy()
+    for level in range(n_levels):
+        step = (high - low) / (n_grid - 1)
+        for i in range(n_grid):
+            for j in range(n_grid):
+                pv = low[0] + i * step[0]
+                battery = low[1] + j * step[1]
+                diesel, lcoe, n = smallest_feasible_diesel(pv, battery, temp, ghi, hour_numbers, load_curve,
+                                                           peak_load, diesel_price, specs, lcoe_factors, low[2],
+                                                           high[2], max_bounds[2], n_bisections, hour_weights)
+                n_evaluations += n
+                if lcoe < best_lcoe:
+                    best_lcoe = lcoe
+                    best_x[0] = pv
+                    best_x[1] = battery
+                    best_x[2] = diesel
+
+        # The next level covers one grid step on each side of the best point, and a diesel bracket of four times the
+        # bisection resolution around the best diesel capacity
+        step[2] = 2 * (high[2] - low[2]) / 2 ** n_bisections
+        low = np.maximum(best_x - step, min_bounds)
+        high = np.minimum(best_x + step, max_bounds)
+
+    return best_x, best_lcoe, n_evaluations
+
+
+@numba.njit(parallel=True)
+def optimize_mini_grid_cells(cells, ghi_curve, temp, hour_numbers, energy, specs, lcoe_factors, seeds, popsize=15):
+    # Optimizes the PV-hybrid sizing for many lookup table cells at once, one cell per core at a time. Each row of
+    # cells holds (tier, annual GHI in kWh/m2, diesel price), and is optimized with its own seed from seeds (see
+    # cell_seed), so the results do not depend on the number of threads. Returns one row of (lcoe, investment,
+    # capacity, fuel cost) per cell, as returned by optimize_mini_grid
+    n_cells = cells.shape[0]
+    results = np.empty((n_cells, 4))
+    ghi_sum = ghi_curve.sum() / 1000
+
+    for c in prange(n_cells):
+        tier = int(cells[c, 0])
+        load_curve = calc_load_curve(tier, energy, ghi_curve.dtype)
+        cell_ghi = (ghi_curve * (ghi_sum / cells[c, 1])).astype(ghi_curve.dtype)
+        diesel_price = cells[c, 2]
+        peak_load = load_curve.max()
+
+        min_bounds = np.array([0, 0, 0.5])
+        max_bounds = np.array([5 * peak_load, 5 * load_curve.sum() / 365, peak_load])
+
+        x, lcoe, n_evaluations = differential_evolution_jit(temp, cell_ghi, hour_numbers, load_curve, peak_load,
+                                                            diesel_price, specs, lcoe_factors, min_bounds,
+                                                            max_bounds, seeds[c], popsize)
+
+        result = find_least_cost_option_specs(x, temp, cell_ghi, hour_numbers, load_curve, peak_load, diesel_price,
+                                              specs, lcoe_factors)
+        results[c, 0] = result[0]
+        results[c, 1] = result[3]
+        results[c, 2] = result[8] + result[9]
+        results[c, 3] = result[4]
+
+    return results
+
+
+@numba.njit(parallel=True)
+def dispatch_batch(configurations, temp, ghi, hour_numbers, load_curve, inv_eff, n_dis, n_chg, dod_max,
+                   full_life_cycles):
+    # Runs the hourly dispatch of a full year for every (pv, battery, diesel) configuration (one per row), without
+    # pruning, and returns one row of (fuel use, diesel share, unmet demand share, battery life) per configuration.
+    # None of these depend on the diesel price, the discounting or the reliability constraints
+    n_configurations = configurations.shape[0]
+    results = np.empty((n_configurations, 4))
+    annual_demand = load_curve.sum()
+
+    for i in prange(n_configurations):
+        net_load, pv_gen = pv_generation(temp, ghi, configurations[i, 0], load_curve, inv_eff)
+        diesel_generation_share, battery_life, unmet_demand_share, annual_fuel_consumption, excess_gen_share, \
+            battery_soc_curve, diesel_gen_curve = year_simulation(configurations[i, 1] * dod_max, configurations[i, 2],
+                                                                  net_load, hour_numbers, inv_eff, n_dis, n_chg,
+                                                                  annual_demand, full_life_cycles, dod_max)
+        results[i, 0] = annual_fuel_consumption
+        results[i, 1] = diesel_generation_share
+        results[i, 2] = unmet_demand_share
+        results[i, 3] = battery_life
+
+    return results
+
+
+@numba.njit
+def least_cost_from_dispatch(pv_sizes, battery_sizes, diesel_sizes, dispatch, annual_demand, peak_load,
+                             diesel_price, pv_cost, charge_controller, pv_inverter, pv_om, diesel_cost, diesel_om,
+                             battery_inverter_life, battery_inverter_cost, diesel_life, pv_life, battery_cost, lpsp_max,
+                             diesel_limit, lcoe_factors):
+    # Financial evaluation of a grid of configurations whose dispatch is already known (dispatch[i, j, k] holds the
+    # dispatch_batch results of pv_sizes[i], battery_sizes[j] and diesel_sizes[k]). Since the unmet demand decreases
+    # with the diesel capacity, the capacity where it crosses lpsp_max is interpolated between the grid points, and
+    # evaluated along with them. Returns the (lcoe, investment, fuel cost, pv, battery, diesel) of the least-cost
+    # configuration meeting the constraints, with an LCOE of 99 if there is none
+    best = np.zeros(6)
+    best[0] = 99
+
+    for i in range(len(pv_sizes)):
+        for j in range(len(battery_sizes)):
+            for k in range(len(diesel_sizes)):
+                for interpolate in (True, False):
+                    diesel = diesel_sizes[k]
+                    fuel, diesel_share, unmet_share, battery_life = dispatch[i, j, k]
+
+                    if interpolate:
+                        if (k == 0) or not (dispatch[i, j, k - 1, 2] > lpsp_max >= unmet_share):
+                            continue
+                        previous = dispatch[i, j, k - 1]
+                        t = (previous[2] - lpsp_max) / (previous[2] - unmet_share)
+                        diesel = diesel_sizes[k - 1] + t * (diesel - diesel_sizes[k - 1])
+                        fuel = previous[0] + t * (fuel - previous[0])
+                        diesel_share = previous[1] + t * (diesel_share - previous[1])
+                        unmet_share = lpsp_max
+                        battery_life = min(previous[3], battery_life)
+
+                    if (battery_life == 0) or (unmet_share > lpsp_max) or (diesel_share > diesel_limit):
+                        continue
+
+                    lcoe, investment, battery_investment, fuel_cost, om_cost, npc = \
+                        calculate_hybrid_lcoe_annuity(diesel_price, annual_demand, fuel, pv_sizes[i], pv_cost, pv_life,
+                                                      pv_om, charge_controller, pv_inverter, diesel, diesel_cost,
+                                                      diesel_om, diesel_life, battery_sizes[j], battery_cost,
+                                                      battery_life, battery_inverter_cost, battery_inverter_life,
+                                                      peak_load, lcoe_factors)
+                    if lcoe < best[0]:
+                        best[0] = lcoe
+                        best[1] = investment
+                        best[2] = fuel_cost
+                        best[3] = pv_sizes[i]
+                        best[4] = battery_sizes[j]
+                        best[5] = diesel
+
+    return best
+
+
+@numba.njit
+def interpolate_dispatch(pv_sizes, battery_sizes, dispatch, fine_pv_sizes, fine_battery_sizes):
+    # Bilinear interpolation of the dispatch results (see least_cost_from_dispatch) in the pv and battery dimensions,
+    # onto a finer grid of sizes within the original one. The battery life is taken as the shortest of the four
+    # surrounding grid points
+    n_diesel = dispatch.shape[2]
+    fine = np.empty((len(fine_pv_sizes), len(fine_battery_sizes), n_diesel, 4))
+
+    for a in range(len(fine_pv_sizes)):
+        i = min(max(np.searchsorted(pv_sizes, fine_pv_sizes[a]) - 1, 0), len(pv_sizes) - 2)
+        u = (fine_pv_sizes[a] - pv_sizes[i]) / (pv_sizes[i + 1] - pv_sizes[i])
+        for b in range(len(fine_battery_sizes)):
+            j = min(max(np.searchsorted(battery_sizes, fine_battery_sizes[b]) - 1, 0), len(battery_sizes) - 2)
+            v = (fine_battery_sizes[b] - battery_sizes[j]) / (battery_sizes[j + 1] - battery_sizes[j])
+            for k in range(n_diesel):
+                for m in range(3):
+                    fine[a, b, k, m] = (1 - u) * (1 - v) * dispatch[i, j, k, m] \
+                        + u * (1 - v) * dispatch[i + 1, j, k, m] \
+                        + (1 - u) * v * dispatch[i, j + 1, k, m] \
+                        + u * v * dispatch[i + 1, j + 1, k, m]
+                fine[a, b, k, 3] = min(min(dispatch[i, j, k, 3], dispatch[i + 1, j, k, 3]),
+                                       min(dispatch[i, j + 1, k, 3], dispatch[i + 1, j + 1, k, 3]))
+
+    return fine
+
+
+class HybridDispatchCache:
+    """
+    Stores the hourly dispatch results (fuel use, diesel share, unmet demand share and battery life) of a grid of
+    (pv, battery, diesel) configurations for each tier and GHI level, computed the first time they are needed.
+
+    The dispatch does not depend on the diesel price, the discounting, the study period or the constraints, so the
+    least-cost configuration can then be found for any of those with the financial evaluation only. The technical
+    specifications (inv_eff, n_dis, n_chg, dod_max and full_life_cycles) are fixed when the cache is created.
+    """
+
+    def __init__(self, ghi_curve, temp, mg_pv_hybrid_specs, energy=10000., n_grid=16, n_refine=9, n_bisections=4):
+        self.ghi_curve = ghi_curve
+        self.temp = temp
+        self.energy = energy
+        self.n_grid = n_grid
+        self.n_refine = n_refine
+        self.n_bisections = n_bisections
+        self.inv_eff = mg_pv_hybrid_specs['inv_eff']
+        self.n_dis = mg_pv_hybrid_specs['n_dis']
+        self.n_chg = mg_pv_hybrid_specs['n_chg']
+        self.dod_max = mg_pv_hybrid_specs['dod_max']
+        self.full_life_cycles = mg_pv_hybrid_specs['full_life_cycles']
+        self.hour_numbers = np.tile(np.arange(24, dtype=float), 365)
+        self.results = {}
+
+    def sizes(self, load_curve):
+        # Same solution space as in optimize_mini_grid. The least-cost battery is usually small compared to the upper
+        # bound of five days of demand, so the battery sizes are spaced more densely towards zero
+        pv_sizes = np.linspace(0, 5 * load_curve.max(), self.n_grid)
+        battery_sizes = np.linspace(0, 1, self.n_grid) ** 2 * 5 * load_curve.sum() / 365
+        diesel_sizes = np.linspace(0.5, load_curve.max(), self.n_grid)
+        return pv_sizes, battery_sizes, diesel_sizes
+
+    def dispatch(self, tier, ghi):
+        """
+        Returns the pv, battery and diesel sizes of the grid and their dispatch results for a tier and an annual GHI
+        (kWh/m2)
+        """
+        if (tier, ghi) not in self.results:
+            load_curve = calc_load_curve(tier, self.energy, self.ghi_curve.dtype)
+            ghi_curve = self.ghi_curve * ((self.ghi_curve.sum() / 1000) / ghi)
+            pv_sizes, battery_sizes, diesel_sizes = self.sizes(load_curve)
+            configurations = np.stack(np.meshgrid(pv_sizes, battery_sizes, diesel_sizes, indexing='ij'),
+                                      axis=-1).reshape(-1, 3)
+            dispatch = dispatch_batch(configurations, self.temp, ghi_curve, self.hour_numbers, load_curve,
+                                      self.inv_eff, self.n_dis, self.n_chg, self.dod_max, self.full_life_cycles)
+            self.results[tier, ghi] = pv_sizes, battery_sizes, diesel_sizes, dispatch.reshape(self.n_grid,
+                                                                                              self.n_grid,
+                                                                                              self.n_grid, 4)
+        return self.results[tier, ghi]
+
+    def optimize(self, tier, ghi, diesel_price, start_year, end_year, mg_pv_hybrid_specs):
+        """
+        Finds the least-cost configuration for a tier and an annual GHI (kWh/m2), with the diesel price, study period,
+        costs and constraints given. Returns the same values as SettlementProcessor.optimize_mini_grid
+        """
+        specs = mg_pv_hybrid_specs
+        pv_sizes, battery_sizes, diesel_sizes, dispatch = self.dispatch(tier, ghi)
+        load_curve = calc_load_curve(tier, self.energy, self.ghi_curve.dtype)
+        lcoe_factors = hybrid_lcoe_factors(end_year, start_year, specs['discount_rate'],
+                                           max(specs['pv_life'], specs['diesel_life'], specs['battery_inverter_life'],
+                                               20))
+
+        def least_cost(pv_sizes, battery_sizes, dispatch):
+            return least_cost_from_dispatch(pv_sizes, battery_sizes, diesel_sizes, dispatch, load_curve.sum(),
+                                            load_curve.max(), diesel_price, specs['pv_cost'],
+                                            specs['charge_controller'], specs['pv_inverter'], specs['pv_om'],
+                                            specs['diesel_cost'], specs['diesel_om'], specs['battery_inverter_life'],
+                                            specs['battery_inverter_cost'], specs['diesel_life'], specs['pv_life'],
+                                            specs['battery_cost'], specs['lpsp_max'], specs['diesel_limit'],
+                                            lcoe_factors)
+
+        lcoe, investment, fuel_cost, pv, battery, diesel = least_cost(pv_sizes, battery_sizes, dispatch)
+
+        if lcoe == 99:
+            return 99, 0, 0, 0
+
+        # The pv and battery sizes are then refined within one grid step of the best grid point, using the dispatch
+        # results interpolated between the grid points
+        pv_step = pv_sizes[1] - pv_sizes[0]
+        battery_step = battery_sizes[1] - battery_sizes[0]
+        fine_pv_sizes = np.linspace(max(pv - pv_step, pv_sizes[0]), min(pv + pv_step, pv_sizes[-1]), self.n_refine)
+        fine_battery_sizes = np.linspace(max(battery - battery_step, battery_sizes[0]),
+                                         min(battery + battery_step, battery_sizes[-1]), self.n_refine)
+        fine_dispatch = interpolate_dispatch(pv_sizes, battery_sizes, dispatch, fine_pv_sizes, fine_battery_sizes)
+
+        fine = least_cost(fine_pv_sizes, fine_battery_sizes, fine_dispatch)
+        if fine[0] < lcoe:
+            lcoe, investment, fuel_cost, pv, battery, diesel = fine
+
+        # The interpolated dispatch is only an approximation, so the diesel capacity for the chosen pv and battery
+        # sizes is settled by a few simulations, bisecting around the interpolated capacity
+        ghi_curve = self.ghi_curve * ((self.ghi_curve.sum() / 1000) / ghi)
+        specs_record = pv_hybrid_specs_record(specs)
+        diesel_step = diesel_sizes[1] - diesel_sizes[0]
+        diesel, exact_lcoe, n_evaluations = smallest_feasible_diesel(
+            pv, battery, self.temp, ghi_curve, self.hour_numbers, load_curve, load_curve.max(), diesel_price,
+            specs_record, lcoe_factors, max(diesel - diesel_step, diesel_sizes[0]),
+            min(diesel + diesel_step, diesel_sizes[-1]), diesel_sizes[-1], self.n_bisections)
+
+        if exact_lcoe < 99:
+            result = find_least_cost_option_specs(np.array([pv, battery, diesel]), self.temp, ghi_curve,
+                                                  self.hour_numbers, load_curve, load_curve.max(), diesel_price,
+                                                  specs_record, lcoe_factors)
+            lcoe, investment, fuel_cost = result[0], result[3], result[4]
+
+        return lcoe, investment, pv + diesel, fuel_cost
+
+
+def file_hash(path):
+    """
+    Returns the SHA-256 hash of the contents of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def lookup_table_key(resource_path, **inputs):
+    """
+    Returns a hash of the contents of the resource file and of all other inputs a hybrid lookup table depends on
+    (specifications, ranges, years and optimizer settings)
+    """
+    def to_json(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        return str(value)
+
+    digest = hashlib.sha256(file_hash(resource_path).encode())
+    digest.update(json.dumps(inputs, sort_keys=True, default=to_json).encode())
+    return digest.hexdigest()[:20]
+
+
+def cell_seed(seed, cell):
+    """
+    Returns the seed of the optimization of a lookup table cell (tier, resource level, diesel price and optionally the
+    annual demand), derived from seed and the values of the cell. A cell therefore gets the same seed whichever other
+    cells are solved with it, in whatever order, and whether they are solved serially, in worker processes or in one
+    compiled call
+    """
+    key = json.dumps([int(seed)] + [round(float(value), 6) for value in cell])
+    return int(hashlib.sha256(key.encode()).hexdigest()[:8], 16)
+
+
+class HybridLookupTable:
+    """
+    The lcoe, investment, capacity and fuel cost of the least-cost hybrid mini-grid of each (tier, resource level,
+    diesel price) cell of a lookup table, in one dense array of shape (4, tiers, resource levels, diesel prices) with
+    NaN for the cells not solved yet. The resource level is the annual GHI (kWh/m2) for PV and the average wind speed
+    (m/s) for wind.
+    """
+
+    def __init__(self, tiers, resource_range, diesel_range):
+        self.tiers = np.asarray(tiers, dtype=float)
+        self.resource_range = np.asarray(resource_range, dtype=float)
+        self.diesel_range = np.asarray(diesel_range, dtype=float)
+        self.cells = {(t, r, d): (i, j, k)
+                      for i, t in enumerate(tiers)
+                      for j, r in enumerate(resource_range)
+                      for k, d in enumerate(diesel_range)}
+        self.table = np.full((4, len(tiers), len(resource_range), len(diesel_range)), np.nan)
+
+    def __contains__(self, cell):
+        return not np.isnan(self.table[(0,) + self.cells[cell]])
+
+    @property
+    def complete(self):
+        return not np.isnan(self.table).any()
+
+    def solved(self):
+        """
+        Returns a dict with the (lcoe, investment, capacity, fuel cost) of each solved cell
+        """
+        return {cell: tuple(self.table[(slice(None),) + index]) for cell, index in self.cells.items() if cell in self}
+
+    def add(self, cell, result):
+        self.table[(slice(None),) + self.cells[cell]] = result
+
+    def query(self, tier, resource, diesel, interpolate=False):
+        """
+        Returns the (lcoe, investment, capacity, fuel cost) of many settlements at once, as an array of shape (4, n).
+        The tier must be one of the tiers of the table. The resource levels and diesel prices outside the table are
+        clipped to its edges.
+
+        By default the nearest cell is used, which is the same as rounding to the table steps. With interpolate=True the
+        values are interpolated bilinearly between the four surrounding cells, except where any of these is infeasible
+        (lcoe of 99), where the nearest cell is used.
+        """
+        def bracket(axis, values):
+            low = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 1)
+            high = np.minimum(low + 1, len(axis) - 1)
+            span = axis[high] - axis[low]
+            weight = np.clip((values - axis[low]) / np.where(span > 0, span, 1), 0, 1)
+            return low, high, np.where(span > 0, weight, 0)
+
+        t = np.clip(np.searchsorted(self.tiers, np.asarray(tier, dtype=float)), 0, len(self.tiers) - 1)
+        r_low, r_high, r_weight = bracket(self.resource_range, np.asarray(resource, dtype=float))
+        d_low, d_high, d_weight = bracket(self.diesel_range, np.asarray(diesel, dtype=float))
+
+        nearest = self.table[:, t, np.where(r_weight < 0.5, r_low, r_high), np.where(d_weight < 0.5, d_low, d_high)]
+        if not interpolate:
+            return nearest
+
+        corners = [self.table[:, t, r, d] for r in (r_low, r_high) for d in (d_low, d_high)]
+        weights = [(1 - r_weight) * (1 - d_weight), (1 - r_weight) * d_weight, r_weight * (1 - d_weight),
+                   r_weight * d_weight]
+        interpolated = sum(w * c for w, c in zip(weights, corners))
+        infeasible = np.any([c[0] >= 99 for c in corners], axis=0)
+        return np.where(infeasible, nearest, interpolated)
+
+    def build_adaptive(self, solve, tolerance=0.01, coarse_step=4):
+        """
+        Fills the table by solving only part of its cells. The cells every coarse_step steps of the resource and diesel
+        ranges are solved first. Each rectangle between them is checked by solving its middle cell: if its lcoe is
+        within the relative tolerance of the lcoe interpolated from the corners of the rectangle, the other cells of
+        the rectangle are interpolated, otherwise the rectangle is split in four and each of these is checked in the
+        same way. Rectangles with infeasible corners are split down to single steps, unless all are infeasible.
+
+        Arguments
+        ---------
+        solve : function of (tier, resource level, diesel price) returning (lcoe, investment, capacity, fuel cost)
+        tolerance : relative lcoe difference below which a rectangle is interpolated
+        coarse_step : number of steps between the cells solved first
+
+        Returns the number of cells solved
+        """
+        cell_at = {index: cell for cell, index in self.cells.items()}
+        solved = ~np.isnan(self.table[0])
+        accepted = []
+        n_solved = 0
+
+        def value(t, i, j):
+            nonlocal n_solved
+            if not solved[t, i, j]:
+                cell = cell_at[t, i, j]
+                self.add(cell, solve(*cell))
+                solved[t, i, j] = True
+                n_solved += 1
+            return self.table[:, t, i, j]
+
+        def refine(t, i0, i1, j0, j1):
+            corners = [value(t, i, j) for i in (i0, i1) for j in (j0, j1)]
+            if i1 - i0 <= 1 and j1 - j0 <= 1:
+                return
+
+            im, jm = (i0 + i1) // 2, (j0 + j1) // 2
+            middle = value(t, im, jm)
+            wi = (im - i0) / (i1 - i0) if i1 > i0 else 0
+            wj = (jm - j0) / (j1 - j0) if j1 > j0 else 0
+            interpolated = (1 - wi) * (1 - wj) * corners[0] + (1 - wi) * wj * corners[1] + \
+                wi * (1 - wj) * corners[2] + wi * wj * corners[3]
+
+            feasible = [c[0] < 99 for c in corners + [middle]]
+            if all(feasible) and abs(middle[0] - interpolated[0]) <= tolerance * middle[0] or not any(feasible):
+                accepted.append((t, i0, i1, j0, j1))
+                return
+
+            for a, b in ([(i0, im), (im, i1)] if i1 - i0 > 1 else [(i0, i1)]):
+                for c, d in ([(j0, jm), (jm, j1)] if j1 - j0 > 1 else [(j0, j1)]):
+                    refine(t, a, b, c, d)
+
+        def coarse(n):
+            return sorted(set(range(0, n, coarse_step)) | {n - 1})
+
+        _, n_tiers, n_resource, n_diesel = self.table.shape
+        resource_steps, diesel_steps = coarse(n_resource), coarse(n_diesel)
+        for t in range(n_tiers):
+            for i0, i1 in zip(resource_steps, resource_steps[1:] or resource_steps):
+                for j0, j1 in zip(diesel_steps, diesel_steps[1:] or diesel_steps):
+                    refine(t, i0, i1, j0, j1)
+
+        # The smallest rectangles are interpolated first, so that a cell on the edge of rectangles of different sizes is
+        # interpolated from the closest solved cells
+        accepted.sort(key=lambda r: (r[2] - r[1]) * (r[4] - r[3]))
+        for t, i0, i1, j0, j1 in accepted:
+            corners = [self.table[:, t, i, j] for i in (i0, i1) for j in (j0, j1)]
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    if np.isnan(self.table[0, t, i, j]):
+                        wi = (i - i0) / (i1 - i0) if i1 > i0 else 0
+                        wj = (j - j0) / (j1 - j0) if j1 > j0 else 0
+                        self.add(cell_at[t, i, j], (1 - wi) * (1 - wj) * corners[0] + (1 - wi) * wj * corners[1] +
+                                 wi * (1 - wj) * corners[2] + wi * wj * corners[3])
+
+        return n_solved
+
+
+class HybridLookupTableCache(HybridLookupTable):
+    """
+    A HybridLookupTable stored on disk, in an npz file named after the lookup_table_key of its inputs.
+
+    The table is saved every checkpoint_interval seconds while it is built, so that an interrupted run resumes from the
+    cells already solved.
+    """
+
+    def __init__(self, folder, resource_path, tiers, resource_range, diesel_range, checkpoint_interval=60., **inputs):
+        super().__init__(tiers, resource_range, diesel_range)
+        key = lookup_table_key(resource_path, tiers=list(tiers), resource_range=resource_range,
+                               diesel_range=diesel_range, **inputs)
+        self.path = os.path.join(folder, 'hybrid_lookup_table_{}.npz'.format(key))
+        self.checkpoint_interval = checkpoint_interval
+
+        if os.path.exists(self.path):
+            with np.load(self.path) as data:
+                self.table = data['table']
+        self.last_saved = time.time()
+
+    def add(self, cell, result):
+        super().add(cell, result)
+        if time.time() - self.last_saved > self.checkpoint_interval:
+            self.save()
+
+    def save(self):
+        # Written to a temporary file first, so that an interruption never leaves a truncated table behind
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary_path = self.path[:-4] + '.tmp.npz'
+        np.savez_compressed(temporary_path, table=self.table)
+        os.replace(temporary_path, self.path)
+        self.last_saved = time.time()
+
+
+class HybridSurrogate:
+    """
+    Surrogate model of the least-cost hybrid mini-grid over continuous inputs: the resource level, the diesel price and
+    any numeric specification such as pv_cost or battery_cost. For each tier, radial basis function interpolants of the
+    lcoe, investment, capacity and fuel cost are fitted to optimized samples spread over the inputs by Latin hypercube
+    sampling, together with an interpolant of the feasibility of the samples.
+
+    The inputs are scaled to their bounds, and clipped to these when predicting. The study period is fixed when the
+    model is trained, as are the specifications that are not inputs.
+    """
+
+    def __init__(self, bounds, start_year, end_year, tiers=(1, 2, 3, 4, 5), kernel='thin_plate_spline', smoothing=0.):
+        """
+        Arguments
+        ---------
+        bounds : dict of (low, high) of each input, which must include 'resource' (annual GHI in kWh/m2 or average wind
+            speed in m/s) and 'diesel_price'. The other inputs are keys of the specifications
+        start_year, end_year : study period of the samples
+        """
+        if 'resource' not in bounds or 'diesel_price' not in bounds:
+            raise ValueError("The bounds must include 'resource' and 'diesel_price'")
+
+        self.names = list(bounds)
+        self.low = np.array([bounds[name][0] for name in self.names], dtype=float)
+        self.high = np.array([bounds[name][1] for name in self.names], dtype=float)
+        self.start_year = start_year
+        self.end_year = end_year
+        self.tiers = list(tiers)
+        self.kernel = kernel
+        self.smoothing = smoothing
+        self.samples = {}
+        self.models = {}
+        self.cv_error = {}
+
+    def scale(self, x):
+        return (np.clip(x, self.low, self.high) - self.low) / np.where(self.high > self.low, self.high - self.low, 1)
+
+    def interpolants(self, x, y):
+        feasible = y[:, 0] < 99
+        return (RBFInterpolator(self.scale(x[feasible]), y[feasible], kernel=self.kernel, smoothing=self.smoothing),
+                RBFInterpolator(self.scale(x), feasible.astype(float), kernel=self.kernel, smoothing=self.smoothing))
+
+    def fit(self, solve, n_samples=200, seed=0, n_folds=5):
+        """
+        Optimizes n_samples samples for each tier with solve(tier, resource, diesel_price, **inputs), which returns the
+        (lcoe, investment, capacity, fuel cost) of the least-cost mini-grid, and fits the interpolants to them
+        """
+        sampler = qmc.LatinHypercube(d=len(self.names), seed=seed)
+        for tier in self.tiers:
+            x = qmc.scale(sampler.random(n_samples), self.low, self.high)
+            y = np.array([solve(tier, **dict(zip(self.names, sample))) for sample in x], dtype=float)
+            self.samples[tier] = x, y
+            logging.info('Hybrid surrogate: {} samples of tier {} optimized'.format(n_samples, tier))
+
+        self.fit_samples(n_folds, seed)
+
+    def fit_samples(self, n_folds=5, seed=0):
+        """
+        Fits the interpolants to the samples, after estimating their error by n_folds-fold cross-validation. The
+        cv_error of each tier has the mean and maximum relative lcoe error of the feasible samples predicted as
+        feasible, and the share of samples with a wrongly predicted feasibility
+        """
+        rng = np.random.default_rng(seed)
+        for tier, (x, y) in self.samples.items():
+            if n_folds > 1:
+                folds = rng.permutation(len(x)) % n_folds
+                predicted = np.empty_like(y)
+                for fold in range(n_folds):
+                    test = folds == fold
+                    model, feasibility = self.interpolants(x[~test], y[~test])
+                    scaled = self.scale(x[test])
+                    predicted[test] = model(scaled)
+                    predicted[test, 0] = np.where(feasibility(scaled) < 0.5, 99, predicted[test, 0])
+
+                feasible, predicted_feasible = y[:, 0] < 99, predicted[:, 0] < 99
+                both = feasible & predicted_feasible
+                error = np.abs(predicted[both, 0] - y[both, 0]) / y[both, 0]
+                self.cv_error[tier] = {'lcoe_mean': error.mean() if both.any() else np.nan,
+                                       'lcoe_max': error.max() if both.any() else np.nan,
+                                       'misclassified': np.mean(feasible != predicted_feasible)}
+                logging.info('Hybrid surrogate tier {}: cross-validated lcoe error {:.1%} mean, {:.1%} max, '
+                             '{:.1%} of feasibility misclassified'.format(tier, *self.cv_error[tier].values()))
+
+            self.models[tier] = self.interpolants(x, y)
+
+    def predict(self, tier, resource, diesel_price, **inputs):
+        """
+        Returns the (lcoe, investment, capacity, fuel cost) of many settlements at once, as an array of shape (4, n),
+        with the values of a 10000 kWh/year mini-grid. All arguments are scalars or arrays of the same length, inputs
+        that are not part of the model are ignored (so the specifications can be passed as they are)
+        """
+        values = dict(inputs, resource=resource, diesel_price=diesel_price)
+        missing = [name for name in self.names if name not in values]
+        if missing:
+            raise ValueError('Missing inputs of the hybrid surrogate: {}'.format(', '.join(missing)))
+
+        shape = np.broadcast(tier, *[values[name] for name in self.names]).shape
+        tier = np.broadcast_to(tier, shape).ravel()
+        x = np.column_stack([np.broadcast_to(np.asarray(values[name], dtype=float), shape).ravel()
+                             for name in self.names])
+
+        result = np.zeros((4, len(tier)))
+        result[0] = 99
+        for t in np.unique(tier):
+            if t not in self.models:
+                raise ValueError('The hybrid surrogate was not trained for tier {}'.format(t))
+            index = np.flatnonzero(tier == t)
+            model, feasibility = self.models[t]
+            scaled = self.scale(x[index])
+            feasible = feasibility(scaled) >= 0.5
+            result[:, index[feasible]] = model(scaled[feasible]).T
+        return result
+
+    def save(self, path):
+        arrays = {'names': self.names, 'low': self.low, 'high': self.high, 'tiers': self.tiers,
+                  'years': [self.start_year, self.end_year], 'kernel': self.kernel, 'smoothing': self.smoothing}
+        for tier, (x, y) in self.samples.items():
+            arrays['x_{}'.format(tier)] = x
+            arrays['y_{}'.format(tier)] = y
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads the samples saved with save and fits the interpolants to them again
+        """
+        with np.load(path) as data:
+            bounds = {str(name): (low, high) for name, low, high in zip(data['names'], data['low'], data['high'])}
+            start_year, end_year = data['years']
+            surrogate = cls(bounds, int(start_year), int(end_year), data['tiers'].tolist(), str(data['kernel']),
+                            float(data['smoothing']))
+            for tier in surrogate.tiers:
+                surrogate.samples[tier] = data['x_{}'.format(tier)], data['y_{}'.format(tier)]
+        surrogate.fit_samples(n_folds=0)
+        return surrogate
+
+
+class ResourceLibrary:
+    """
+    Hourly GHI (W/m2) and temperature (C) profiles of many sites, stored in a folder as arrays of shape (sites, hours)
+    (ghi.npy and temp.npy) with the longitude and latitude of each site (sites.npy). The profiles are memory-mapped, so
+    that only the ones used are read from disk, and the memory used does not grow with the number of sites.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.ghi = np.load(os.path.join(folder, 'ghi.npy'), mmap_mode='r')
+        self.temp = np.load(os.path.join(folder, 'temp.npy'), mmap_mode='r')
+        self.sites = np.load(os.path.join(folder, 'sites.npy'))
+        self.tree = scipy.spatial.cKDTree(self.unit_vectors(self.sites[:, 0], self.sites[:, 1]))
+
+    def __len__(self):
+        return len(self.sites)
+
+    @staticmethod
+    def unit_vectors(lon, lat):
+        # The sites are compared on the unit sphere, so that the nearest site is found across the poles and the
+        # antimeridian too
+        lon, lat = np.radians(lon), np.radians(lat)
+        return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+    def nearest(self, lon, lat):
+        """
+        Returns the index of the nearest site of each point (degrees)
+        """
+        return self.tree.query(self.unit_vectors(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)))[1]
+
+    def profile(self, site):
+        """
+        Returns the (ghi_curve, temp) of a site as (hours, 1) views of the memory-mapped arrays, the same shape as from
+        read_environmental_data
+        """
+        return self.ghi[site].reshape(-1, 1), self.temp[site].reshape(-1, 1)
+
+    @classmethod
+    def create(cls, folder, sites, read_profile, hours=8760, dtype=np.float64):
+        """
+        Writes a library with the sites given as an array of (longitude, latitude), one site at a time so that the
+        profiles never all need to be in memory. read_profile(i) returns the (ghi_curve, temp) of site i, for example
+        read with read_environmental_data
+        """
+        os.makedirs(folder, exist_ok=True)
+        sites_path = os.path.join(folder, 'sites.npy')
+        if os.path.exists(sites_path):
+            os.remove(sites_path)
+        sites = np.asarray(sites, dtype=float)
+
+        # The profiles are appended to the .npy files after their header, rather than through a memory map, which
+        # would keep all the written pages in memory
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False,
+                  'shape': (len(sites), hours)}
+        with open(os.path.join(folder, 'ghi.npy'), 'wb') as ghi, open(os.path.join(folder, 'temp.npy'), 'wb') as temp:
+            for f in (ghi, temp):
+                np.lib.format.write_array_header_1_0(f, header)
+            for i in range(len(sites)):
+                for f, curve in zip((ghi, temp), read_profile(i)):
+                    curve = np.ravel(curve).astype(dtype)
+                    if len(curve) != hours:
+                        raise ValueError('The profile of site {} has {} hours instead of {}'.format(
+                            i, len(curve), hours))
+                    f.write(curve.tobytes())
+
+        # The sites are written last, so that an interrupted library is never loaded
+        np.save(sites_path, sites)
+        return cls(folder)
+
+
 @numba.njit
 def pv_generation(temp, ghi, pv_capacity, load, inv_eff):
-    # Calculation of PV gen and net load
-    temp = temp[:,0]
-    ghi = ghi[:,0]
+    # Calculation of PV gen and net load, hour by hour. The results are stored with the same precision as the load
+    # curve (float32 or float64), while the calculations are done in double precision
     k_t = 0.005  # temperature factor of PV panels
-    t_cell = temp + 0.0256 * ghi  # PV cell temperature
-    pv_gen = pv_capacity * 0.9 * ghi / 1000 * (1 - k_t * (t_cell - 25))  # PV generation in the hour
-    net_load = load - pv_gen * inv_eff  # remaining load not met by PV panels
+    net_load = np.empty_like(load)
+    pv_gen = np.empty_like(load)
+    for i in range(len(load)):
+        t_cell = temp[i, 0] + 0.0256 * ghi[i, 0]  # PV cell temperature
+        pv_gen[i] = pv_capacity * 0.9 * ghi[i, 0] / 1000 * (1 - k_t * (t_cell - 25))  # PV generation in the hour
+        net_load[i] = load[i] - pv_gen[i] * inv_eff  # remaining load not met by PV panels
     return net_load, pv_gen
 
 @numba.njit
 def year_simulation(battery_size, diesel_capacity, net_load, hour_numbers, inv_eff, n_dis, n_chg,
-                    annual_demand, full_life_cycles, dod_max):
+                    annual_demand, full_life_cycles, dod_max, trace=False, lpsp_max=np.inf,
+                    diesel_limit=np.inf, hour_weights=None):
     soc = 0.5  # Initial SOC of battery
 
     # Variables for tracking annual performance information
@@ -90,24 +988,43 @@ def year_simulation(battery_size, diesel_capacity, net_load, hour_numbers, inv_e
     annual_battery_use = 0
     annual_fuel_consumption = 0
 
-    # Arrays for tracking hourly values throughout the year (for plotting purposes)
-    diesel_gen_curve = []
-    battery_soc_curve = []
+    # Arrays for tracking hourly values throughout the year (for plotting purposes). These are only filled if a trace
+    # is requested, otherwise they are left empty so that optimizer evaluations do not allocate per-hour memory
+    n_hours = len(hour_numbers) if trace else 0
+    diesel_gen_curve = np.empty(n_hours, dtype=net_load.dtype)
+    battery_soc_curve = np.empty(n_hours, dtype=net_load.dtype)
 
     # Run the simulation for each hour during one year
-    for hour in hour_numbers:
-        load = net_load[int(hour)]
-
-        diesel_gen, annual_fuel_consumption, annual_diesel_gen, annual_battery_use, soc, annual_unmet_demand, \
-            annual_excess_gen = hour_simulation(hour, soc, load, diesel_capacity, annual_fuel_consumption,
-                                                annual_diesel_gen,
-                                                inv_eff, n_dis, n_chg, battery_size, annual_battery_use,
-                                                annual_unmet_demand,
-                                                annual_excess_gen)
+    for i in range(len(hour_numbers)):
+        hour = hour_numbers[i]
+        load = net_load[i]
+
+        # When simulating a reduced set of representative hours, each hour counts for the number of hours it represents
+        if hour_weights is None:
+            weight = 1.
+        else:
+            weight = hour_weights[i]
+
+        diesel_gen, fuel_consumption, diesel_gen_sum, battery_use, soc, unmet_demand, \
+            excess_gen = hour_simulation(hour, soc, load, diesel_capacity, 0., 0., inv_eff, n_dis, n_chg, battery_size,
+                                         0., 0., 0.)
+
+        annual_fuel_consumption += weight * fuel_consumption
+        annual_diesel_gen += weight * diesel_gen_sum
+        annual_battery_use += weight * battery_use
+        annual_unmet_demand += weight * unmet_demand
+        annual_excess_gen += weight * excess_gen
 
         # Update plotting arrays
-        diesel_gen_curve.append(diesel_gen)
-        battery_soc_curve.append(soc)
+        if trace:
+            diesel_gen_curve[i] = diesel_gen
+            battery_soc_curve[i] = soc
+
+        # The unmet demand and diesel generation can only grow during the year, so once either share exceeds its limit
+        # the configuration is known to be infeasible and the rest of the year does not need to be simulated.
+        # The limits are infinite by default, i.e. the full year is always simulated unless pruning is requested
+        if (annual_unmet_demand / annual_demand > lpsp_max) or (annual_diesel_gen / annual_demand > diesel_limit):
+            break
 
     # When a full year has been simulated, calculate battery life and performance metrics
     if (battery_size > 0) & (annual_battery_use > 0):
@@ -302,7 +1219,78 @@ def calculate_hybrid_lcoe(diesel_price, end_year, start_year, annual_demand,
 
 
 @numba.njit
-def calc_load_curve(tier, annual_demand):
+def hybrid_lcoe_factors(end_year, start_year, discount_rate, max_life=25):
+    # The discounting in the LCOE calculation only depends on the project years and the discount rate, so it is
+    # calculated once per optimization instead of for every configuration evaluated by the optimizer.
+    # For a component with a lifetime of n years, life_factors[n] holds the discounted sum of all (re)investments,
+    # the number of (re)investments, and the share of the last investment that is salvaged at the end of the project
+    project_life = end_year - start_year
+    discount_factor = (1 + discount_rate) ** np.arange(project_life + 1)
+
+    annual_factor = 0.  # Fuel and OM costs incur every year, including the first
+    generation_factor = 0.  # In first year, there is assumed to be no generation
+    for year in range(project_life + 1):
+        annual_factor += 1 / discount_factor[year]
+        if year > 0:
+            generation_factor += 1 / discount_factor[year]
+
+    salvage_factor = 1 / discount_factor[project_life]  # Salvage value is accounted for in the final year
+
+    life_factors = np.zeros((max_life + 1, 3))
+    for life in range(1, max_life + 1):
+        for year in range(0, project_life + 1, life):
+            life_factors[life, 0] += 1 / discount_factor[year]
+            life_factors[life, 1] += 1
+        life_factors[life, 2] = 1 - (project_life % life) / life
+
+    return annual_factor, generation_factor, salvage_factor, life_factors
+
+
+@numba.njit
+def calculate_hybrid_lcoe_annuity(diesel_price, annual_demand, fuel_usage, pv_panel_size, pv_cost, pv_life, pv_om,
+                                  charge_controller, pv_inverter_cost, diesel_capacity, diesel_cost, diesel_om,
+                                  diesel_life, battery_size, battery_cost, battery_life, battery_inverter_cost,
+                                  battery_inverter_life, peak_load, lcoe_factors):
+    # Same results as calculate_hybrid_lcoe, but using the discount factors and replacement schedule precomputed in
+    # hybrid_lcoe_factors and the peak load of the load curve, instead of stepping through each year of the project
+    annual_factor, generation_factor, salvage_factor, life_factors = lcoe_factors
+
+    fuel_costs = fuel_usage * diesel_price
+    om_costs = (pv_panel_size * (pv_cost + charge_controller) * pv_om + diesel_capacity * diesel_cost * diesel_om)
+
+    # Cost of each component every time it is bought, and the lifetime factors of that component
+    inverter_unit_cost = peak_load * battery_inverter_cost  # Battery inverter, sized based on the peak demand
+    diesel_unit_cost = diesel_capacity * diesel_cost
+    pv_unit_cost = pv_panel_size * (pv_cost + charge_controller + pv_inverter_cost)
+    battery_unit_cost = battery_size * battery_cost
+
+    inverter_factors = life_factors[int(battery_inverter_life)]
+    diesel_factors = life_factors[int(diesel_life)]
+    pv_factors = life_factors[int(pv_life)]
+    battery_factors = life_factors[int(battery_life)]
+
+    discounted_investment = inverter_unit_cost * inverter_factors[0] + diesel_unit_cost * diesel_factors[0] + \
+        pv_unit_cost * pv_factors[0] + battery_unit_cost * battery_factors[0]
+
+    salvage = inverter_unit_cost * inverter_factors[2] + diesel_unit_cost * diesel_factors[2] + \
+        pv_unit_cost * pv_factors[2] + battery_unit_cost * battery_factors[2]
+
+    investment = inverter_unit_cost * inverter_factors[1] + diesel_unit_cost * diesel_factors[1] + \
+        pv_unit_cost * pv_factors[1] + battery_unit_cost * battery_factors[1] - salvage
+    total_battery_investment = battery_unit_cost * (battery_factors[1] - battery_factors[2])
+
+    total_fuel_cost = fuel_costs * annual_factor
+    total_om_cost = om_costs * annual_factor
+
+    npc = total_fuel_cost + total_om_cost + discounted_investment
+    sum_costs = npc - salvage * salvage_factor
+    sum_el_gen = annual_demand * generation_factor
+
+    return sum_costs / sum_el_gen, investment, total_battery_investment, total_fuel_cost, total_om_cost, npc
+
+
+@numba.njit
+def calc_load_curve(tier, annual_demand, dtype=np.float64):
     # the values below define the load curve for the five tiers. The values reflect the share of the daily demand
     # expected in each hour of the day (sum of all values for one tier = 1)
     tier5_load_curve = [0.021008403, 0.021008403, 0.021008403, 0.021008403, 0.027310924, 0.037815126,
@@ -337,74 +1325,314 @@ def calc_load_curve(tier, annual_demand):
     else:
         load_curve = tier5_load_curve * 365
 
-    return np.array(load_curve) * annual_demand / 365
+    return (np.array(load_curve) * annual_demand / 365).astype(dtype)
 
 
-def get_pv_data(latitude, longitude, token, output_folder):
-    # This function can be used to retrieve solar resource data from https://renewables.ninja
-    api_base = 'https://www.renewables.ninja/api/'
-    s = requests.session()
-    # Send token header with each request
-    s.headers = {'Authorization': 'Token ' + token}
-
-    out_path = os.path.join(output_folder, 'pv_data_lat_{}_long_{}.csv'.format(latitude, longitude))
-
-    url = api_base + 'data/pv'
-
-    args = {
-        'lat': latitude,
-        'lon': longitude,
-        'date_from': '2020-01-01',
-        'date_to': '2020-12-31',
-        'dataset': 'merra2',
-        'capacity': 1.0,
-        'system_loss': 0.1,
-        'tracking': 0,
-        'tilt': 35,
-        'azim': 180,
-        'format': 'json',
-        'local_time': True,
-        'raw': True
-    }
+def select_typical_days(curves, n_days=12, seed=1):
+    """
+    Clusters the 365 days of the year into n_days groups of similar days based on the given hourly curves (e.g. GHI,
+    temperature and load), and picks the day closest to the centre of each group as its representative.
 
-    if token != '':
+    Returns the indices of the representative hours (in chronological order) and the number of hours of the year each
+    of them represents, which can be passed as hour_weights to the hourly simulation.
+    """
+    # Each day is described by its 24 hourly values of every curve, scaled so that all curves weigh equally
+    features = []
+    for curve in curves:
+        daily = np.asarray(curve, dtype=float).reshape(365, 24)
+        scale = daily.std()
+        features.append(daily / scale if scale > 0 else daily)
+    features = np.hstack(features)
+
+    n_days = min(n_days, 365)
+    centroids, labels = kmeans2(features, n_days, minit='++', seed=seed)
+
+    days = []
+    weights = []
+    for cluster in range(n_days):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        distance = ((features[members] - centroids[cluster]) ** 2).sum(axis=1)
+        days.append(members[np.argmin(distance)])
+        weights.append(len(members))
+
+    order = np.argsort(days)
+    days = np.array(days)[order]
+    weights = np.array(weights, dtype=float)[order]
+
+    hours = (days[:, None] * 24 + np.arange(24)).ravel()
+    hour_weights = np.repeat(weights, 24)
+
+    return hours, hour_weights
+
+
+def warm_start_population(seeds, min_bounds, max_bounds, n_members=30, spread=0.1, seed=0):
+    """
+    Creates an initial optimizer population around known good configurations, e.g. the optima of neighbouring lookup
+    table cells. The seeds themselves are kept, and the rest of the population is drawn from a normal distribution
+    around them, with a standard deviation of spread times the width of the bounds.
+    """
+    rng = np.random.default_rng(seed)
+    seeds = np.clip(np.atleast_2d(np.asarray(seeds, dtype=float)), min_bounds, max_bounds)
+    n_members = max(n_members, len(seeds), 5)
 
-        try:
-            r = s.get(url, params=args)
+    population = seeds[rng.integers(len(seeds), size=n_members)]
+    population = population + rng.normal(0, spread, population.shape) * (max_bounds - min_bounds)
+    population[:len(seeds)] = seeds
 
-            # Parse JSON to get a pandas.DataFrame of data and dict of metadata
-            parsed_response = json.loads(r.text)
+    return np.clip(population, min_bounds, max_bounds)
 
-        except json.decoder.JSONDecodeError:
-            print('API maximum hourly requests reached, waiting one hour', time.ctime())
-            time.sleep(3700)
-            print('Wait over, resuming API requests', time.ctime())
-            r = s.get(url, params=args)
 
-            # Parse JSON to get a pandas.DataFrame of data and dict of metadata
-            parsed_response = json.loads(r.text)
+class TokenBucket:
+    """
+    Rate limit of rate requests every per seconds, shared by threads. Up to burst requests can be made at once, after
+    which they are spread evenly.
+    """
+
+    def __init__(self, rate, per=3600., burst=1):
+        self.fill_rate = rate / per
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a request may be made
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Holds back all requests for the given time, e.g. when the server reports that the limit was reached
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.fill_rate
+
+
+class ResourceDownloader:
+    """
+    Downloads hourly solar resource data (GHI in W/m2 and temperature in C) from https://renewables.ninja for many
+    locations at once. The requests are made by a pool of threads, within a token bucket rate limit, and each
+    response is kept in a cache folder under a hash of the location and request parameters, so that a location is
+    only downloaded once.
+    """
 
-        data = pd.read_json(StringIO(json.dumps(parsed_response['data'])), orient='index')
+    def __init__(self, token, cache_folder, rate=50, per=3600., burst=1, max_workers=4, retries=5, timeout=60.,
+                 api_base='https://www.renewables.ninja/api/', **parameters):
+        """
+        Arguments
+        ---------
+        token : API token of renewables.ninja
+        rate, per, burst : at most rate requests every per seconds, with up to burst requests at once
+        max_workers : number of requests made at the same time
+        retries : number of times a request is repeated after an error, or after the rate limit was reached
+        timeout : seconds to wait for the server to respond before the request is repeated
+        parameters : request parameters other than the location, replacing the defaults
+        """
+        self.token = token
+        self.cache_folder = cache_folder
+        self.bucket = TokenBucket(rate, per, burst)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.timeout = timeout
+        self.url = api_base + 'data/pv'
+        self.parameters = dict({'date_from': '2020-01-01', 'date_to': '2020-12-31', 'dataset': 'merra2',
+                                'capacity': 1.0, 'system_loss': 0.1, 'tracking': 0, 'tilt': 35, 'azim': 180,
+                                'format': 'json', 'local_time': True, 'raw': True}, **parameters)
+        self.sessions = threading.local()
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def cache_path(self, latitude, longitude):
+        key = json.dumps(dict(self.parameters, lat=latitude, lon=longitude, url=self.url), sort_keys=True)
+        return os.path.join(self.cache_folder, 'pv_{}.npz'.format(hashlib.sha256(key.encode()).hexdigest()[:20]))
+
+    def request(self, latitude, longitude):
+        if not hasattr(self.sessions, 'session'):
+            # requests sessions are not thread-safe, so each thread has its own
+            self.sessions.session = requests.session()
+            self.sessions.session.headers = {'Authorization': 'Token ' + self.token}
+
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                r = self.sessions.session.get(self.url, params=dict(self.parameters, lat=latitude, lon=longitude),
+                                              timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                time.sleep(2 ** attempt)
+                continue
+
+            if r.status_code == 429:
+                # The limit of the server was reached, all requests wait for the time it asks for, if given
+                retry_after = r.headers.get('Retry-After')
+                wait = float(retry_after) if retry_after else 1 / self.bucket.fill_rate
+                logging.info('API request limit reached, waiting {:.0f} s'.format(wait))
+                self.bucket.pause(wait)
+            elif r.status_code >= 500:
+                time.sleep(2 ** attempt)
+            else:
+                r.raise_for_status()
+                try:
+                    return r.json()
+                except ValueError:
+                    # A response that is not JSON is also a sign that the limit was reached
+                    self.bucket.pause(1 / self.bucket.fill_rate)
+
+        raise IOError('Could not download the resource data of {}, {} after {} attempts'.format(
+            latitude, longitude, self.retries + 1))
+
+    def fetch(self, latitude, longitude):
+        """
+        Downloads the hourly (ghi, temp) of a location unless it is in the cache, and returns the path of its cache file
+        """
+        path = self.cache_path(latitude, longitude)
+        if not os.path.exists(path):
+            hours = list(self.request(latitude, longitude)['data'].values())
+            ghi = np.array([h['irradiance_direct'] + h['irradiance_diffuse'] for h in hours]) * 1000
+            temp = np.array([h['temperature'] for h in hours], dtype=float)
+            local_time = np.array([str(h['local_time']) for h in hours])
+
+            # Written to a temporary file of its own first, so that an interruption never leaves a truncated file
+            # behind, and that threads writing the same location do not write to the same file
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp.npz', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, ghi=ghi, temp=temp, time=local_time)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return path
+
+    def profile(self, latitude, longitude):
+        """
+        Returns the hourly (ghi, temp) of a location
+        """
+        with np.load(self.fetch(latitude, longitude)) as data:
+            return data['ghi'], data['temp']
+
+    def download(self, latitudes, longitudes):
+        """
+        Downloads the locations that are not in the cache yet, at the same time, and returns their cache files
+        """
+        # Each location is downloaded once, even if it is given several times
+        locations = list(dict.fromkeys(zip(latitudes, longitudes)))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            paths = dict(zip(locations, executor.map(lambda location: self.fetch(*location), locations)))
+        return [paths[location] for location in zip(latitudes, longitudes)]
+
+    def download_library(self, latitudes, longitudes, folder, dtype=np.float64):
+        """
+        Downloads the locations and stores them in a ResourceLibrary in folder
+        """
+        paths = self.download(latitudes, longitudes)
+
+        def read_profile(i):
+            with np.load(paths[i]) as data:
+                return data['ghi'], data['temp']
+
+        sites = np.column_stack([longitudes, latitudes])
+        return ResourceLibrary.create(folder, sites, read_profile, len(read_profile(0)[0]), dtype)
 
-        df_out = pd.DataFrame(columns=['time', 'ghi', 'temp'])
-        df_out['ghi'] = (data['irradiance_direct'] + data['irradiance_diffuse']) * 1000
-        df_out['temp'] = data['temperature']
-        df_out['time'] = data['local_time']
 
+def get_pv_data(latitude, longitude, token, output_folder):
+    # This function can be used to retrieve solar resource data from https://renewables.ninja
+    if token != '':
+        with np.load(ResourceDownloader(token, output_folder).fetch(latitude, longitude)) as data:
+            df_out = pd.DataFrame({'time': data['time'], 'ghi': data['ghi'], 'temp': data['temp']})
+
+        out_path = os.path.join(output_folder, 'pv_data_lat_{}_long_{}.csv'.format(latitude, longitude))
         df_out.to_csv(out_path, index=False)
     else:
         print('No token provided')
 
 
-def read_environmental_data(path, skiprows=341882, ghi_col=3, temp_col=2):
+def read_resource_columns(path, columns, skiprows=0, dtype=np.float64, cache=True):
+    """
+    Reads columns of an hourly resource csv-file, as one contiguous array of shape (hours, 1) per column.
+
+    With cache, the columns are parsed once into an .npy file next to the csv-file, named after the columns, rows and
+    dtype read, and memory-mapped on the following reads. The .npy file is used as long as the size and modification
+    time of the csv-file are the same as when it was written, or else its contents, compared by hash.
+
+    Each column can only be requested once, as the columns are read by pd.read_csv, which reads every column once.
+    """
+    if len(set(columns)) != len(columns):
+        raise ValueError('The columns {} of {} are not all different'.format(list(columns), path))
+
+    def parse():
+        data = pd.read_csv(path, usecols=columns, skiprows=skiprows)
+        # read_csv returns the columns in the order of the file
+        order = sorted(columns)
+        return np.stack([data.values[:, order.index(c)] for c in columns]).astype(dtype)
+
+    if not cache:
+        return [column.reshape(-1, 1) for column in parse()]
+
+    key = hashlib.sha256(json.dumps([list(columns), skiprows, np.dtype(dtype).name]).encode()).hexdigest()[:12]
+    cache_path = '{}.{}.npy'.format(path, key)
+    meta_path = '{}.{}.json'.format(path, key)
+    stat = os.stat(path)
+    meta = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def write_meta():
+        # Written to a temporary file first, so that an interruption never leaves a truncated file behind
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    data = None
+    try:
+        cached = None
+        if os.path.exists(cache_path) and os.path.exists(meta_path):
+            try:
+                with open(meta_path) as f:
+                    cached = json.load(f)
+                cached = (cached['size'], cached['mtime_ns']), cached['sha256']
+            except (KeyError, TypeError, ValueError):
+                # A truncated or outdated meta file, the cache is written again
+                cached = None
+
+        if cached is not None:
+            if cached[0] == (meta['size'], meta['mtime_ns']):
+                return [column.reshape(-1, 1) for column in np.load(cache_path, mmap_mode='r')]
+
+            meta['sha256'] = file_hash(path)
+            if cached[1] == meta['sha256']:
+                write_meta()
+                return [column.reshape(-1, 1) for column in np.load(cache_path, mmap_mode='r')]
+
+        data = parse()
+        meta['sha256'] = meta.get('sha256') or file_hash(path)
+        np.save(cache_path + '.tmp.npy', data)
+        os.replace(cache_path + '.tmp.npy', cache_path)
+        write_meta()
+    except OSError:
+        logging.warning('Could not use the resource cache {}, reading {} without it'.format(cache_path, path))
+        return [column.reshape(-1, 1) for column in (parse() if data is None else data)]
+
+    return [column.reshape(-1, 1) for column in np.load(cache_path, mmap_mode='r')]
+
+
+def read_environmental_data(path, skiprows=341882, ghi_col=3, temp_col=2, dtype=np.float64, cache=True):
     """
     This method reads the solar resource GHI and temperature for each hour during one year from a csv-file.
     The skiprows and skipcolumns define which rows and columns the data should be read from.
+    With dtype=np.float32 the hybrid simulation is run in single precision, halving the memory used for the curves.
+    With cache, the file is only parsed the first time, see read_resource_columns.
     """
     try:
-        #data = pd.read_csv(path, skiprows=skiprows)
-        ghi_curve = pd.read_csv(path, usecols=[ghi_col], skiprows=skiprows).values
-        temp = pd.read_csv(path, usecols=[temp_col], skiprows=skiprows).values
+        ghi_curve, temp = read_resource_columns(path, [ghi_col, temp_col], skiprows, dtype, cache)
 
         return ghi_curve, temp
     except:
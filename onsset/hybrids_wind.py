@@ -8,20 +8,30 @@ import json
 import time
 from io import StringIO
 
+try:
+    from hybrids import read_resource_columns
+except:
+    from onsset.hybrids import read_resource_columns
+
 
 @numba.njit
-def find_least_cost_option_wind(configuration, wind_curve, hour_numbers, load_curve, inv_eff, n_dis,
-                                n_chg, dod_max, diesel_price, end_year, start_year, wind_cost, charge_controller,
-                                wind_om, diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
-                                diesel_life, wind_life, battery_cost, discount_rate, lpsp_max, diesel_limit,
-                                full_life_cycles):
+def find_least_cost_option_wind(configuration, wind_curve, hour_numbers, load_curve, peak_load, inv_eff, n_dis,
+                                n_chg, dod_max, diesel_price, wind_cost, charge_controller, wind_om, diesel_cost,
+                                diesel_om, battery_inverter_life, battery_inverter_cost, diesel_life, wind_life,
+                                battery_cost, lpsp_max, diesel_limit, full_life_cycles, lcoe_factors,
+                                hour_weights=None):
 
     wind = float(configuration[0])
     battery = float(configuration[1])
     usable_battery = battery * dod_max  # ensure the battery never goes below max depth of discharge
     diesel = float(configuration[2])
 
-    annual_demand = load_curve.sum()
+    # The hourly series may be a reduced set of representative hours, in which case they are weighted by the number
+    # of hours of the year they represent
+    if hour_weights is None:
+        annual_demand = load_curve.sum()
+    else:
+        annual_demand = (load_curve * hour_weights).sum()
 
     # First the PV generation and net load (load - pv generation) is calculated for each hour of the year
     net_load, wind_gen = wind_generation(wind_curve, wind, load_curve, inv_eff)
@@ -31,7 +41,8 @@ def find_least_cost_option_wind(configuration, wind_curve, hour_numbers, load_cu
         excess_gen_share, battery_soc_curve, diesel_gen_curve = \
         year_simulation_wind(battery_size=usable_battery, diesel_capacity=diesel, net_load=net_load,
                              hour_numbers=hour_numbers, inv_eff=inv_eff, n_dis=n_dis, n_chg=n_chg,
-                             annual_demand=annual_demand, full_life_cycles=full_life_cycles, dod_max=dod_max)
+                             annual_demand=annual_demand, full_life_cycles=full_life_cycles, dod_max=dod_max,
+                             lpsp_max=lpsp_max, diesel_limit=diesel_limit, hour_weights=hour_weights)
 
     # If the system could meet the demand in a satisfactory manner (i.e. with high enough reliability and low enough
     # share of the generation coming from the diesel generator), then the LCOE is calculated. Else 99 is returned.
@@ -43,47 +54,82 @@ def find_least_cost_option_wind(configuration, wind_curve, hour_numbers, load_cu
         npc = 0
     else:
         lcoe, investment, battery_investment, fuel_cost, \
-            om_cost, npc = calculate_hybrid_lcoe_wind(diesel_price=diesel_price,
-                                                     end_year=end_year,
-                                                     start_year=start_year,
-                                                     annual_demand=annual_demand,
-                                                     fuel_usage=annual_fuel_consumption,
-                                                     wind_size=wind,
-                                                     wind_cost=wind_cost,
-                                                     charge_controller=charge_controller,
-                                                     wind_om=wind_om,
-                                                     diesel_capacity=diesel,
-                                                     diesel_cost=diesel_cost,
-                                                     diesel_om=diesel_om,
-                                                     battery_inverter_cost=battery_inverter_cost,
-                                                     battery_inverter_life=battery_inverter_life,
-                                                     load_curve=load_curve,
-                                                     diesel_life=diesel_life,
-                                                     wind_life=wind_life,
-                                                     battery_life=battery_life,
-                                                     battery_size=battery,
-                                                     battery_cost=battery_cost,
-                                                     discount_rate=discount_rate)
+            om_cost, npc = calculate_hybrid_lcoe_wind_annuity(diesel_price=diesel_price,
+                                                              annual_demand=annual_demand,
+                                                              fuel_usage=annual_fuel_consumption,
+                                                              wind_size=wind,
+                                                              wind_cost=wind_cost,
+                                                              charge_controller=charge_controller,
+                                                              wind_om=wind_om,
+                                                              diesel_capacity=diesel,
+                                                              diesel_cost=diesel_cost,
+                                                              diesel_om=diesel_om,
+                                                              battery_inverter_cost=battery_inverter_cost,
+                                                              battery_inverter_life=battery_inverter_life,
+                                                              peak_load=peak_load,
+                                                              diesel_life=diesel_life,
+                                                              wind_life=wind_life,
+                                                              battery_life=battery_life,
+                                                              battery_size=battery,
+                                                              battery_cost=battery_cost,
+                                                              lcoe_factors=lcoe_factors)
 
     return lcoe, unmet_demand_share, diesel_generation_share, investment, fuel_cost, om_cost, battery, battery_life, wind, diesel, npc
 
+
+@numba.njit(parallel=True)
+def find_least_cost_option_wind_batch(configurations, wind_curve, hour_numbers, load_curve, peak_load, inv_eff, n_dis,
+                                      n_chg, dod_max, diesel_price, wind_cost, charge_controller, wind_om,
+                                      diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
+                                      diesel_life, wind_life, battery_cost, lpsp_max, diesel_limit, full_life_cycles,
+                                      lcoe_factors, hour_weights=None):
+    # Evaluates the LCOE of a whole population of (wind, battery, diesel) configurations (one per row) in one call,
+    # with the candidates spread over all available cores. Used as the vectorized objective of the optimizer
+    n_candidates = configurations.shape[0]
+    lcoe = np.empty(n_candidates)
+
+    for i in prange(n_candidates):
+        lcoe[i] = find_least_cost_option_wind(configurations[i], wind_curve, hour_numbers, load_curve, peak_load,
+                                              inv_eff, n_dis, n_chg, dod_max, diesel_price, wind_cost,
+                                              charge_controller, wind_om, diesel_cost, diesel_om,
+                                              battery_inverter_life, battery_inverter_cost, diesel_life, wind_life,
+                                              battery_cost, lpsp_max, diesel_limit, full_life_cycles, lcoe_factors,
+                                              hour_weights)[0]
+
+    return lcoe
+
+
+# Power curve of the reference wind turbine (kW) at each integer wind speed from 0 to 25 m/s, with a rated power of
+# 600 kW. Above 25 m/s the turbine is cut out
+WIND_POWER_CURVE = np.array([0, 0, 0, 0, 30, 77, 135, 208, 287, 371, 450, 514, 558, 582, 594, 598, 600, 600, 600, 600,
+                             600, 600, 600, 600, 600, 600], dtype=np.float64)
+WIND_RATED_POWER = 600.
+
+
 @numba.njit
 def wind_generation(wind_curve, wind, load, inv_eff):
-    # Calculation of Wind gen and net load
-    p_rated = 600
-    p_curve = [0, 0, 0, 0, 30, 77, 135, 208, 287, 371, 450, 514, 558,
-               582, 594, 598, 600, 600, 600, 600, 600, 600, 600, 600, 600]
-    wind_power = np.round(wind_curve)
-    for i in prange(len(p_curve)):
-        wind_power = np.where(wind_power == i, p_curve[i], wind_power)
-    wind_power = wind_curve
-    wind_gen = wind_power * wind / p_rated
-    net_load = load - wind_gen
+    # Calculation of wind gen and net load, hour by hour. The turbine output is interpolated linearly between the
+    # integer wind speeds of the power curve and scaled to the wind capacity of the mini-grid. The results are stored
+    # with the same precision as the load curve (float32 or float64)
+    n_speeds = len(WIND_POWER_CURVE)
+    net_load = np.empty_like(load)
+    wind_gen = np.empty_like(load)
+    for i in range(len(load)):
+        speed = wind_curve[i, 0]
+        if speed <= 0 or speed > n_speeds - 1:
+            power = 0.
+        else:
+            k = min(int(speed), n_speeds - 2)
+            power = WIND_POWER_CURVE[k] + (speed - k) * (WIND_POWER_CURVE[k + 1] - WIND_POWER_CURVE[k])
+        wind_gen[i] = wind * power / WIND_RATED_POWER  # Wind generation in the hour
+        net_load[i] = load[i] - wind_gen[i]  # remaining load not met by the wind turbines
     return net_load, wind_gen
 
+
 @numba.njit
 def year_simulation_wind(battery_size, diesel_capacity, net_load, hour_numbers, inv_eff, n_dis, n_chg,
-                    annual_demand, full_life_cycles, dod_max):
+                    annual_demand, full_life_cycles, dod_max, trace=False, lpsp_max=np.inf,
+                    diesel_limit=np.inf, hour_weights=None):
     soc = 0.5  # Initial SOC of battery
 
     # Variables for tracking annual performance information
@@ -93,26 +139,43 @@ def year_simulation_wind(battery_size, diesel_capacity, net_load, hour_numbers,
     annual_battery_use = 0
     annual_fuel_consumption = 0
 
-    # Arrays for tracking hourly values throughout the year (for plotting purposes)
-    diesel_gen_curve = []
-    battery_soc_curve = []
-
-    net_load = net_load[0]
+    # Arrays for tracking hourly values throughout the year (for plotting purposes). These are only filled if a trace
+    # is requested, otherwise they are left empty so that optimizer evaluations do not allocate per-hour memory
+    n_hours = len(hour_numbers) if trace else 0
+    diesel_gen_curve = np.empty(n_hours, dtype=net_load.dtype)
+    battery_soc_curve = np.empty(n_hours, dtype=net_load.dtype)
 
     # Run the simulation for each hour during one year
-    for hour in hour_numbers:
-        load = net_load[int(hour)]
-
-        diesel_gen, annual_fuel_consumption, annual_diesel_gen, annual_battery_use, soc, annual_unmet_demand, \
-            annual_excess_gen = hour_simulation_wind(hour, soc, load, diesel_capacity, annual_fuel_consumption,
-                                                annual_diesel_gen,
-                                                inv_eff, n_dis, n_chg, battery_size, annual_battery_use,
-                                                annual_unmet_demand,
-                                                annual_excess_gen)
+    for i in range(len(hour_numbers)):
+        hour = hour_numbers[i]
+        load = net_load[i]
+
+        # When simulating a reduced set of representative hours, each hour counts for the number of hours it represents
+        if hour_weights is None:
+            weight = 1.
+        else:
+            weight = hour_weights[i]
+
+        diesel_gen, fuel_consumption, diesel_gen_sum, battery_use, soc, unmet_demand, \
+            excess_gen = hour_simulation_wind(hour, soc, load, diesel_capacity, 0., 0., inv_eff, n_dis, n_chg,
+                                              battery_size, 0., 0., 0.)
+
+        annual_fuel_consumption += weight * fuel_consumption
+        annual_diesel_gen += weight * diesel_gen_sum
+        annual_battery_use += weight * battery_use
+        annual_unmet_demand += weight * unmet_demand
+        annual_excess_gen += weight * excess_gen
 
         # Update plotting arrays
-        diesel_gen_curve.append(diesel_gen)
-        battery_soc_curve.append(soc)
+        if trace:
+            diesel_gen_curve[i] = diesel_gen
+            battery_soc_curve[i] = soc
+
+        # The unmet demand and diesel generation can only grow during the year, so once either share exceeds its limit
+        # the configuration is known to be infeasible and the rest of the year does not need to be simulated.
+        # The limits are infinite by default, i.e. the full year is always simulated unless pruning is requested
+        if (annual_unmet_demand / annual_demand > lpsp_max) or (annual_diesel_gen / annual_demand > diesel_limit):
+            break
 
     # When a full year has been simulated, calculate battery life and performance metrics
     if (battery_size > 0) & (annual_battery_use > 0):
@@ -306,7 +369,50 @@ def calculate_hybrid_lcoe_wind(diesel_price, end_year, start_year, annual_demand
 
 
 @numba.njit
-def calc_load_curve_wind(tier, annual_demand):
+def calculate_hybrid_lcoe_wind_annuity(diesel_price, annual_demand, fuel_usage, wind_size, wind_cost, wind_life,
+                                       wind_om, charge_controller, diesel_capacity, diesel_cost, diesel_om, diesel_life,
+                                       battery_size, battery_cost, battery_life, battery_inverter_cost,
+                                       battery_inverter_life, peak_load, lcoe_factors):
+    # Same results as calculate_hybrid_lcoe_wind, but using the discount factors and replacement schedule precomputed
+    # in hybrid_lcoe_factors and the peak load of the load curve, instead of stepping through each year of the project
+    annual_factor, generation_factor, salvage_factor, life_factors = lcoe_factors
+
+    fuel_costs = fuel_usage * diesel_price
+    om_costs = (wind_size * (wind_cost + charge_controller) * wind_om + diesel_capacity * diesel_cost * diesel_om)
+
+    # Cost of each component every time it is bought, and the lifetime factors of that component
+    inverter_unit_cost = peak_load * battery_inverter_cost  # Battery inverter, sized based on the peak demand
+    diesel_unit_cost = diesel_capacity * diesel_cost
+    wind_unit_cost = wind_size * wind_cost
+    battery_unit_cost = battery_size * battery_cost
+
+    inverter_factors = life_factors[int(battery_inverter_life)]
+    diesel_factors = life_factors[int(diesel_life)]
+    wind_factors = life_factors[int(wind_life)]
+    battery_factors = life_factors[int(battery_life)]
+
+    discounted_investment = inverter_unit_cost * inverter_factors[0] + diesel_unit_cost * diesel_factors[0] + \
+        wind_unit_cost * wind_factors[0] + battery_unit_cost * battery_factors[0]
+
+    salvage = inverter_unit_cost * inverter_factors[2] + diesel_unit_cost * diesel_factors[2] + \
+        wind_unit_cost * wind_factors[2] + battery_unit_cost * battery_factors[2]
+
+    investment = inverter_unit_cost * inverter_factors[1] + diesel_unit_cost * diesel_factors[1] + \
+        wind_unit_cost * wind_factors[1] + battery_unit_cost * battery_factors[1] - salvage
+    total_battery_investment = battery_unit_cost * (battery_factors[1] - battery_factors[2])
+
+    total_fuel_cost = fuel_costs * annual_factor
+    total_om_cost = om_costs * annual_factor
+
+    npc = total_fuel_cost + total_om_cost + discounted_investment
+    sum_costs = npc - salvage * salvage_factor
+    sum_el_gen = annual_demand * generation_factor
+
+    return sum_costs / sum_el_gen, investment, total_battery_investment, total_fuel_cost, total_om_cost, npc
+
+
+@numba.njit
+def calc_load_curve_wind(tier, annual_demand, dtype=np.float64):
     # the values below define the load curve for the five tiers. The values reflect the share of the daily demand
     # expected in each hour of the day (sum of all values for one tier = 1)
     tier5_load_curve = [0.021008403, 0.021008403, 0.021008403, 0.021008403, 0.027310924, 0.037815126,
@@ -341,7 +447,7 @@ def calc_load_curve_wind(tier, annual_demand):
     else:
         load_curve = tier5_load_curve * 365
 
-    return np.array(load_curve) * annual_demand / 365
+    return (np.array(load_curve) * annual_demand / 365).astype(dtype)
 
 
 # def get_pv_data(latitude, longitude, token, output_folder): # ToDo
@@ -400,13 +506,15 @@ def calc_load_curve_wind(tier, annual_demand):
 #         print('No token provided')
 
 
-def read_wind_environmental_data(wind_path, skiprows=3, wind_col=3):
+def read_wind_environmental_data(wind_path, skiprows=3, wind_col=3, dtype=np.float64, cache=True):
     """
         This method reads the wind resource (m/s) for each hour during one year from a csv-file.
         The skiprows and skipcolumns define which rows and columns the data should be read from.
+        With dtype=np.float32 the hybrid simulation is run in single precision.
+        With cache, the file is only parsed the first time, see read_resource_columns.
     """
     try:
-        wind_curve = pd.read_csv(wind_path, usecols=[wind_col], skiprows=skiprows).values
+        wind_curve, = read_resource_columns(wind_path, [wind_col], skiprows, dtype, cache)
         return wind_curve
     except:
         print('Could not read data, try changing which columns and rows ro read')
@@ -1,5 +1,7 @@
 import logging
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from math import log, pi
 from typing import Dict
 import scipy.spatial
@@ -20,7 +22,8 @@ from shapely.geometry import shape, Point
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-from numba import njit
+import numba
+from numba import njit, prange
 import shapely.geometry
 import geojson
 
@@ -112,6 +115,236 @@ LHV_DIESEL = 9.9445485  # (kWh/l) lower heating value
 HOURS_PER_YEAR = 8760
 
 
+def discount_factor_sum(discount_rate, first_year, end_year):
+    """Sum of the discount factors 1 / (1 + discount_rate) ** year of the years first_year <= year < end_year,
+    counted from the base year
+    """
+    return (1 / (1 + discount_rate) ** np.arange(first_year, end_year)).sum()
+
+
+# Parameters of the transmission and distribution network of a Technology, in the order they are used by
+# td_network_kernel. The kernel receives them as a one-element structured array (see Technology.td_network_record)
+TD_NETWORK_DTYPE = np.dtype([('standalone', np.float64), ('distribution_losses', np.float64),
+                             ('base_to_peak_load_ratio', np.float64), ('power_factor', np.float64),
+                             ('lv_line_max_length', np.float64), ('service_transf_type', np.float64),
+                             ('max_nodes_per_serv_trans', np.float64), ('load_moment', np.float64),
+                             ('hv_line_cost', np.float64), ('hv_line_type', np.float64), ('mv_line_cost', np.float64),
+                             ('mv_line_type', np.float64), ('mv_line_amperage_limit', np.float64),
+                             ('mv_line_max_length', np.float64), ('hv_mv_substation_type', np.float64),
+                             ('lv_line_cost', np.float64), ('service_transf_cost', np.float64),
+                             ('connection_cost_per_hh', np.float64), ('hv_mv_sub_station_cost', np.float64),
+                             ('existing_grid_cost_ratio', np.float64)])
+
+
+@njit(error_model='numpy')
+def distribution_network_point(people, energy_per_cell, num_people_per_hh, grid_cell_area, productive_nodes, network):
+    # Same as Technology.distribution_network, for one settlement
+    network = network[0]
+    peak_load = energy_per_cell / (1 - network.distribution_losses) / HOURS_PER_YEAR / \
+        network.base_to_peak_load_ratio  # kW
+
+    if network.standalone:
+        return 0., 0., 0., energy_per_cell, peak_load, 0.
+
+    s_max = peak_load / network.power_factor
+    max_transformer_area = pi * network.lv_line_max_length ** 2
+    total_nodes = (people / num_people_per_hh) + productive_nodes
+
+    no_of_service_transf = np.ceil(np.maximum(s_max / network.service_transf_type,
+                                              np.maximum(total_nodes / network.max_nodes_per_serv_trans,
+                                                         grid_cell_area / max_transformer_area)))
+
+    transformer_radius = ((grid_cell_area / no_of_service_transf) / pi) ** 0.5
+    transformer_load = peak_load / no_of_service_transf
+    cluster_radius = (grid_cell_area / pi) ** 0.5
+
+    # Sizing lv lines in settlement
+    cluster_lv_lines_length = 0.
+    cluster_mv_lines_length = 0.
+    if 2 / 3 * cluster_radius * transformer_load * 1000 < network.load_moment:
+        cluster_lv_lines_length = 2 / 3 * cluster_radius * no_of_service_transf
+    if 2 / 3 * cluster_radius * transformer_load * 1000 >= network.load_moment:
+        cluster_mv_lines_length = 2 * transformer_radius * no_of_service_transf
+
+    hh_area = grid_cell_area / total_nodes
+    hh_diameter = 2 * ((hh_area / pi) ** 0.5)
+
+    lv_km = cluster_lv_lines_length + hh_diameter * total_nodes
+
+    return cluster_mv_lines_length, lv_km, no_of_service_transf, energy_per_cell, peak_load, total_nodes
+
+
+@njit(error_model='numpy')
+def transmission_network_point(peak_load, additional_mv_line_length, additional_transformer, network):
+    # Same as Technology.transmission_network, for one settlement
+    network = network[0]
+    if network.standalone:
+        return 0., 0., 0.
+
+    hv_to_mv_lines = network.hv_line_cost / network.mv_line_cost
+    max_mv_load = network.mv_line_amperage_limit * network.mv_line_type * hv_to_mv_lines
+
+    mv_amperage = network.service_transf_type / network.mv_line_type
+    no_of_mv_lines = np.ceil(peak_load / (mv_amperage * network.mv_line_type))
+    hv_amperage = network.hv_mv_substation_type / network.hv_line_type
+    no_of_hv_lines = np.ceil(peak_load / (hv_amperage * network.hv_line_type))
+
+    if (peak_load <= max_mv_load) and (additional_mv_line_length < network.mv_line_max_length):
+        hv_km = 0.
+        mv_km = additional_mv_line_length * no_of_mv_lines
+    else:
+        hv_km = additional_mv_line_length * no_of_hv_lines
+        mv_km = 0.
+
+    no_of_hv_mv_subs = 0.
+    if additional_transformer:
+        no_of_hv_mv_subs = np.ceil(peak_load / network.hv_mv_substation_type)
+
+    return hv_km, mv_km, no_of_hv_mv_subs
+
+
+@njit(parallel=True, error_model='numpy')
+def td_network_kernel(people, new_connections, prev_code, total_energy_per_cell, energy_per_cell, num_people_per_hh,
+                      grid_cell_area, additional_mv_line_length, additional_transformer, productive_nodes, elec_loop,
+                      penalty, network):
+    # Same results as the network calculations of Technology.td_network_cost, with the total, existing and new network
+    # of each settlement calculated in one pass over the settlements. Returns the generation, peak load, total
+    # investment and its hv, mv distribution, lv, transformer and connection components (one row each)
+    n = len(people)
+    hv_line_cost = network[0].hv_line_cost
+    mv_line_cost = network[0].mv_line_cost
+    lv_line_cost = network[0].lv_line_cost
+    service_transf_cost = network[0].service_transf_cost
+    connection_cost_per_hh = network[0].connection_cost_per_hh
+    hv_mv_sub_station_cost = network[0].hv_mv_sub_station_cost
+    existing_grid_cost_ratio = network[0].existing_grid_cost_ratio
+    out = np.empty((8, n))
+
+    for i in prange(n):
+        # The distribution network required to meet all of the demand, the network already there and the difference
+        mv_total, lv_total, transf_total, generation_total, peak_total, nodes_total = \
+            distribution_network_point(people[i], total_energy_per_cell[i], num_people_per_hh[i], grid_cell_area[i],
+                                       productive_nodes[i], network)
+        mv_existing, lv_existing, transf_existing, generation_existing, peak_existing, nodes_existing = \
+            distribution_network_point(max(people[i] - new_connections[i], 1),
+                                       total_energy_per_cell[i] - energy_per_cell[i], num_people_per_hh[i],
+                                       grid_cell_area[i], productive_nodes[i], network)
+
+        # Then the transmission network (HV or MV lines plus transformers) in the same way
+        hv_total, mv_connection_total, subs_total = \
+            transmission_network_point(peak_total, additional_mv_line_length[i], additional_transformer[i], network)
+        hv_existing, mv_connection_existing, subs_existing = \
+            transmission_network_point(peak_existing, additional_mv_line_length[i], additional_transformer[i], network)
+
+        # And the network if no distribution network is present
+        mv_new, lv_new, transf_new, generation_new, peak_new, nodes_new = \
+            distribution_network_point(people[i], energy_per_cell[i], num_people_per_hh[i], grid_cell_area[i],
+                                       productive_nodes[i], network)
+        hv_new, mv_connection_new, subs_new = \
+            transmission_network_point(peak_new, additional_mv_line_length[i], additional_transformer[i], network)
+
+        if (prev_code[i] != 3) and (prev_code[i] != 99):
+            mv_distribution = np.maximum(lv_total - lv_existing, 0)
+            lv = np.maximum(lv_total - lv_existing, 0)
+            transformers = np.maximum(transf_total - transf_existing, 0)
+            nodes = np.maximum(nodes_total - nodes_existing, 0)
+            subs = np.maximum(subs_total - subs_existing, 0)
+            generation = np.maximum(generation_total - generation_existing, 0)
+        else:
+            mv_distribution = mv_new
+            lv = lv_new
+            transformers = transf_new
+            nodes = nodes_new
+            subs = subs_new
+            generation = generation_new
+
+        if (people[i] != new_connections[i]) and (prev_code[i] < 3):
+            hv = np.maximum(hv_total - hv_existing, 0)
+            mv_connection = np.maximum(mv_connection_total - mv_connection_existing, 0)
+        else:
+            hv = hv_new
+            mv_connection = mv_connection_new
+
+        if prev_code[i] != 99:
+            peak_load = np.maximum(peak_total - peak_existing, 0)
+        else:
+            peak_load = peak_new
+
+        extension_cost_ratio = 1 + existing_grid_cost_ratio * elec_loop[i]
+        out[0, i] = generation
+        out[1, i] = peak_load
+        out[2, i] = (hv * hv_line_cost * extension_cost_ratio +
+                     mv_connection * mv_line_cost * extension_cost_ratio +
+                     lv * lv_line_cost +
+                     mv_distribution * mv_line_cost +
+                     transformers * service_transf_cost +
+                     nodes * connection_cost_per_hh +
+                     subs * hv_mv_sub_station_cost) * penalty[i]
+        out[3, i] = hv * hv_line_cost
+        out[4, i] = mv_distribution * mv_line_cost
+        out[5, i] = lv * lv_line_cost
+        out[6, i] = transformers * service_transf_cost
+        out[7, i] = nodes * connection_cost_per_hh
+
+    return out
+
+
+def prevent_zero_division(people, energy_per_cell):
+    """Sets the people and the demand of settlements without any to a very low value, to prevent division by zero in
+    the LCOE calculations
+    """
+    if type(people) == int or type(people) == float or type(people) == np.float64:
+        if people == 0:
+            # If there are no people, set the people low (prevent div/0 error) and continue.
+            people = 0.00001
+    else:
+        people = np.maximum(people, 0.00001)
+
+    if type(energy_per_cell) == int or type(energy_per_cell) == float or type(energy_per_cell) == np.float64:
+        if energy_per_cell == 0:
+            # If there is no demand, set the demand low (prevent div/0 error) and continue.
+            energy_per_cell = 0.000000000001
+    else:
+        energy_per_cell = np.maximum(energy_per_cell, 0.000000000001)
+
+    return people, energy_per_cell
+
+
+class LCOEResult:
+    """
+    The LCOE (USD/kWh), discounted investment (USD) and installed capacity (kW) of each settlement, as returned by
+    Technology.get_lcoe, in contiguous arrays in the order of the settlements (with one row per technology for
+    Technology.get_lcoes). The peak load (kW) is only kept when requested for the maximum extension distance. The
+    result unpacks like a tuple:
+
+        lcoe, investment, capacity = technology.get_lcoe(...)
+    """
+    __slots__ = ('lcoe', 'investment', 'capacity', 'peak_load')
+
+    def __init__(self, lcoe, investment, capacity, peak_load=None):
+        self.lcoe = np.ascontiguousarray(lcoe, dtype=np.float64)
+        self.investment = np.ascontiguousarray(investment, dtype=np.float64)
+        self.capacity = np.ascontiguousarray(capacity, dtype=np.float64)
+        self.peak_load = None if peak_load is None else np.ascontiguousarray(peak_load, dtype=np.float64)
+
+    def __iter__(self):
+        yield self.lcoe
+        yield self.investment
+        yield self.capacity
+        if self.peak_load is not None:
+            yield self.peak_load
+
+    def __len__(self):
+        return len(self.lcoe)
+
+
+def finite_or_zero(values):
+    """Returns the values (e.g. investments of a technology) as an array, with NaN and +/-inf replaced by 0
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(values), values, 0.)
+
+
 class Technology:
     """
     Used to define the parameters for each electricity access technology, and to calculate the LCOE depending on
@@ -168,6 +401,26 @@ class Technology:
         self.hybrid_fuel = hybrid_fuel
         self.discount_rate = discount_rate
 
+    @property
+    def capital_cost(self):
+        """Capital cost (USD/kW) by upper limit of the installed capacity (kW, or kW per household for standalone
+        systems). The limits are kept sorted in an array, so that the tier of every settlement is found in one search
+        """
+        return self._capital_cost
+
+    @capital_cost.setter
+    def capital_cost(self, capital_cost):
+        self._capital_cost = capital_cost
+        limits = sorted(capital_cost)
+        self._capital_cost_limits = np.array(limits, dtype=np.float64)
+        # Settlements above the highest limit get no capital cost
+        self._capital_cost_values = np.array([capital_cost[limit] for limit in limits] + [0], dtype=np.float64)
+
+    def get_capital_cost(self, capacity):
+        """Returns the capital cost (USD/kW) of the tier of each capacity, i.e. the cost of the lowest limit above it
+        """
+        return self._capital_cost_values[np.searchsorted(self._capital_cost_limits, capacity, side='right')]
+
     @classmethod
     def set_default_values(cls, base_year, start_year, end_year, hv_line_type=69, hv_line_cost=53000,
                            mv_line_type=33, mv_line_amperage_limit=8.0, mv_line_cost=7000, mv_line_max_length=50,
@@ -242,56 +495,107 @@ class Technology:
 
         Returns
         -------
-        lcoe or discounted investment cost
+        LCOEResult with the lcoe, discounted investment cost and installed capacity (and the peak load if
+        get_max_dist) of each settlement
         """
 
-        if type(people) == int or type(people) == float or type(people) == np.float64:
-            if people == 0:
-                # If there are no people, set the people low (prevent div/0 error) and continue.
-                people = 0.00001
-        else:
-            people = np.maximum(people, 0.00001)
+        people, energy_per_cell = prevent_zero_division(people, energy_per_cell)
+
+        network = self.td_network_cost(people,
+                                       new_connections,
+                                       prev_code,
+                                       total_energy_per_cell,
+                                       energy_per_cell,
+                                       num_people_per_hh,
+                                       grid_cell_area,
+                                       additional_mv_line_length,
+                                       additional_transformer,
+                                       productive_nodes,
+                                       elec_loop,
+                                       penalty,
+                                       )
+
+        return self.network_lcoe(network, people, num_people_per_hh, start_year, end_year, capacity_factor, fuel_cost,
+                                 penalty, get_max_dist)
 
-        if type(energy_per_cell) == int or type(energy_per_cell) == float or type(energy_per_cell) == np.float64:
-            if energy_per_cell == 0:
-                # If there is no demand, set the demand low (prevent div/0 error) and continue.
-                energy_per_cell = 0.000000000001
-        else:
-            energy_per_cell = np.maximum(energy_per_cell, 0.000000000001)
+    @staticmethod
+    def get_lcoes(technologies, energy_per_cell, people, num_people_per_hh, start_year, end_year, new_connections,
+                  total_energy_per_cell, prev_code, grid_cell_area, technology_args=None, **kwargs):
+        """Calculates the LCOE of several technologies for the same settlements.
+
+        The T&D network only depends on the network parameters of a technology (see TD_NETWORK_DTYPE) and on the
+        connection arguments, so it is costed once for each group of technologies where these are the same, e.g.
+        mini-grids with the same distribution parameters, and shared by all technologies of the group.
+
+        Parameters
+        ----------
+        technologies : list of Technology
+        technology_args : list of dict, optional
+            Keyword arguments of get_lcoe specific to each technology (e.g. capacity_factor,
+            additional_mv_line_length or fuel_cost), one dict per technology
+        kwargs : keyword arguments of get_lcoe common to all technologies
+        The other parameters are the same as for get_lcoe.
+
+        Returns
+        -------
+        LCOEResult with the lcoe, discounted investment cost and installed capacity in arrays of shape
+        (technologies, settlements), e.g. to select the least-cost technology of each settlement with argmin
+        """
+        if technology_args is None:
+            technology_args = [{}] * len(technologies)
+
+        people, energy_per_cell = prevent_zero_division(people, energy_per_cell)
+
+        network_arg_names = ['additional_mv_line_length', 'additional_transformer', 'productive_nodes', 'elec_loop',
+                             'penalty']
+        networks = []  # (network parameters, connection arguments, network) of each group of technologies
+        results = []
+        for technology, args in zip(technologies, technology_args):
+            args = dict(dict(additional_mv_line_length=0.0, capacity_factor=0.9, fuel_cost=0, elec_loop=0,
+                             productive_nodes=0, additional_transformer=0, penalty=1), **kwargs, **args)
+            network_record = technology.td_network_record().tobytes()
+            network_args = [args[name] for name in network_arg_names]
+
+            for record, connection_args, network in networks:
+                if record == network_record and all(a is b or np.array_equal(a, b)
+                                                    for a, b in zip(connection_args, network_args)):
+                    break
+            else:
+                network = technology.td_network_cost(people, new_connections, prev_code, total_energy_per_cell,
+                                                     energy_per_cell, num_people_per_hh, grid_cell_area,
+                                                     *network_args)
+                networks.append((network_record, network_args, network))
+
+            results.append(technology.network_lcoe(network, people, num_people_per_hh, start_year, end_year,
+                                                   args['capacity_factor'], args['fuel_cost'], args['penalty']))
+
+        logging.debug('LCOE of {} technologies with {} T&D networks'.format(len(technologies), len(networks)))
 
+        return LCOEResult(np.stack([result.lcoe for result in results]),
+                          np.stack([result.investment for result in results]),
+                          np.stack([result.capacity for result in results]))
+
+    def network_lcoe(self, network, people, num_people_per_hh, start_year, end_year, capacity_factor=0.9, fuel_cost=0,
+                     penalty=1, get_max_dist=False):
+        """Calculates the LCOE of the technology for the T&D network of the settlements, as returned by
+        td_network_cost. See get_lcoe for the parameters
+        """
+        generation_per_year, peak_load, td_investment_cost = network[:3]
         grid_penalty_ratio = 1
 
-        generation_per_year, peak_load, td_investment_cost, hv, mv, lv, service_transf, connection = \
-            self.td_network_cost(people,
-                                 new_connections,
-                                 prev_code,
-                                 total_energy_per_cell,
-                                 energy_per_cell,
-                                 num_people_per_hh,
-                                 grid_cell_area,
-                                 additional_mv_line_length,
-                                 additional_transformer,
-                                 productive_nodes,
-                                 elec_loop,
-                                 penalty,
-                                 )
-        generation_per_year = pd.Series(generation_per_year)
-        peak_load = pd.Series(peak_load)
-        td_investment_cost = pd.Series(td_investment_cost)
+        generation_per_year = np.atleast_1d(generation_per_year)
+        peak_load = np.atleast_1d(peak_load)
+        td_investment_cost = np.atleast_1d(td_investment_cost)
 
         td_investment_cost = td_investment_cost * grid_penalty_ratio
-        td_om_cost = td_investment_cost * self.om_of_td_lines * penalty
-        installed_capacity = peak_load / capacity_factor
-
-        cap_cost = td_investment_cost * 0
-        cost_dict_list = self.capital_cost.keys()
-        cost_dict_list = sorted(cost_dict_list)
-        for key in cost_dict_list:
-            if self.standalone:
-                cap_cost.loc[((installed_capacity / (people / num_people_per_hh)) < key) & (cap_cost == 0)] = \
-                    self.capital_cost[key]
-            else:
-                cap_cost.loc[(installed_capacity < key) & (cap_cost == 0)] = self.capital_cost[key]
+        td_om_cost = td_investment_cost * self.om_of_td_lines * np.asarray(penalty)
+        installed_capacity = peak_load / np.asarray(capacity_factor)
+
+        # The capital cost tier of standalone systems depends on the capacity per household
+        if self.standalone:
+            cap_cost = self.get_capital_cost(installed_capacity / np.asarray(people / num_people_per_hh))
+        else:
+            cap_cost = self.get_capital_cost(installed_capacity)
 
         capital_investment = installed_capacity * cap_cost # * penalty
         total_om_cost = td_om_cost + (cap_cost * penalty * self.om_costs * installed_capacity)
@@ -308,68 +612,42 @@ class Technology:
         if self.tech_life + step < project_life:
             reinvest_year = self.tech_life + step
 
-        year = np.arange(project_life)
-        el_gen = np.outer(np.asarray(generation_per_year), np.ones(project_life))
-        for s in range(step):
-            el_gen[:, s] = 0
-        discount_factor = (1 + self.discount_rate) ** year
-        investments = np.zeros(project_life)
-        investments[step] = 1
+        # Every cost and the generation of a settlement is a constant yearly value (from the start year), a one-off
+        # value in the investment years or in the final year, so the discounting reduces to one sum of discount
+        # factors for each of these year profiles, the same for all settlements
+        generation_factor = discount_factor_sum(self.discount_rate, step, project_life)
+        investment_factor = discount_factor_sum(self.discount_rate, step, step + 1)
         # Calculate the year of re-investment if tech_life is smaller than project life
         if reinvest_year:
-            investments[reinvest_year] = 1
-        investments = np.outer(total_investment_cost, investments)
-
-        grid_capacity_investments = np.zeros(project_life)
-        grid_capacity_investments[step] = 1
-        # Calculate the year of re-investment if tech_life is smaller than project life
-        if reinvest_year:
-            grid_capacity_investments[reinvest_year] = 1
-        grid_capacity_investments = np.outer(peak_load * self.grid_capacity_investment, grid_capacity_investments)
+            investment_factor += discount_factor_sum(self.discount_rate, reinvest_year, reinvest_year + 1)
 
         # Calculate salvage value if tech_life is bigger than project life
-        salvage = np.zeros(project_life)
         if reinvest_year > 0:
             used_life = (project_life - step) - self.tech_life
         else:
             used_life = project_life - step - 1
-        salvage[-1] = 1
-        salvage = np.outer(total_investment_cost * (1 - used_life / self.tech_life), salvage)
-
-        operation_and_maintenance = np.ones(project_life)
-        for s in range(step):
-            operation_and_maintenance[s] = 0
-        operation_and_maintenance = np.outer(total_om_cost, operation_and_maintenance)
-        fuel = np.outer(np.asarray(generation_per_year), np.zeros(project_life))
-        for p in range(project_life):
-            fuel[:, p] = el_gen[:, p] * fuel_cost
-
-        discounted_investments = investments / discount_factor
-        dicounted_grid_capacity_investments = grid_capacity_investments / discount_factor
-        investment_cost = np.sum(discounted_investments, axis=1) + np.sum(dicounted_grid_capacity_investments, axis=1)
-        discounted_costs = (investments + operation_and_maintenance + fuel - salvage) / discount_factor
-        discounted_generation = el_gen / discount_factor
-        lcoe = np.sum(discounted_costs, axis=1) / np.sum(discounted_generation, axis=1)
-        # lcoe = pd.DataFrame(lcoe[:, np.newaxis])
-        # investment_cost = pd.DataFrame(investment_cost[:, np.newaxis])
-        # installed_capacity = pd.DataFrame(installed_capacity[:, np.newaxis])
-
-        lcoe = pd.DataFrame(lcoe)
-        investment_cost = pd.DataFrame(investment_cost)
-        installed_capacity = pd.DataFrame(installed_capacity)
+        salvage_factor = discount_factor_sum(self.discount_rate, project_life - 1, project_life)
+
+        generation_per_year = np.asarray(generation_per_year, dtype=float)
+        total_investment_cost = np.asarray(total_investment_cost, dtype=float)
+        salvage = total_investment_cost * (1 - used_life / self.tech_life)
+
+        investment_cost = (total_investment_cost + np.asarray(peak_load) * self.grid_capacity_investment) * \
+            investment_factor
+        discounted_costs = total_investment_cost * investment_factor + \
+            (np.asarray(total_om_cost) + generation_per_year * np.asarray(fuel_cost)) * generation_factor - \
+            salvage * salvage_factor
+        lcoe = discounted_costs / (generation_per_year * generation_factor)
 
         if get_max_dist:
-            return lcoe, investment_cost, installed_capacity, peak_load
+            return LCOEResult(lcoe, investment_cost, installed_capacity, peak_load)
         elif self.hybrid:
-            hybrid_capacity = pd.DataFrame(self.hybrid_capacity)  # ToDo this exception can be handled more elegantly
-            try:
-                hybrid_capacity.rename(columns={2: 0}, inplace=True)
-            except:
-                pass
-            return lcoe + pd.DataFrame(self.hybrid_fuel), pd.DataFrame(investment_cost[0] + self.hybrid_investment), \
-                hybrid_capacity #, hv, mv, lv, service_transf, connection, td_investment_cost
+            # The LCOE, investment and capacity of the generation of hybrid mini-grids come from their lookup table
+            hybrid_capacity = np.asarray(self.hybrid_capacity, dtype=np.float64) * np.ones_like(lcoe)
+            return LCOEResult(lcoe + np.asarray(self.hybrid_fuel), investment_cost + np.asarray(self.hybrid_investment),
+                              hybrid_capacity)
         else:
-            return lcoe, investment_cost, installed_capacity
+            return LCOEResult(lcoe, investment_cost, installed_capacity)
 
     def transmission_network(self, peak_load, additional_mv_line_length=0, additional_transformer=0,
                              mv_distribution=False):
@@ -517,117 +795,144 @@ class Technology:
             Cost penalty factor for T&D network, e.g. https://www.mdpi.com/2071-1050/12/3/777
         """
 
-        # Start by calculating the distribution network required to meet all of the demand
-        cluster_mv_lines_length_total, cluster_lv_lines_length_total, no_of_service_transf_total, \
-            generation_per_year_total, peak_load_total, total_nodes_total = \
-            self.distribution_network(people, total_energy_per_cell, num_people_per_hh, grid_cell_area,
-                                      productive_nodes)
-
-        # Next calculate the network that is already there
-        cluster_mv_lines_length_existing, cluster_lv_lines_length_existing, no_of_service_transf_existing, \
-            generation_per_year_existing, peak_load_existing, total_nodes_existing = \
-            self.distribution_network(np.maximum((people - new_connections), 1),
-                                      (total_energy_per_cell - energy_per_cell),
-                                      num_people_per_hh, grid_cell_area, productive_nodes)
-
-        # Then calculate the difference between the two
-        mv_lines_distribution_length_additional = \
-            np.maximum(cluster_lv_lines_length_total - cluster_lv_lines_length_existing, 0)
-        total_lv_lines_length_additional = \
-            np.maximum(cluster_lv_lines_length_total - cluster_lv_lines_length_existing, 0)
-        num_transformers_additional = np.maximum(no_of_service_transf_total - no_of_service_transf_existing, 0)
-        generation_per_year_additional = np.maximum(generation_per_year_total - generation_per_year_existing, 0)
-        peak_load_additional = np.maximum(peak_load_total - peak_load_existing, 0)
-        total_nodes_additional = np.maximum(total_nodes_total - total_nodes_existing, 0)
-
-        # Examine if there are any MV lines in the distribution network, used to determine transformer type
-        mv_distribution = np.where(mv_lines_distribution_length_additional > 0, True, False)
-
-        # Then calculate the transmission network (HV or MV lines plus transformers) using the same methodology
-        hv_lines_total_length_total, mv_lines_connection_length_total, no_of_hv_mv_substation_total, \
-            no_of_mv_lv_substation_total = \
-            self.transmission_network(peak_load_total, additional_mv_line_length, additional_transformer,
-                                      mv_distribution=mv_distribution)
-
-        hv_lines_total_length_existing, mv_lines_connection_length_existing, no_of_hv_mv_substation_existing, \
-            no_of_mv_lv_substation_existing = \
-            self.transmission_network(peak_load_existing, additional_mv_line_length, additional_transformer,
-                                      mv_distribution=mv_distribution)
-
-        hv_lines_total_length_additional = np.maximum(hv_lines_total_length_total - hv_lines_total_length_existing, 0)
-        mv_lines_connection_length_additional = \
-            np.maximum(mv_lines_connection_length_total - mv_lines_connection_length_existing, 0)
-        no_of_hv_mv_substation_additional = \
-            np.maximum(no_of_hv_mv_substation_total - no_of_hv_mv_substation_existing, 0)
-        no_of_mv_lv_substation_additional = \
-            np.maximum(no_of_mv_lv_substation_total - no_of_mv_lv_substation_existing, 0)
-
-        # If no distribution network is present, perform the calculations only once
-        mv_lines_distribution_length_new, total_lv_lines_length_new, num_transformers_new, generation_per_year_new, \
-            peak_load_new, total_nodes_new = self.distribution_network(people, energy_per_cell, num_people_per_hh,
-                                                                       grid_cell_area, productive_nodes)
-
-        mv_distribution = np.where(mv_lines_distribution_length_new > 0, True, False)
-
-        hv_lines_total_length_new, mv_lines_connection_length_new, no_of_hv_mv_substation_new, \
-            no_of_mv_lv_substation_new, = \
-            self.transmission_network(peak_load_new, additional_mv_line_length, additional_transformer,
-                                      mv_distribution=mv_distribution)
-
-        mv_lines_distribution_length = np.where((prev_code != 3) & (prev_code != 99),
-                                                mv_lines_distribution_length_additional,
-                                                mv_lines_distribution_length_new)
-
-        hv_lines_total_length = np.where((people != new_connections) & (prev_code < 3),
-                                         hv_lines_total_length_additional,
-                                         hv_lines_total_length_new)
-
-        mv_lines_connection_length = np.where((people != new_connections) & (prev_code < 3),
-                                              mv_lines_connection_length_additional,
-                                              mv_lines_connection_length_new)
-
-        total_lv_lines_length = np.where((prev_code != 3) & (prev_code != 99),
-                                         total_lv_lines_length_additional,
-                                         total_lv_lines_length_new)
-
-        num_transformers = np.where((prev_code != 3) & (prev_code != 99),
-                                    num_transformers_additional,
-                                    num_transformers_new)
-
-        total_nodes = np.where((prev_code != 3) & (prev_code != 99),
-                               total_nodes_additional,
-                               total_nodes_new)
-
-        no_of_hv_mv_substation = np.where((prev_code != 3) & (prev_code != 99),
-                                          no_of_hv_mv_substation_additional,
-                                          no_of_hv_mv_substation_new)
-
-        no_of_mv_lv_substation = np.where((prev_code != 3) & (prev_code != 99),
-                                          no_of_mv_lv_substation_additional,
-                                          no_of_mv_lv_substation_new)
-
-        generation_per_year = np.where((prev_code != 3) & (prev_code != 99),
-                                       generation_per_year_additional,
-                                       generation_per_year_new)
-
-        peak_load = np.where(prev_code != 99,  # ToDo check
-                             peak_load_additional,
-                             peak_load_new)
-
-        td_investment_cost = (hv_lines_total_length * self.hv_line_cost * (
-                1 + self.existing_grid_cost_ratio * elec_loop) +
-                              mv_lines_connection_length * self.mv_line_cost * (
-                                      1 + self.existing_grid_cost_ratio * elec_loop) +
-                              total_lv_lines_length * self.lv_line_cost +
-                              mv_lines_distribution_length * self.mv_line_cost +
-                              num_transformers * self.service_transf_cost +
-                              total_nodes * self.connection_cost_per_hh +
-                              no_of_hv_mv_substation * self.hv_mv_sub_station_cost) * penalty
-                              # + no_of_mv_lv_substation * self.mv_lv_sub_station_cost) * penalty
-
-        return generation_per_year, peak_load, td_investment_cost, hv_lines_total_length * self.hv_line_cost, \
-            mv_lines_distribution_length * self.mv_line_cost, total_lv_lines_length * self.lv_line_cost,\
-            num_transformers * self.service_transf_cost, total_nodes * self.connection_cost_per_hh
+        # The total, existing and new network of each settlement are calculated in one pass of the compiled kernel,
+        # see distribution_network and transmission_network for the methodology
+        inputs = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in
+                                       (people, new_connections, prev_code, total_energy_per_cell, energy_per_cell,
+                                        num_people_per_hh, grid_cell_area, additional_mv_line_length,
+                                        additional_transformer, productive_nodes, elec_loop, penalty)])
+        shape = inputs[0].shape
+        inputs = [np.ascontiguousarray(x).ravel() for x in inputs]
+
+        generation_per_year, peak_load, td_investment_cost, hv_cost, mv_cost, lv_cost, service_transf_cost, \
+            connection_cost = td_network_kernel(*inputs, self.td_network_record()).reshape((8,) + shape)
+
+        return generation_per_year, peak_load, td_investment_cost, hv_cost, mv_cost, lv_cost, service_transf_cost, \
+            connection_cost
+
+    def td_network_record(self):
+        """Packs the network parameters of the technology into the one-element record array taken by
+        td_network_kernel
+        """
+        network = np.zeros(1, dtype=TD_NETWORK_DTYPE)
+        for name in TD_NETWORK_DTYPE.names:
+            network[name] = getattr(self, name)
+        return network
+
+
+# Resource data and arguments of a lookup table worker process, set once per process by _init_lookup_table_worker
+_lookup_table_worker = {}
+
+
+def _init_lookup_table_worker(technology, resource, year, time_step, end_year, specs, kwargs):
+    _lookup_table_worker.update(technology=technology, resource=resource, year=year, time_step=time_step,
+                                end_year=end_year, specs=specs, kwargs=kwargs)
+
+
+def _init_lookup_table_process(*initargs):
+    # Each worker process runs one cell at a time, so the parallel numba kernels are limited to one thread per process
+    numba.set_num_threads(1)
+    _init_lookup_table_worker(*initargs)
+
+
+def _solve_lookup_table_cell(task):
+    cell, seed = task
+    tier, resource_level, diesel_price = cell[:3]
+    energy = cell[3] if len(cell) > 3 else 10000
+    w = _lookup_table_worker
+
+    if w['technology'] == 'pv':
+        ghi_curve, temp = w['resource']
+        return SettlementProcessor.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / resource_level), temp,
+                                                      energy, tier, diesel_price, w['year'] - w['time_step'],
+                                                      w['end_year'], w['year'], w['time_step'], w['specs'],
+                                                      seed=seed, **w['kwargs'])
+    else:
+        wind_curve = w['resource']
+        return SettlementProcessor.optimize_wind_mini_grid(wind_curve * resource_level / np.average(wind_curve), energy,
+                                                           tier, diesel_price, w['year'] - w['time_step'],
+                                                           w['end_year'], w['year'], w['time_step'], w['specs'],
+                                                           seed=seed, **w['kwargs'])
+
+
+def build_hybrid_lookup_table(cells, resource, year, time_step, end_year, specs, technology='pv', processes=None,
+                              seed=0, callback=None, **kwargs):
+    """
+    Optimizes the hybrid mini-grid of each (tier, resource level, diesel price) cell of a lookup table in a pool of
+    worker processes. The cells are handed out one at a time to whichever worker is free, since their run times vary
+    widely. The workers are kept for the whole table, so the numba kernels are only compiled once in each of them.
+
+    Arguments
+    ---------
+    cells : list of (tier, resource level, diesel price) tuples, the resource level being the annual GHI (kWh/m2) for
+        PV and the average wind speed (m/s) for wind. An annual demand (kWh) can be given as a fourth element, otherwise
+        the cells are optimized for 10000 kWh
+    resource : (ghi_curve, temp) for PV, wind_curve for wind
+    technology : 'pv' or 'wind'
+    processes : number of worker processes, the number of CPUs by default. With 1, the cells are solved in this process
+    seed : each cell is optimized with cell_seed(seed, cell), so the results do not depend on the order the cells are
+        solved in, nor on which other cells are solved with them
+    callback : optional function called with each cell and its result as soon as the cell is solved
+    kwargs : additional arguments to optimize_mini_grid or optimize_wind_mini_grid
+
+    Returns a dict with the (lcoe, investment, capacity, fuel cost) of each cell
+    """
+    tasks = [(tuple(cell), cell_seed(seed, cell)) for cell in cells]
+    initargs = (technology, resource, year, time_step, end_year, specs, kwargs)
+    n_cells = len(tasks)
+    table = {}
+
+    start = time.time()
+    report_every = max(n_cells // 10, 1)
+
+    def collect(task, result):
+        table[task[0]] = result
+        if callback is not None:
+            callback(task[0], result)
+        if len(table) % report_every == 0 or len(table) == n_cells:
+            elapsed = time.time() - start
+            logging.info('Hybrid lookup table: {}/{} cells in {:.0f} s ({:.2f} cells/s)'.format(
+                len(table), n_cells, elapsed, len(table) / max(elapsed, 1e-9)))
+
+    if processes == 1:
+        _init_lookup_table_worker(*initargs)
+        for task in tasks:
+            collect(task, _solve_lookup_table_cell(task))
+    else:
+        # Worker processes are spawned rather than forked, as forking a process that has started the numba threads is
+        # not safe
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_lookup_table_process, initargs=initargs) as executor:
+            futures = {executor.submit(_solve_lookup_table_cell, task): task for task in tasks}
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
+
+    return table
+
+
+def train_pv_hybrid_surrogate(ghi_curve, temp, start_year, end_year, mg_pv_hybrid_specs, bounds, n_samples=200,
+                              seed=0, n_folds=5, **kwargs):
+    """
+    Trains a HybridSurrogate of SettlementProcessor.optimize_mini_grid over the inputs in bounds
+
+    Arguments
+    ---------
+    ghi_curve, temp : hourly resource data, as from read_environmental_data
+    mg_pv_hybrid_specs : specifications, of which the ones in bounds are replaced by the sampled values
+    bounds : dict of (low, high) of 'resource' (annual GHI in kWh/m2), 'diesel_price' and any numeric specifications
+    n_samples : number of samples optimized for each tier
+    kwargs : additional arguments to optimize_mini_grid
+
+    Returns the trained HybridSurrogate, with its cross-validated error in cv_error
+    """
+    def solve(tier, resource, diesel_price, **inputs):
+        return SettlementProcessor.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / resource), temp, 10000,
+                                                      tier, diesel_price, start_year, end_year, start_year, 0,
+                                                      dict(mg_pv_hybrid_specs, **inputs), seed=seed, **kwargs)
+
+    surrogate = HybridSurrogate(bounds, start_year, end_year)
+    surrogate.fit(solve, n_samples, seed, n_folds)
+    return surrogate
 
 
 class SettlementProcessor:
@@ -1335,8 +1640,6 @@ class SettlementProcessor:
         # Grid-electrified settlements
         electrified_loce, electrified_investment, electrified_capacity = self.get_grid_lcoe(0, 0, 0, year, time_step,
                                                                                             end_year, grid_calc)
-        electrified_investment = electrified_investment[0]
-        electrified_capacity = electrified_capacity[0]
         grid_investment = np.where(self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 1,
                                    electrified_investment, grid_investment)
         grid_capacity = np.where(self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 1,
@@ -1368,24 +1671,19 @@ class SettlementProcessor:
             self.get_grid_lcoe(0, 0, 0, year, time_step, end_year, grid_calc, get_max_dist=True)
 
         project_life = year - start_year
-        years = np.arange(project_life)
         step = (year - time_step) - start_year
         prev_code = self.df[SET_ELEC_FINAL_CODE + '{}'.format(year - time_step)]
         generation_per_year = self.df[SET_ENERGY_PER_CELL + '{}'.format(year)]
 
-        el_gen = np.outer(np.asarray(generation_per_year), np.ones(project_life))
-        for s in range(step):
-            el_gen[:, s] = 0
-
-        discount_factor = (1 + grid_calc.discount_rate) ** years
-        discounted_generation = el_gen / discount_factor
-        discounted_generation = np.sum(discounted_generation, axis=1)
+        # The generation is the same every year from the investment year on
+        discounted_generation = np.asarray(generation_per_year) * \
+            discount_factor_sum(grid_calc.discount_rate, step, project_life)
 
         discounted_generation = pd.Series(discounted_generation)
         # max_discounted_investments = filter_lcoe[0] * discounted_generation
-        max_discounted_investments = (self.df['Minimum_LCOE_Off_grid{}'.format(year)] - filter_lcoe[0]) * discounted_generation
+        max_discounted_investments = (self.df['Minimum_LCOE_Off_grid{}'.format(year)] - filter_lcoe) * discounted_generation
 
-        max_investment = max_discounted_investments * discount_factor[year - time_step - start_year]
+        max_investment = max_discounted_investments * (1 + grid_calc.discount_rate) ** step
 
         hv_to_mv_lines = grid_calc.hv_line_cost / grid_calc.mv_line_cost
         max_mv_load = grid_calc.mv_line_amperage_limit * grid_calc.mv_line_type * hv_to_mv_lines
@@ -1406,7 +1704,7 @@ class SettlementProcessor:
         self.df['GridCapacityRequired'] = peak_load / grid_calc.capacity_factor
         self.df['GridCapacityRequired' + '{}'.format(year)] = peak_load / grid_calc.capacity_factor
         self.df['MaxIntensificationDist'] = np.where(self.df[SET_NEW_CONNECTIONS + "{}".format(year)] > 0,
-            (max_intensification_cost - filter_investment[0] / self.df[SET_NEW_CONNECTIONS + "{}".format(year)]) / (cost_per_km / self.df[SET_NEW_CONNECTIONS + "{}".format(year)]),
+            (max_intensification_cost - filter_investment / self.df[SET_NEW_CONNECTIONS + "{}".format(year)]) / (cost_per_km / self.df[SET_NEW_CONNECTIONS + "{}".format(year)]),
                                             0)  # Todo
 
         #print(self.df['MaxIntensificationDist'])
@@ -1746,9 +2044,9 @@ class SettlementProcessor:
         grid_lcoe, grid_investment, grid_capacity = \
             self.get_grid_lcoe(self.df['NewDist'], 0, 0, year, time_step, end_year, grid_calc)
 
-        grid_lcoe = np.where((self.df['NewDist'] == 0) & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] > 2), 99, grid_lcoe[0])
-        grid_investment = np.where((self.df['NewDist'] == 0) & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] > 2), 0, grid_investment[0])
-        grid_capacity = np.where((self.df['NewDist'] == 0) & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] > 2), 0, grid_capacity[0])
+        grid_lcoe = np.where((self.df['NewDist'] == 0) & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] > 2), 99, grid_lcoe)
+        grid_investment = np.where((self.df['NewDist'] == 0) & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] > 2), 0, grid_investment)
+        grid_capacity = np.where((self.df['NewDist'] == 0) & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] > 2), 0, grid_capacity)
 
         # Create a FeatureCollection
         feature_collection = geojson.FeatureCollection(features)
@@ -1757,7 +2055,7 @@ class SettlementProcessor:
 
         #print('Finishing', time.ctime())
 
-        return grid_lcoe, self.df['NewDist'], pd.DataFrame(grid_investment), pd.DataFrame(grid_capacity), x_coordinates, y_coordinates, feature_collection
+        return grid_lcoe, self.df['NewDist'], grid_investment, grid_capacity, x_coordinates, y_coordinates, feature_collection
 
     def elec_extension(self, grid_calc, max_dist, year, start_year, end_year, time_step, grid_capacity_limit,
                        grid_connect_limit, new_investment, new_capacity, auto_intensification=0, prioritization=0,
@@ -1792,10 +2090,8 @@ class SettlementProcessor:
             intensification_lcoe, intensification_investment, intensification_capacity = \
                 self.get_grid_lcoe(dist_adjusted=mv_dist_adjusted, elecorder=0, additional_transformer=0, year=year,
                                    time_step=time_step, end_year=end_year, grid_calc=grid_calc)
-            intensification_lcoe = new_lcoes.copy(deep=True)
-            intensification_lcoe.loc[(mv_planned < auto_intensification) & (prev_code != 1)] = 0.01
-            intensification_lcoe = pd.DataFrame(intensification_lcoe)
-            intensification_lcoe.columns = [0]
+            intensification_lcoe = new_lcoes.to_numpy(dtype=np.float64, copy=True)
+            intensification_lcoe[(mv_planned < auto_intensification) & (prev_code != 1)] = 0.01
 
             grid_capacity_limit, grid_connect_limit, cell_path_real, cell_path_adjusted, elecorder, electrified, \
                 new_lcoes, new_investment, new_capacity \
@@ -1815,8 +2111,7 @@ class SettlementProcessor:
         # Find the unelectrified settlements where grid can be less costly than off-grid
         filter_lcoe, filter_investment, filter_capacity = self.get_grid_lcoe(0, 0, 0, year, time_step, end_year,
                                                                              grid_calc)
-        filter_lcoe = filter_lcoe[0]
-        filter_lcoe.loc[electrified == 1] = 99
+        filter_lcoe[electrified == 1] = 99
         unelectrified = np.where(filter_lcoe < min_code_lcoes)
         unelectrified = unelectrified[0].tolist()
 
@@ -1903,12 +2198,11 @@ class SettlementProcessor:
                                                     new_capacity=new_capacity,
                                                     )
 
-        return new_lcoes, cell_path_adjusted, elecorder, cell_path_real, pd.DataFrame(new_investment), pd.DataFrame(
-            new_capacity)
+        return new_lcoes, cell_path_adjusted, elecorder, cell_path_real, new_investment, new_capacity
 
     def get_grid_lcoe(self, dist_adjusted, elecorder, additional_transformer, year, time_step, end_year, grid_calc,
                       get_max_dist=False):
-        grid = \
+        return \
             grid_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
                                start_year=year - time_step,
                                end_year=end_year,
@@ -1924,11 +2218,6 @@ class SettlementProcessor:
                                capacity_factor=grid_calc.capacity_factor,
                                get_max_dist=get_max_dist)
 
-        if get_max_dist:
-            return grid[0], grid[1], grid[2], grid[3]
-        else:
-            return grid[0], grid[1], grid[2]
-
     def closest_electrified_settlement(self, new_electrified, unelectrified, cell_path_real, grid_penalty_ratio,
                                        elecorder):
 
@@ -1981,31 +2270,31 @@ class SettlementProcessor:
                                    cell_path_adjusted, electrified, year, grid_calc, grid_investment, new_investment,
                                    grid_capacity, new_capacity, threshold=999999999):
 
-        min_code_lcoes = self.df[SET_MIN_OFFGRID_LCOE + "{}".format(year)].copy(deep=True)
+        min_code_lcoes = self.df[SET_MIN_OFFGRID_LCOE + "{}".format(year)].to_numpy(dtype=np.float64)
 
-        grid_lcoe = grid_lcoe[0]
-        grid_investment = grid_investment[0]
-        grid_capacity = grid_capacity[0]
-        grid_lcoe.loc[electrified == 1] = 99
-        grid_lcoe.loc[prev_dist + dist_adjusted > max_dist] = 99
-        grid_lcoe.loc[grid_lcoe > new_lcoes] = 99
+        grid_lcoe = np.array(grid_lcoe, dtype=np.float64)
+        grid_lcoe[electrified == 1] = 99
+        grid_lcoe[np.asarray(prev_dist + dist_adjusted) > max_dist] = 99
+        grid_lcoe[grid_lcoe > np.asarray(new_lcoes)] = 99
 
-        grid_lcoe.loc[grid_investment / self.df[SET_NEW_CONNECTIONS + "{}".format(year)] > threshold] = 99
+        new_connections = self.df[SET_NEW_CONNECTIONS + "{}".format(year)].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            grid_lcoe[grid_investment / new_connections > threshold] = 99
 
-        consumption = self.df[SET_ENERGY_PER_CELL + "{}".format(year)]  # kWh/year
+        consumption = self.df[SET_ENERGY_PER_CELL + "{}".format(year)].to_numpy(dtype=np.float64)  # kWh/year
         average_load = consumption / (1 - grid_calc.distribution_losses) / HOURS_PER_YEAR  # kW
         peak_load = average_load / grid_calc.base_to_peak_load_ratio  # kW
-        peak_load.loc[grid_lcoe >= min_code_lcoes] = 0
+        peak_load[grid_lcoe >= min_code_lcoes] = 0
         peak_load_cum_sum = np.cumsum(peak_load)
-        grid_lcoe.loc[peak_load_cum_sum > grid_capacity_limit] = 99
-        new_grid_connections = self.df[SET_NEW_CONNECTIONS + "{}".format(year)].copy()
-        new_grid_connections.loc[grid_lcoe >= min_code_lcoes] = 0
+        grid_lcoe[peak_load_cum_sum > grid_capacity_limit] = 99
+        new_grid_connections = new_connections.copy()
+        new_grid_connections[grid_lcoe >= min_code_lcoes] = 0
         new_grid_connections_cum_sum = np.cumsum(new_grid_connections)
-        grid_lcoe.loc[new_grid_connections_cum_sum > grid_connect_limit] = 99
+        grid_lcoe[new_grid_connections_cum_sum > grid_connect_limit] = 99
 
         # Update limiting values
-        grid_capacity_limit -= peak_load.loc[grid_lcoe < min_code_lcoes].sum()
-        grid_connect_limit -= new_grid_connections.loc[grid_lcoe < min_code_lcoes].sum()
+        grid_capacity_limit -= peak_load[grid_lcoe < min_code_lcoes].sum()
+        grid_connect_limit -= new_grid_connections[grid_lcoe < min_code_lcoes].sum()
 
         # Update values for settlements that meet conditions
         cell_path_real = np.where(grid_lcoe < min_code_lcoes, prev_dist + dist, cell_path_real)
@@ -2180,9 +2469,14 @@ class SettlementProcessor:
 
     @staticmethod
     def optimize_mini_grid(ghi_curve, temp, energy, tier, diesel_price, start_year, end_year,
-                           year, time_step, mg_pv_hybrid_specs):
+                           year, time_step, mg_pv_hybrid_specs, typical_days=None, optimizer='scipy', seed=0,
+                           warm_start=None, full_output=False):
+
+        if warm_start is not None and optimizer == 'bisection':
+            raise ValueError('warm_start cannot be used with the bisection optimizer, which searches a fixed grid')
 
-        load_curve = calc_load_curve(tier, energy)
+        # The simulation is run with the precision of the resource data (float32 or float64)
+        load_curve = calc_load_curve(tier, energy, ghi_curve.dtype)
 
         def optimizer_de(diesel_price,
                          hourly_ghi,
@@ -2228,72 +2522,209 @@ class SettlementProcessor:
                 for j in prange(24):
                     hour_numbers[i * 24 + j] = j
 
-            def opt_func(X):
-                lcoe = find_least_cost_option(X, hourly_temp, hourly_ghi, hour_numbers,
-                                              load_curve, inv_eff, n_dis, n_chg, dod_max,
-                                              diesel_price, end_year, start_year, pv_cost, charge_controller,
-                                              pv_inverter, pv_om,
-                                              diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
-                                              diesel_life, pv_life,
-                                              battery_cost, discount_rate, lpsp_max, diesel_limit,
-                                              full_life_cycles)[0]
-
-                return lcoe
+            # The discounting and the peak load are the same for all configurations, so they are only calculated once
+            peak_load = load_curve.max()
+            lcoe_factors = hybrid_lcoe_factors(end_year, start_year, discount_rate,
+                                               max(pv_life, diesel_life, battery_inverter_life, 20))
+
+            def evaluate(X, series):
+                # series holds the (temp, ghi, hour numbers, load, hour weights) to simulate the configuration for
+                series_temp, series_ghi, series_hours, series_load, series_weights = series
+                return find_least_cost_option(X, series_temp, series_ghi, series_hours, series_load, peak_load,
+                                              inv_eff, n_dis, n_chg, dod_max, diesel_price, pv_cost,
+                                              charge_controller, pv_inverter, pv_om, diesel_cost, diesel_om,
+                                              battery_inverter_life, battery_inverter_cost, diesel_life, pv_life,
+                                              battery_cost, lpsp_max, diesel_limit, full_life_cycles, lcoe_factors,
+                                              series_weights)
+
+            # Number of simulations run by the optimizer(s), used to track the convergence
+            n_evaluations_total = [0]
+
+            def search(series, bounds=bounds, popsize=15, engine=optimizer):
+                series_temp, series_ghi, series_hours, series_load, series_weights = series
+                lb = np.array(bounds.lb, dtype=float)
+                ub = np.array(bounds.ub, dtype=float)
+
+                if engine == 'numba':
+                    # The whole search runs in compiled code, with a fixed seed
+                    specs = pv_hybrid_specs_record(mg_pv_hybrid_specs)
+                    init = None
+                    if warm_start is not None and len(warm_start) > 0:
+                        init = warm_start_population(warm_start, lb, ub, seed=seed)
+                    x, lcoe, n_evaluations = differential_evolution_jit(
+                        series_temp, series_ghi, series_hours, series_load, peak_load, diesel_price, specs,
+                        lcoe_factors, lb, ub, seed, popsize, hour_weights=series_weights, init=init)
+
+                    if lcoe == 99 and init is not None:
+                        # None of the warm-started configurations was feasible, so the full space is searched instead
+                        n_evaluations_total[0] += n_evaluations
+                        x, lcoe, n_evaluations = differential_evolution_jit(
+                            series_temp, series_ghi, series_hours, series_load, peak_load, diesel_price, specs,
+                            lcoe_factors, lb, ub, seed, popsize, hour_weights=series_weights)
+                    logging.debug('Compiled DE LCOE: {:.4f} after {} evaluations'.format(lcoe, n_evaluations))
+                    n_evaluations_total[0] += n_evaluations
+                    return [x[0], x[1], x[2]]
+
+                if engine == 'bisection':
+                    # Grid search over PV and battery, with the smallest feasible diesel capacity found by bisection
+                    x, lcoe, n_evaluations = grid_bisection_search(
+                        series_temp, series_ghi, series_hours, series_load, peak_load, diesel_price,
+                        pv_hybrid_specs_record(mg_pv_hybrid_specs), lcoe_factors, lb, ub,
+                        hour_weights=series_weights)
+                    logging.debug('Grid-bisection LCOE: {:.4f} after {} evaluations'.format(lcoe, n_evaluations))
+                    n_evaluations_total[0] += n_evaluations
+                    return [x[0], x[1], x[2]]
+
+                n_evaluations = [0]
+
+                def opt_func(X):
+                    # X has shape (3, S) when the whole population is evaluated at once, and (3,) when polishing
+                    configurations = np.ascontiguousarray(np.reshape(X, (3, -1)).T)
+                    n_evaluations[0] += len(configurations)
+                    lcoe = find_least_cost_option_batch(configurations, series_temp, series_ghi, series_hours,
+                                                        series_load, peak_load, inv_eff, n_dis, n_chg, dod_max,
+                                                        diesel_price, pv_cost, charge_controller, pv_inverter, pv_om,
+                                                        diesel_cost, diesel_om, battery_inverter_life,
+                                                        battery_inverter_cost, diesel_life, pv_life, battery_cost,
+                                                        lpsp_max, diesel_limit, full_life_cycles, lcoe_factors,
+                                                        series_weights)
+
+                    return lcoe if np.ndim(X) > 1 else lcoe[0]
+
+                if warm_start is not None and len(warm_start) > 0:
+                    # The population starts around the given configurations (e.g. optima of neighbouring cells),
+                    # which needs far fewer generations than a search of the full space
+                    init = warm_start_population(warm_start, lb, ub, seed=seed)
+                else:
+                    init = 'latinhypercube'  # init='halton' on newer env
+
+                ret = differential_evolution(opt_func, bounds, popsize=popsize, init=init, seed=seed,
+                                             vectorized=True, updating='deferred')
+
+                if ret.fun == 99 and not isinstance(init, str):
+                    # None of the warm-started configurations was feasible, so the full space is searched instead
+                    ret = differential_evolution(opt_func, bounds, popsize=popsize, init='latinhypercube', seed=seed,
+                                                 vectorized=True, updating='deferred')
+
+                logging.debug('DE LCOE: {:.4f} after {} evaluations'.format(ret.fun, n_evaluations[0]))
+                n_evaluations_total[0] += n_evaluations[0]
+
+                return [ret.x[0], ret.x[1], ret.x[2]]
+
+            full_year = (hourly_temp, hourly_ghi, hour_numbers, load_curve, None)
+
+            if typical_days:
+                # The optimizer searches a reduced year made of representative days, each weighted by the number of
+                # days it stands for, and the optimum found is then simulated again with the full hourly resolution
+                hours, hour_weights = select_typical_days([hourly_ghi, hourly_temp], typical_days)
+                reduced_year = (hourly_temp[hours], hourly_ghi[hours], hour_numbers[hours], load_curve[hours],
+                                hour_weights)
+
+                X = search(reduced_year)
+                reduced_result = evaluate(X, reduced_year)
+                result = evaluate(X, full_year)
+
+                # The optimum of the reduced year often lies right at the reliability constraint, which it may not
+                # meet over the full year. In that case a short search with the full resolution is run in a narrow box
+                # around it
+                if result[0] == 99:
+                    logging.info('Typical days ({}) optimum not feasible with full resolution, refining'.format(
+                        typical_days))
+                    width = 0.1 * (max_bounds - min_bounds)
+                    local_bounds = Bounds(np.maximum(np.array(X) - width, min_bounds),
+                                          np.minimum(np.array(X) + width, max_bounds))
+                    X = search(full_year, local_bounds, popsize=5)
+                    result = evaluate(X, full_year)
+
+                logging.info('Typical days ({}) LCOE: {:.4f}, full resolution LCOE: {:.4f}, error: {:.4f}'.format(
+                    typical_days, reduced_result[0], result[0], reduced_result[0] - result[0]))
+            else:
+                X = search(full_year)
+                result = evaluate(X, full_year)
 
-            ret = differential_evolution(opt_func, bounds, popsize=15,
-                                         init='latinhypercube')  # init='halton' on newer env
+            return result, X, n_evaluations_total[0]
 
-            X = [ret.x[0], ret.x[1], ret.x[2]]
+        result, X, n_evaluations = optimizer_de(diesel_price=diesel_price,
+                                                hourly_ghi=ghi_curve,
+                                                hourly_temp=temp,
+                                                load_curve=load_curve,
+                                                start_year=start_year,
+                                                end_year=end_year,
+                                                )
 
-            result = find_least_cost_option(X, hourly_temp, hourly_ghi, hour_numbers,
-                                            load_curve, inv_eff, n_dis, n_chg, dod_max,
-                                            diesel_price, end_year, start_year, pv_cost, charge_controller,
-                                            pv_inverter, pv_om,
-                                            diesel_cost, diesel_om, battery_inverter_life, battery_inverter_cost,
-                                            diesel_life, pv_life,
-                                            battery_cost, discount_rate, lpsp_max, diesel_limit,
-                                            full_life_cycles)
+        if full_output:
+            # The optimal (pv, battery, diesel) sizing and the number of simulations needed to find it are also
+            # returned, e.g. to warm-start the optimization of similar settlements
+            return result[0], result[3], result[8] + result[9], result[4], X, n_evaluations
 
-            return result
+        return result[0], result[3], result[8] + result[9], result[4]
 
-        result = optimizer_de(diesel_price=diesel_price,
-                              hourly_ghi=ghi_curve,
-                              hourly_temp=temp,
-                              load_curve=load_curve,
-                              start_year=start_year,
-                              end_year=end_year,
-                              )
+    def pv_hybrids_lcoe(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_folder_path=r'../test_data',
+                        typical_days=None, dtype=np.float64, processes=None, quantize=None, seed=0):
+        """
+        Optimizes the PV-hybrid mini-grid of each potential mini-grid settlement. The settlements with the same tier,
+        GHI, diesel price and demand are optimized only once, and with processes the optimizations are run in a pool of
+        worker processes (see build_hybrid_lookup_table).
 
-        return result[0], result[3], result[8] + result[9], result[4]
+        quantize is an optional dict of the steps to round the 'ghi' (kWh/m2), 'diesel' (USD/l) and 'energy'
+        (kWh/year) of the settlements to, before they are grouped, so that fewer optimizations are needed.
 
-    def pv_hybrids_lcoe(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_folder_path=r'../test_data'):
+        Each optimization is seeded with cell_seed(seed, (tier, ghi, diesel price, energy)), so the results are the
+        same with or without processes
+        """
         logging.info('Starting hybrid gen lcoe')
 
         self.df['PVHybridGenLCOE' + "{}".format(year)] = 0.
 
         pv_path = pv_folder_path
         # os.path.join(pv_folder_path, 'sl-2-pv.csv') # ToDo, should use multiple PV files
-        ghi_curve, temp = read_environmental_data(pv_path)
+        ghi_curve, temp = read_environmental_data(pv_path, dtype=dtype)
 
         self.df['PotentialMG'] = np.where(((self.df[SET_POP + "{}".format(year)] > mg_pv_hybrid_specs['min_mg_size_ppl'])
                                           & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
                                           (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) |
                                           (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5), 1, 0)
 
-        gen_lcoe, inv, cap, fuel_cost = zip(
-            *self.df.apply(lambda row: self.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / row[SET_GHI]),
-                                                               temp,
-                                                               row[SET_ENERGY_PER_CELL + '{}'.format(year)],
-                                                               row[SET_TIER],
-                                                               row[SET_MG_DIESEL_FUEL + '{}'.format(year)],
-                                                               year - time_step,
-                                                               end_year,
-                                                               year,
-                                                               time_step,
-                                                               mg_pv_hybrid_specs)
-            if row['PotentialMG'] == 1
-            else [99, 0, 0, 0],
-                           axis=1))
+        potential_mg = self.df['PotentialMG'].values == 1
+        requests = np.column_stack([self.df[SET_TIER].values[potential_mg],
+                                    self.df[SET_GHI].values[potential_mg],
+                                    self.df[SET_MG_DIESEL_FUEL + '{}'.format(year)].values[potential_mg],
+                                    self.df[SET_ENERGY_PER_CELL + '{}'.format(year)].values[potential_mg]])
+        if quantize:
+            for column, name in [(1, 'ghi'), (2, 'diesel'), (3, 'energy')]:
+                if name in quantize:
+                    requests[:, column] = np.round(requests[:, column] / quantize[name]) * quantize[name]
+
+        unique_requests, settlement_request = np.unique(requests, axis=0, return_inverse=True)
+        logging.info('Hybrid optimization: {} settlements, {} unique optimizations'.format(len(requests),
+                                                                                          len(unique_requests)))
+
+        if processes:
+            cells = [(int(t), g, d, e) for t, g, d, e in unique_requests]
+            table = build_hybrid_lookup_table(cells, (ghi_curve, temp), year, time_step, end_year, mg_pv_hybrid_specs,
+                                              'pv', processes, seed, typical_days=typical_days)
+            results = np.array([table[cell] for cell in cells])
+        else:
+            results = np.array([self.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / g),
+                                                        temp,
+                                                        e,
+                                                        int(t),
+                                                        d,
+                                                        year - time_step,
+                                                        end_year,
+                                                        year,
+                                                        time_step,
+                                                        mg_pv_hybrid_specs,
+                                                        typical_days,
+                                                        seed=cell_seed(seed, (t, g, d, e)))
+                                for t, g, d, e in unique_requests])
+
+        # The results of the unique optimizations are scattered back to the settlements
+        hybrid_values = np.zeros((len(self.df), 4))
+        hybrid_values[:, 0] = 99
+        if len(unique_requests) > 0:
+            hybrid_values[potential_mg] = results.reshape(-1, 4)[settlement_request.ravel()]
+        gen_lcoe, inv, cap, fuel_cost = hybrid_values.T
 
         del self.df['PotentialMG']
 
@@ -2308,14 +2739,33 @@ class SettlementProcessor:
 
         return hybrid_lcoe, hybrid_capacity, hybrid_investment
 
-    def pv_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_path=r'../test_data'):
+    def pv_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_pv_hybrid_specs, pv_path=r'../test_data',
+                                    typical_days=None, optimizer='scipy', seed=0, warm_start=False,
+                                    dispatch_cache=None, dtype=np.float64, processes=None, cache_folder=None,
+                                    interpolate=False, adaptive_tolerance=None):
+        """
+        Builds a lookup table of the least-cost PV-hybrid mini-grid of each (tier, GHI, diesel price) cell and looks up
+        the settlements in it.
+
+        optimizer is the engine of optimize_mini_grid ('scipy', 'numba' or 'bisection'). Unless adaptive_tolerance or
+        dispatch_cache is given, 'numba' optimizes all cells in one compiled call, over all available cores, which
+        cannot be combined with typical_days, warm_start or processes. warm_start cannot be used with 'bisection'
+        either.
+
+        With warm_start, the cells are solved one after the other in this process, each seeded with the optima of its
+        solved neighbours, so it cannot be combined with processes, where the cells are solved independently
+        """
         logging.info('Starting hybrid gen lcoe')
+        if warm_start and optimizer == 'bisection':
+            raise ValueError('warm_start cannot be used with the bisection optimizer, which searches a fixed grid')
+        if warm_start and processes:
+            raise ValueError('warm_start cannot be used with processes, as the cells are then solved independently')
         # lats = sorted(self.df['Y_deg'].round().unique())
         # longs = sorted(self.df['X_deg'].round().unique())
 
         self.df['PVHybridGenLCOE' + "{}".format(year)] = 0.
 
-        ghi_curve, temp = read_environmental_data(pv_path)
+        ghi_curve, temp = read_environmental_data(pv_path, dtype=dtype)
 
         ghi_min = round(min(self.df[SET_GHI]), -2)
         ghi_max = round(max(self.df[SET_GHI]), -2)
@@ -2326,57 +2776,158 @@ class SettlementProcessor:
 
         tiers = [1, 2, 3, 4, 5]
 
-        pv_hybrids_lcoe = {}
-        pv_hybrid_investment = {}
-        pv_hybrid_capacity = {}
-        pv_hybrid_fuel_cost = {}
+        if cache_folder is None:
+            lookup_table = HybridLookupTable(tiers, ghi_range, diesel_range)
+        else:
+            # The cells solved before with the same inputs are read from the cache, so only the others are optimized
+            dispatch_settings = None if dispatch_cache is None else \
+                (dispatch_cache.energy, dispatch_cache.n_grid, dispatch_cache.n_refine, dispatch_cache.n_bisections)
+            lookup_table = HybridLookupTableCache(cache_folder, pv_path, tiers, ghi_range, diesel_range,
+                                                  technology='pv', specs=mg_pv_hybrid_specs, year=year,
+                                                  time_step=time_step, end_year=end_year, typical_days=typical_days,
+                                                  optimizer=optimizer, seed=seed, seeding='cell',
+                                                  warm_start=warm_start,
+                                                  dispatch_cache=dispatch_settings, dtype=np.dtype(dtype).name,
+                                                  adaptive_tolerance=adaptive_tolerance)
+            logging.info('Hybrid lookup table: {} of {} cells read from {}'.format(
+                len(lookup_table.solved()), len(lookup_table.cells), lookup_table.path))
+
+        if adaptive_tolerance is not None:
+            # Only the cells where the lcoe is not smooth enough to be interpolated are optimized, with the
+            # HybridDispatchCache if given
+            def solve(t, g, d):
+                if dispatch_cache is not None:
+                    return dispatch_cache.optimize(t, g, d, year - time_step, end_year, mg_pv_hybrid_specs)
+                return self.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / g), temp, 10000, t, d,
+                                               year - time_step, end_year, year, time_step, mg_pv_hybrid_specs,
+                                               typical_days, optimizer, cell_seed(seed, (t, g, d)))
+
+            n_solved = lookup_table.build_adaptive(solve, adaptive_tolerance)
+            logging.info('Hybrid lookup table: {} of {} cells optimized'.format(n_solved, len(lookup_table.cells)))
+        elif dispatch_cache is not None:
+            # The dispatch results are reused from the HybridDispatchCache, which only simulates the tiers and GHI
+            # levels it has not seen before. The diesel price and the study period only affect the financial evaluation
+            for t in tiers:
+                for g in ghi_range:
+                    for d in diesel_range:
+                        if (t, g, d) not in lookup_table:
+                            lookup_table.add((t, g, d), dispatch_cache.optimize(t, g, d, year - time_step, end_year,
+                                                                                mg_pv_hybrid_specs))
+        elif optimizer == 'numba':
+            # All cells of the table are optimized in one compiled call, spread over all available cores
+            if typical_days or warm_start or processes:
+                raise ValueError('typical_days, warm_start and processes cannot be used when the lookup table is '
+                                 'optimized in one compiled call (optimizer=\'numba\')')
+            cells = np.array([[t, g, d] for t in tiers for g in ghi_range for d in diesel_range
+                              if (t, g, d) not in lookup_table], dtype=float).reshape(-1, 3)
+            seeds = np.array([cell_seed(seed, cell) for cell in cells], dtype=np.int64)
+
+            hour_numbers = np.tile(np.arange(24, dtype=float), 365)
+            specs = mg_pv_hybrid_specs
+            lcoe_factors = hybrid_lcoe_factors(end_year, year - time_step, specs['discount_rate'],
+                                               max(specs['pv_life'], specs['diesel_life'],
+                                                   specs['battery_inverter_life'], 20))
+
+            results = optimize_mini_grid_cells(cells, ghi_curve, temp, hour_numbers, 10000.,
+                                               pv_hybrid_specs_record(specs), lcoe_factors, seeds)
+
+            for (t, g, d), result in zip(cells, results):
+                lookup_table.add((int(t), g, d), result)
+        elif processes:
+            # The cells are optimized independently of each other in a pool of worker processes
+            cells = [(t, g, d) for t in tiers for g in ghi_range for d in diesel_range
+                     if (t, g, d) not in lookup_table]
+            build_hybrid_lookup_table(cells, (ghi_curve, temp), year, time_step, end_year, mg_pv_hybrid_specs, 'pv',
+                                      processes, seed, callback=lookup_table.add,
+                                      typical_days=typical_days, optimizer=optimizer)
+        else:
+            # The cells are solved in a serpentine order over GHI and diesel price, so that every cell after the first
+            # one is next to an already solved cell. With warm_start, the optima of the solved neighbours (and of the
+            # same cell in the previous tier) seed the optimizer
+            optima = {}
+            n_evaluations = []
+            for t in tiers:
+                for i, g in enumerate(ghi_range):
+                    for j in (range(len(diesel_range)) if i % 2 == 0 else reversed(range(len(diesel_range)))):
+                        d = diesel_range[j]
+                        if (t, g, d) in lookup_table:
+                            continue
+                        neighbours = [(t, i - 1, j), (t, i + 1, j), (t, i, j - 1), (t, i, j + 1), (t - 1, i, j)]
+                        seeds = [optima[n] for n in neighbours if n in optima] if warm_start else None
+
+                        gen_lcoe, inv, cap, fuel_cost, x, n = \
+                            self.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / g),
+                                                    temp,
+                                                    10000,
+                                                    t,
+                                                    d,
+                                                    year - time_step,
+                                                    end_year,
+                                                    year,
+                                                    time_step,
+                                                    mg_pv_hybrid_specs,
+                                                    typical_days,
+                                                    optimizer,
+                                                    cell_seed(seed, (t, g, d)),
+                                                    seeds,
+                                                    full_output=True)
+
+                        if gen_lcoe < 99:
+                            optima[t, i, j] = x
+                        n_evaluations.append(n)
+
+                        lookup_table.add((t, g, d), (gen_lcoe, inv, cap, fuel_cost))
+
+            if n_evaluations:
+                logging.info('Hybrid lookup table: {} cells, {:.0f} simulations per cell on average'.format(
+                    len(n_evaluations), np.mean(n_evaluations)))
+
+        if cache_folder is not None:
+            lookup_table.save()
+
+        potential_mg = ((self.df[SET_POP + "{}".format(year)] > mg_pv_hybrid_specs['min_mg_size_ppl'])
+                        & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
+                        (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) | \
+                       (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5)
+
+        # All settlements are looked up in the table at once, the others get the values of no mini-grid
+        hybrid_values = lookup_table.query(self.df[SET_TIER], self.df[SET_GHI],
+                                           self.df[SET_MG_DIESEL_FUEL + "{}".format(year)], interpolate)
+        hybrid_values[:, ~potential_mg.values] = np.array([[99], [0], [0], [0]])
+        hybrid_series = pd.DataFrame(hybrid_values.T, index=self.df.index)
 
-        for t in tiers:
-            for g in ghi_range:
-                for d in diesel_range:
-                    gen_lcoe, inv, cap, fuel_cost = \
-                        self.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / g),
-                                                temp,
-                                                10000,
-                                                t,
-                                                d,
-                                                year - time_step,
-                                                end_year,
-                                                year,
-                                                time_step,
-                                                mg_pv_hybrid_specs)
-
-                    pv_hybrids_lcoe[t, g, d] = gen_lcoe
-                    pv_hybrid_investment[t, g, d] = inv
-                    pv_hybrid_capacity[t, g, d] = cap
-                    pv_hybrid_fuel_cost[t, g, d] = fuel_cost
-
-        def local_hybrid(ghi, diesel, tier, energy):
-            ghi = round(ghi, -2)
-            diesel = round(diesel, 1)
-
-            hybrid_lcoe = pv_hybrids_lcoe[tier, ghi, diesel]
-            hybrid_investment = pv_hybrid_investment[tier, ghi, diesel] #* (energy / 10000)
-            hybrid_capacity = pv_hybrid_capacity[tier, ghi, diesel] #* (energy / 10000)
-            hybrid_fuel_cost = pv_hybrid_fuel_cost[tier, ghi, diesel] #* (energy / 10000)
-
-            return hybrid_lcoe, hybrid_investment, hybrid_capacity, hybrid_fuel_cost
-
-        self.df['PotentialMG'] = np.where(
-            ((self.df[SET_POP + "{}".format(year)] > mg_pv_hybrid_specs['min_mg_size_ppl'])
-             & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
-             (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) |
-            (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5), 1, 0)
-
-        hybrid_series = self.df.apply(
-            lambda row: local_hybrid(row[SET_GHI], row[SET_MG_DIESEL_FUEL + "{}".format(year)],
-                                     row[SET_TIER], row[SET_ENERGY_PER_CELL + "{}".format(year)])
-            if row['PotentialMG'] == 1
-            else [99, 0, 0, 0],
-            axis=1,
-            result_type='expand')
+        hybrid_lcoe = pd.Series(hybrid_series[0])
+        hybrid_capacity = pd.Series(hybrid_series[2] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        hybrid_investment = pd.Series(hybrid_series[1] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        fuel_cost = pd.Series(hybrid_series[3] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        emission_factor = fuel_cost / self.df[
+            SET_MG_DIESEL_FUEL + '{}'.format(year)] * 256.9131097 * 9.9445485  # ToDo check emission factor
+        self.df['PVHybridEmissionFactor' + "{}".format(year)] = emission_factor
+        self.df['PVHybridGenLCOE' + "{}".format(year)] += hybrid_lcoe
 
-        del self.df['PotentialMG']
+        return hybrid_lcoe, hybrid_capacity, hybrid_investment, lookup_table
+
+    def pv_hybrids_lcoe_surrogate(self, year, time_step, end_year, mg_pv_hybrid_specs, surrogate):
+        logging.info('Starting hybrid gen lcoe')
+
+        if (surrogate.start_year, surrogate.end_year) != (year - time_step, end_year):
+            raise ValueError('The hybrid surrogate was trained for {}-{}, not for {}-{}'.format(
+                surrogate.start_year, surrogate.end_year, year - time_step, end_year))
+
+        self.df['PVHybridGenLCOE' + "{}".format(year)] = 0.
+
+        potential_mg = ((self.df[SET_POP + "{}".format(year)] > mg_pv_hybrid_specs['min_mg_size_ppl'])
+                        & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
+                        (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) | \
+                       (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5)
+
+        # The surrogate predicts all potential mini-grids at once, with the costs of mg_pv_hybrid_specs
+        hybrid_values = np.zeros((4, len(self.df)))
+        hybrid_values[0] = 99
+        hybrid_values[:, potential_mg.values] = surrogate.predict(
+            self.df.loc[potential_mg, SET_TIER].values, self.df.loc[potential_mg, SET_GHI].values,
+            self.df.loc[potential_mg, SET_MG_DIESEL_FUEL + "{}".format(year)].values, **mg_pv_hybrid_specs)
+        hybrid_series = pd.DataFrame(hybrid_values.T, index=self.df.index)
 
         hybrid_lcoe = pd.Series(hybrid_series[0])
         hybrid_capacity = pd.Series(hybrid_series[2] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
@@ -2387,13 +2938,69 @@ class SettlementProcessor:
         self.df['PVHybridEmissionFactor' + "{}".format(year)] = emission_factor
         self.df['PVHybridGenLCOE' + "{}".format(year)] += hybrid_lcoe
 
-        return hybrid_lcoe, hybrid_capacity, hybrid_investment, pv_hybrid_investment
+        return hybrid_lcoe, hybrid_capacity, hybrid_investment
+
+    def pv_hybrids_lcoe_library(self, year, time_step, end_year, mg_pv_hybrid_specs, library, **kwargs):
+        """
+        Optimizes the PV-hybrid mini-grids with the hourly profiles of the nearest site of a ResourceLibrary, instead of
+        one profile scaled to the GHI of each settlement. A lookup table of (tier, site, diesel price) is built for the
+        sites nearest to the potential mini-grids, each site profile being read from the memory-mapped library only
+        while its cells are optimized. kwargs are additional arguments to optimize_mini_grid
+        """
+        logging.info('Starting hybrid gen lcoe')
+
+        self.df['PVHybridGenLCOE' + "{}".format(year)] = 0.
+
+        potential_mg = ((self.df[SET_POP + "{}".format(year)] > mg_pv_hybrid_specs['min_mg_size_ppl'])
+                        & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
+                        (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) | \
+                       (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5)
+
+        site = library.nearest(self.df[SET_X_DEG], self.df[SET_Y_DEG])
+
+        diesel_min = round(min(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)]), 1)
+        diesel_max = round(max(self.df[SET_MG_DIESEL_FUEL + "{}".format(year)]), 1)
+        diesel_range = np.round(np.arange(diesel_min, diesel_max + 0.1, 0.1), 1)
+        site_range = np.unique(site[potential_mg.values])
+
+        tiers = [1, 2, 3, 4, 5]
+
+        lookup_table = HybridLookupTable(tiers, site_range, diesel_range)
+        for s in site_range:
+            ghi_curve, temp = library.profile(s)
+            for t in tiers:
+                for d in diesel_range:
+                    lookup_table.add((t, s, d), self.optimize_mini_grid(ghi_curve, temp, 10000, t, d, year - time_step,
+                                                                        end_year, year, time_step, mg_pv_hybrid_specs,
+                                                                        **kwargs))
+        logging.info('Hybrid lookup table: {} sites of {} in the resource library'.format(len(site_range),
+                                                                                          len(library)))
+
+        # All settlements are looked up in the table at once, the others get the values of no mini-grid
+        hybrid_values = np.zeros((4, len(self.df)))
+        hybrid_values[0] = 99
+        if len(site_range) > 0:
+            hybrid_values[:, potential_mg.values] = lookup_table.query(
+                self.df.loc[potential_mg, SET_TIER], site[potential_mg.values],
+                self.df.loc[potential_mg, SET_MG_DIESEL_FUEL + "{}".format(year)])
+        hybrid_series = pd.DataFrame(hybrid_values.T, index=self.df.index)
+
+        hybrid_lcoe = pd.Series(hybrid_series[0])
+        hybrid_capacity = pd.Series(hybrid_series[2] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        hybrid_investment = pd.Series(hybrid_series[1] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        fuel_cost = pd.Series(hybrid_series[3] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
+        emission_factor = fuel_cost / self.df[
+            SET_MG_DIESEL_FUEL + '{}'.format(year)] * 256.9131097 * 9.9445485  # ToDo check emission factor
+        self.df['PVHybridEmissionFactor' + "{}".format(year)] = emission_factor
+        self.df['PVHybridGenLCOE' + "{}".format(year)] += hybrid_lcoe
+
+        return hybrid_lcoe, hybrid_capacity, hybrid_investment, lookup_table
 
     @staticmethod
     def optimize_wind_mini_grid(wind_curve, energy, tier, diesel_price, start_year, end_year,
-                                year, time_step, mg_wind_hybrid_specs):
+                                year, time_step, mg_wind_hybrid_specs, typical_days=None, seed=0, popsize=15):
 
-        load_curve = calc_load_curve(tier, energy)
+        load_curve = calc_load_curve(tier, energy, wind_curve.dtype)
 
         def optimizer_wind_de(diesel_price,
                              hourly_wind,
@@ -2422,7 +3029,7 @@ class SettlementProcessor:
 
             demand = load_curve.sum()
 
-            # The following lines defines the solution space for the Particle Swarm Optimization (PSO) algorithm
+            # The following lines defines the solution space for the Differential Evolution (DE) algorithm
             battery_bounds = [0, 5 * demand / 365]
             wind_bounds = [0, 5 * max(load_curve)]
             diesel_bounds = [0.5, max(load_curve)]
@@ -2437,28 +3044,71 @@ class SettlementProcessor:
                 for j in prange(24):
                     hour_numbers[i * 24 + j] = j
 
-            # def opt_func(X):
-            #     lcoe = find_least_cost_option_wind(X, hourly_wind, hour_numbers, load_curve, inv_eff, n_dis, n_chg,
-            #                                        dod_max, diesel_price, end_year, start_year, wind_cost,
-            #                                        charge_controller, wind_om, diesel_cost, diesel_om,
-            #                                        battery_inverter_life, battery_inverter_cost, diesel_life,
-            #                                        wind_life, battery_cost, discount_rate, lpsp_max, diesel_limit,
-            #                                        full_life_cycles)[0]
-            #
-            #     return lcoe
-            #
-            # ret = differential_evolution(opt_func, bounds, popsize=15,
-            #                              init='latinhypercube')  # init='halton' on newer env
-            #
-            # X = [ret.x[0], ret.x[1], ret.x[2]]
-
-            X = [(wind_bounds[0] + wind_bounds[1])/2, (battery_bounds[0] + battery_bounds[1])/2, (diesel_bounds[0] + diesel_bounds[1])/2]
-
-            result = find_least_cost_option_wind(X, hourly_wind, hour_numbers, load_curve, inv_eff, n_dis, n_chg,
-                                                 dod_max, diesel_price, end_year, start_year, wind_cost,
-                                                 charge_controller, wind_om, diesel_cost, diesel_om,
-                                                 battery_inverter_life, battery_inverter_cost, diesel_life, wind_life,
-                                                 battery_cost, discount_rate, lpsp_max, diesel_limit, full_life_cycles)
+            peak_load = load_curve.max()
+            lcoe_factors = hybrid_lcoe_factors(end_year, start_year, discount_rate,
+                                               max(wind_life, diesel_life, battery_inverter_life, 20))
+
+            def evaluate(X, series):
+                # series holds the (wind, hour numbers, load, hour weights) to simulate the configuration for
+                series_wind, series_hours, series_load, series_weights = series
+                return find_least_cost_option_wind(X, series_wind, series_hours, series_load, peak_load, inv_eff,
+                                                   n_dis, n_chg, dod_max, diesel_price, wind_cost, charge_controller,
+                                                   wind_om, diesel_cost, diesel_om, battery_inverter_life,
+                                                   battery_inverter_cost, diesel_life, wind_life, battery_cost,
+                                                   lpsp_max, diesel_limit, full_life_cycles, lcoe_factors,
+                                                   series_weights)
+
+            def search(series, bounds=bounds, popsize=popsize):
+                series_wind, series_hours, series_load, series_weights = series
+                n_evaluations = [0]
+
+                def opt_func(X):
+                    # X has shape (3, S) when the whole population is evaluated at once, and (3,) when polishing
+                    configurations = np.ascontiguousarray(np.reshape(X, (3, -1)).T)
+                    n_evaluations[0] += len(configurations)
+                    lcoe = find_least_cost_option_wind_batch(configurations, series_wind, series_hours, series_load,
+                                                             peak_load, inv_eff, n_dis, n_chg, dod_max, diesel_price,
+                                                             wind_cost, charge_controller, wind_om, diesel_cost,
+                                                             diesel_om, battery_inverter_life, battery_inverter_cost,
+                                                             diesel_life, wind_life, battery_cost, lpsp_max,
+                                                             diesel_limit, full_life_cycles, lcoe_factors,
+                                                             series_weights)
+
+                    return lcoe if np.ndim(X) > 1 else lcoe[0]
+
+                ret = differential_evolution(opt_func, bounds, popsize=popsize, init='latinhypercube', seed=seed,
+                                             vectorized=True, updating='deferred')
+
+                logging.debug('Wind DE LCOE: {:.4f} after {} evaluations'.format(ret.fun, n_evaluations[0]))
+
+                return [ret.x[0], ret.x[1], ret.x[2]]
+
+            full_year = (hourly_wind, hour_numbers, load_curve, None)
+
+            if typical_days:
+                # Same reduced year of representative days as for the PV hybrids. The optimum found is simulated again
+                # with the full hourly resolution, and refined around if it does not meet the constraints over the year
+                hours, hour_weights = select_typical_days([hourly_wind], typical_days)
+                reduced_year = (hourly_wind[hours], hour_numbers[hours], load_curve[hours], hour_weights)
+
+                X = search(reduced_year)
+                reduced_result = evaluate(X, reduced_year)
+                result = evaluate(X, full_year)
+
+                if result[0] == 99:
+                    logging.info('Typical days ({}) optimum not feasible with full resolution, refining'.format(
+                        typical_days))
+                    width = 0.1 * (max_bounds - min_bounds)
+                    local_bounds = Bounds(np.maximum(np.array(X) - width, min_bounds),
+                                          np.minimum(np.array(X) + width, max_bounds))
+                    X = search(full_year, local_bounds, popsize=5)
+                    result = evaluate(X, full_year)
+
+                logging.info('Typical days ({}) LCOE: {:.4f}, full resolution LCOE: {:.4f}, error: {:.4f}'.format(
+                    typical_days, reduced_result[0], result[0], reduced_result[0] - result[0]))
+            else:
+                X = search(full_year)
+                result = evaluate(X, full_year)
 
             return result
 
@@ -2486,7 +3136,7 @@ class SettlementProcessor:
                                           (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5), 1, 0)
 
         gen_lcoe, inv, cap, fuel_cost = zip(
-            *self.df.apply(lambda row: self.optimize_mini_grid_wind(wind_curve * row[SET_WINDVEL] / np.average(wind_curve),
+            *self.df.apply(lambda row: self.optimize_wind_mini_grid(wind_curve * row[SET_WINDVEL] / np.average(wind_curve),
                                                                     row[SET_ENERGY_PER_CELL + '{}'.format(year)],
                                                                     row[SET_TIER],
                                                                     row[SET_MG_DIESEL_FUEL + '{}'.format(year)],
@@ -2512,7 +3162,9 @@ class SettlementProcessor:
 
         return hybrid_lcoe, hybrid_capacity, hybrid_investment
 
-    def wind_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_wind_hybrid_specs, wind_path=r'../test_data'):
+    def wind_hybrids_lcoe_lookuptable(self, year, time_step, end_year, mg_wind_hybrid_specs, wind_path=r'../test_data',
+                                      processes=None, cache_folder=None, interpolate=False, adaptive_tolerance=None,
+                                      seed=0):
         logging.info('Starting wind hybrid gen lcoe')
         # lats = sorted(self.df['Y_deg'].round().unique())
         # longs = sorted(self.df['X_deg'].round().unique())
@@ -2530,56 +3182,66 @@ class SettlementProcessor:
 
         tiers = [1, 2, 3, 4, 5]
 
-        wind_hybrids_lcoe = {}
-        wind_hybrid_investment = {}
-        wind_hybrid_capacity = {}
-        wind_hybrid_fuel_cost = {}
-
-        for t in tiers:
-            for g in wind_range:
-                for d in diesel_range:
-                    gen_lcoe, inv, cap, fuel_cost = \
-                        self.optimize_wind_mini_grid(wind_curve * g / np.average(wind_curve),
-                                                     10000,
-                                                     t,
-                                                     d,
-                                                     year - time_step,
-                                                     end_year,
-                                                     year,
-                                                     time_step,
-                                                     mg_wind_hybrid_specs)
-
-                    wind_hybrids_lcoe[t, g, d] = gen_lcoe
-                    wind_hybrid_investment[t, g, d] = inv
-                    wind_hybrid_capacity[t, g, d] = cap
-                    wind_hybrid_fuel_cost[t, g, d] = fuel_cost
-
-        def local_hybrid(wind, diesel, tier, energy):
-            wind = round(wind)
-            diesel = round(diesel, 1)
-
-            hybrid_lcoe = wind_hybrids_lcoe[tier, wind, diesel]
-            hybrid_investment = wind_hybrid_investment[tier, wind, diesel] #* (energy / 10000)
-            hybrid_capacity = wind_hybrid_capacity[tier, wind, diesel] #* (energy / 10000)
-            hybrid_fuel_cost = wind_hybrid_fuel_cost[tier, wind, diesel] #* (energy / 10000)
-
-            return hybrid_lcoe, hybrid_investment, hybrid_capacity, hybrid_fuel_cost
-
-        self.df['PotentialMG'] = np.where(
-            ((self.df[SET_POP + "{}".format(year)] > mg_wind_hybrid_specs['min_mg_size_ppl'])
-             & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
-             (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) |
-            (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5), 1, 0)
-
-        hybrid_series = self.df.apply(
-            lambda row: local_hybrid(row[SET_WINDVEL], row[SET_MG_DIESEL_FUEL + "{}".format(year)],
-                                     row[SET_TIER], row[SET_ENERGY_PER_CELL + "{}".format(year)])
-            if row['PotentialMG'] == 1
-            else [99, 0, 0, 0],
-            axis=1,
-            result_type='expand')
-
-        del self.df['PotentialMG']
+        if cache_folder is None:
+            lookup_table = HybridLookupTable(tiers, wind_range, diesel_range)
+        else:
+            # The cells solved before with the same inputs are read from the cache, so only the others are optimized
+            lookup_table = HybridLookupTableCache(cache_folder, wind_path, tiers, wind_range, diesel_range,
+                                                  technology='wind', specs=mg_wind_hybrid_specs, year=year,
+                                                  time_step=time_step, end_year=end_year, optimizer='de',
+                                                  seed=seed, seeding='cell', adaptive_tolerance=adaptive_tolerance)
+            logging.info('Wind hybrid lookup table: {} of {} cells read from {}'.format(
+                len(lookup_table.solved()), len(lookup_table.cells), lookup_table.path))
+
+        if adaptive_tolerance is not None:
+            # Only the cells where the lcoe is not smooth enough to be interpolated are optimized
+            def solve(t, g, d):
+                return self.optimize_wind_mini_grid(wind_curve * g / np.average(wind_curve), 10000, t, d,
+                                                    year - time_step, end_year, year, time_step,
+                                                    mg_wind_hybrid_specs, seed=cell_seed(seed, (t, g, d)))
+
+            n_solved = lookup_table.build_adaptive(solve, adaptive_tolerance)
+            logging.info('Wind hybrid lookup table: {} of {} cells optimized'.format(n_solved,
+                                                                                    len(lookup_table.cells)))
+        elif processes:
+            # The cells are optimized independently of each other in a pool of worker processes
+            cells = [(t, g, d) for t in tiers for g in wind_range for d in diesel_range
+                     if (t, g, d) not in lookup_table]
+            build_hybrid_lookup_table(cells, wind_curve, year, time_step, end_year, mg_wind_hybrid_specs, 'wind',
+                                      processes, seed, callback=lookup_table.add)
+        else:
+            for t in tiers:
+                for g in wind_range:
+                    for d in diesel_range:
+                        if (t, g, d) in lookup_table:
+                            continue
+                        gen_lcoe, inv, cap, fuel_cost = \
+                            self.optimize_wind_mini_grid(wind_curve * g / np.average(wind_curve),
+                                                         10000,
+                                                         t,
+                                                         d,
+                                                         year - time_step,
+                                                         end_year,
+                                                         year,
+                                                         time_step,
+                                                         mg_wind_hybrid_specs,
+                                                         seed=cell_seed(seed, (t, g, d)))
+
+                        lookup_table.add((t, g, d), (gen_lcoe, inv, cap, fuel_cost))
+
+        if cache_folder is not None:
+            lookup_table.save()
+
+        potential_mg = ((self.df[SET_POP + "{}".format(year)] > mg_wind_hybrid_specs['min_mg_size_ppl'])
+                        & (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 1) &
+                        (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 10)) | \
+                       (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] == 5)
+
+        # All settlements are looked up in the table at once, the others get the values of no mini-grid
+        hybrid_values = lookup_table.query(self.df[SET_TIER], self.df[SET_WINDVEL],
+                                           self.df[SET_MG_DIESEL_FUEL + "{}".format(year)], interpolate)
+        hybrid_values[:, ~potential_mg.values] = np.array([[99], [0], [0], [0]])
+        hybrid_series = pd.DataFrame(hybrid_values.T, index=self.df.index)
 
         hybrid_lcoe = pd.Series(hybrid_series[0])
         hybrid_capacity = pd.Series(hybrid_series[2] * (self.df[SET_ENERGY_PER_CELL + "{}".format(year)] / 10000))
@@ -2590,7 +3252,7 @@ class SettlementProcessor:
         self.df['windHybridEmissionFactor' + "{}".format(year)] = emission_factor
         self.df['windHybridGenLCOE' + "{}".format(year)] += hybrid_lcoe
 
-        return hybrid_lcoe, hybrid_capacity, hybrid_investment, wind_hybrid_investment
+        return hybrid_lcoe, hybrid_capacity, hybrid_investment, lookup_table
 
     def calculate_off_grid_lcoes(self, mg_hydro_calc, mg_wind_hybrid_calc, sa_pv_calc,  mg_pv_hybrid_calc, year, end_year, time_step, techs, tech_codes,
                                  min_mg_size=0, mg_min_grid_dist=0, diesel_techs=0):  # mg_diesel_calc, sa_diesel_calc,
@@ -2598,35 +3260,33 @@ class SettlementProcessor:
         Calculate the LCOEs for all off-grid technologies
         """
 
-        logging.info('Calculate minigrid hydro LCOE')
-        self.df[SET_LCOE_MG_HYDRO + "{}".format(year)], mg_hydro_investment, mg_hydro_capacity = \
-            mg_hydro_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                   start_year=year - time_step,
-                                   end_year=end_year,
-                                   people=self.df[SET_POP + "{}".format(year)],
-                                   new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                   total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                   prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                   num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                   grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                   additional_mv_line_length=self.df[SET_HYDRO_DIST],
-                                   capacity_factor=mg_hydro_calc.capacity_factor)
+        logging.info('Calculate minigrid hydro, PV hybrid, wind hybrid and standalone PV LCOE')
+        # The mini-grids share the same distribution network, which is only costed once for them
+        lcoes, investments, capacities = \
+            Technology.get_lcoes([mg_hydro_calc, mg_pv_hybrid_calc, mg_wind_hybrid_calc, sa_pv_calc],
+                                 energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
+                                 start_year=year - time_step,
+                                 end_year=end_year,
+                                 people=self.df[SET_POP + "{}".format(year)],
+                                 new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
+                                 total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
+                                 prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
+                                 num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
+                                 grid_cell_area=self.df[SET_GRID_CELL_AREA],
+                                 technology_args=[dict(additional_mv_line_length=self.df[SET_HYDRO_DIST],
+                                                       capacity_factor=mg_hydro_calc.capacity_factor),
+                                                  dict(capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR),
+                                                  dict(capacity_factor=self.df[SET_WINDCF]),
+                                                  dict(capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR)])
+
+        self.df[SET_LCOE_MG_HYDRO + "{}".format(year)] = lcoes[0]
+        mg_hydro_investment, mg_pv_hybrid_investment, mg_wind_investment, sa_pv_investment = investments
+        mg_hydro_capacity, mg_pv_hybrid_capacity, mg_wind_capacity, sa_pv_capacity = capacities
 
         self.df.loc[self.df[SET_POP + "{}".format(year)] < min_mg_size, SET_LCOE_MG_HYDRO + "{}".format(year)] = 99
         self.df.loc[self.df[SET_MV_DIST_CURRENT] < mg_min_grid_dist, SET_LCOE_MG_HYDRO + "{}".format(year)] = 99
 
-        logging.info('Calculate minigrid PV Hybrid LCOE')
-        self.df[SET_LCOE_MG_PV_HYBRID + "{}".format(year)], mg_pv_hybrid_investment, mg_pv_hybrid_capacity = \
-            mg_pv_hybrid_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                       start_year=year - time_step,
-                                       end_year=end_year,
-                                       people=self.df[SET_POP + "{}".format(year)],
-                                       new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                       total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                       prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                       num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                       grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                       capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR)
+        self.df[SET_LCOE_MG_PV_HYBRID + "{}".format(year)] = lcoes[1]
         self.df.loc[self.df[SET_LCOE_MG_PV_HYBRID + "{}".format(year)] > 99, SET_LCOE_MG_PV_HYBRID + "{}".format(year)] = 99
 
         self.df.loc[self.df[SET_POP + "{}".format(year)] < min_mg_size, SET_LCOE_MG_PV_HYBRID + "{}".format(year)] = 99
@@ -2645,18 +3305,7 @@ class SettlementProcessor:
         #                         grid_cell_area=self.df[SET_GRID_CELL_AREA],
         #                         capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR)
 
-        logging.info('Calculate minigrid Wind Hybrid LCOE')
-        self.df[SET_LCOE_MG_WIND + "{}".format(year)], mg_wind_investment, mg_wind_capacity = \
-            mg_wind_hybrid_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                       start_year=year - time_step,
-                                       end_year=end_year,
-                                       people=self.df[SET_POP + "{}".format(year)],
-                                       new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                       total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                       prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                       num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                       grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                       capacity_factor=self.df[SET_WINDCF])
+        self.df[SET_LCOE_MG_WIND + "{}".format(year)] = lcoes[2]
         self.df.loc[self.df[SET_LCOE_MG_WIND + "{}".format(year)] > 99, SET_LCOE_MG_WIND + "{}".format(year)] = 99
 
         self.df.loc[self.df[SET_POP + "{}".format(year)] < min_mg_size, SET_LCOE_MG_WIND + "{}".format(year)] = 99
@@ -2715,18 +3364,7 @@ class SettlementProcessor:
         #                                 fuel_cost=self.df[SET_SA_DIESEL_FUEL + "{}".format(year)],
         #                                 capacity_factor=sa_diesel_calc.capacity_factor)
 
-        logging.info('Calculate standalone PV LCOE')
-        self.df[SET_LCOE_SA_PV + "{}".format(year)], sa_pv_investment, sa_pv_capacity = \
-            sa_pv_calc.get_lcoe(energy_per_cell=self.df[SET_ENERGY_PER_CELL + "{}".format(year)],
-                                start_year=year - time_step,
-                                end_year=end_year,
-                                people=self.df[SET_POP + "{}".format(year)],
-                                new_connections=self.df[SET_NEW_CONNECTIONS + "{}".format(year)],
-                                total_energy_per_cell=self.df[SET_TOTAL_ENERGY_PER_CELL],
-                                prev_code=self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)],
-                                num_people_per_hh=self.df[SET_NUM_PEOPLE_PER_HH],
-                                grid_cell_area=self.df[SET_GRID_CELL_AREA],
-                                capacity_factor=self.df[SET_GHI] / HOURS_PER_YEAR)
+        self.df[SET_LCOE_SA_PV + "{}".format(year)] = lcoes[3]
 
         self.df.loc[(self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 3) &
                     (self.df[SET_ELEC_FINAL_CODE + "{}".format(year - time_step)] != 99),
@@ -2779,24 +3417,20 @@ class SettlementProcessor:
             self.df.loc[self.df[SET_MIN_OFFGRID + "{}".format(year)] == off_grid_techs[i],
                         SET_MIN_OFFGRID_CODE + "{}".format(year)] = off_grid_tech_codes[i]
 
-        sa_diesel = pd.DataFrame(np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 2, 1, 0))
-        sa_pv = pd.DataFrame(np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 3, 1, 0))
-        mg_diesel = pd.DataFrame(np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 4, 1, 0))
-        mg_pv_hybrid = pd.DataFrame(np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 5, 1, 0))
-        mg_wind = pd.DataFrame(np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 6, 1, 0))
-        mg_hydro = pd.DataFrame(np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 7, 1, 0))
-
-        sa_pv_investment.fillna(0, inplace=True)
-        mg_pv_hybrid_investment.fillna(0, inplace=True)
-        mg_wind_investment.fillna(0, inplace=True)
-        mg_hydro_investment.fillna(0, inplace=True)
+        sa_diesel = np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 2, 1, 0)
+        sa_pv = np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 3, 1, 0)
+        mg_diesel = np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 4, 1, 0)
+        mg_pv_hybrid = np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 5, 1, 0)
+        mg_wind = np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 6, 1, 0)
+        mg_hydro = np.where(self.df[SET_MIN_OFFGRID_CODE + "{}".format(year)] == 7, 1, 0)
 
         logging.info('Calculate investment cost')
 
         self.df['OffGridInvestmentCost' + "{}".format(year)] = 0.
-        self.df['OffGridInvestmentCost' + "{}".format(year)] = sa_pv * sa_pv_investment + \
-                                                           mg_pv_hybrid * mg_pv_hybrid_investment + \
-                                                           mg_wind * mg_wind_investment + mg_hydro * mg_hydro_investment
+        self.df['OffGridInvestmentCost' + "{}".format(year)] = sa_pv * finite_or_zero(sa_pv_investment) + \
+                                                           mg_pv_hybrid * finite_or_zero(mg_pv_hybrid_investment) + \
+                                                           mg_wind * finite_or_zero(mg_wind_investment) + \
+                                                           mg_hydro * finite_or_zero(mg_hydro_investment)
 
     def limit_hydro_usage(self, mg_hydro_calc, year):
         # A df with all hydro-power sites, to ensure that they aren't assigned more capacity than is available
@@ -2874,55 +3508,34 @@ class SettlementProcessor:
                                            mg_hydro_investment,
                                            mg_hydro_capacity, grid_investment, grid_capacity, year):
 
-        grid = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 1, 1, 0))
-        sa_diesel = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 2, 1, 0))
-        sa_pv = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 3, 1, 0))
-        mg_diesel = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 4, 1, 0))
-        # mg_pv = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 5, 1, 0))
-        mg_pv_hybrid = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 5, 1, 0))
-        mg_wind = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 6, 1, 0))
-        mg_hydro = pd.DataFrame(np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 7, 1, 0))
-
-        sa_pv_investment.fillna(0, inplace=True)
-        mg_pv_hybrid_investment.fillna(0, inplace=True)
-        mg_wind_investment.fillna(0, inplace=True)
-        mg_hydro_investment.fillna(0, inplace=True)
-        grid_investment.fillna(0, inplace=True)
-
-        sa_pv_investment.replace([np.inf, -np.inf], 0, inplace=True)
-        mg_pv_hybrid_investment.replace([np.inf, -np.inf], 0, inplace=True)
-        mg_wind_investment.replace([np.inf, -np.inf], 0, inplace=True)
-        mg_hydro_investment.replace([np.inf, -np.inf], 0, inplace=True)
-        grid_investment.replace([np.inf, -np.inf], 0, inplace=True)
+        grid = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 1, 1, 0)
+        sa_diesel = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 2, 1, 0)
+        sa_pv = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 3, 1, 0)
+        mg_diesel = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 4, 1, 0)
+        # mg_pv = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 5, 1, 0)
+        mg_pv_hybrid = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 5, 1, 0)
+        mg_wind = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 6, 1, 0)
+        mg_hydro = np.where(self.df[SET_MIN_OVERALL_CODE + "{}".format(year)] == 7, 1, 0)
 
         logging.info('Calculate investment cost')
 
         self.df[SET_INVESTMENT_COST + "{}".format(year)] = 0
 
-        self.df[SET_INVESTMENT_COST + "{}".format(year)] = grid * grid_investment + \
-                                                           sa_pv * sa_pv_investment + \
-                                                           mg_pv_hybrid * mg_pv_hybrid_investment + \
-                                                           mg_wind * mg_wind_investment + mg_hydro * mg_hydro_investment
+        self.df[SET_INVESTMENT_COST + "{}".format(year)] = grid * finite_or_zero(grid_investment) + \
+                                                           sa_pv * finite_or_zero(sa_pv_investment) + \
+                                                           mg_pv_hybrid * finite_or_zero(mg_pv_hybrid_investment) + \
+                                                           mg_wind * finite_or_zero(mg_wind_investment) + \
+                                                           mg_hydro * finite_or_zero(mg_hydro_investment)
 
         logging.info('Calculate new capacity')
 
-        sa_pv_capacity.fillna(0, inplace=True)
-        mg_pv_hybrid_capacity.fillna(0, inplace=True)
-        mg_wind_capacity.fillna(0, inplace=True)
-        mg_hydro_capacity.fillna(0, inplace=True)
-        grid_capacity.fillna(0, inplace=True)
-
-        sa_pv_capacity.replace([np.inf, -np.inf], 0, inplace=True)
-        mg_pv_hybrid_capacity.replace([np.inf, -np.inf], 0, inplace=True)
-        mg_wind_capacity.replace([np.inf, -np.inf], 0, inplace=True)
-        mg_hydro_capacity.replace([np.inf, -np.inf], 0, inplace=True)
-        grid_capacity.replace([np.inf, -np.inf], 0, inplace=True)
-
         self.df[SET_NEW_CAPACITY + "{}".format(year)] = 0
 
-        self.df[SET_NEW_CAPACITY + "{}".format(year)] = grid * grid_capacity + sa_pv * sa_pv_capacity + \
-                                                        mg_pv_hybrid * mg_pv_hybrid_capacity + \
-                                                        mg_wind * mg_wind_capacity + mg_hydro * mg_hydro_capacity
+        self.df[SET_NEW_CAPACITY + "{}".format(year)] = grid * finite_or_zero(grid_capacity) + \
+                                                        sa_pv * finite_or_zero(sa_pv_capacity) + \
+                                                        mg_pv_hybrid * finite_or_zero(mg_pv_hybrid_capacity) + \
+                                                        mg_wind * finite_or_zero(mg_wind_capacity) + \
+                                                        mg_hydro * finite_or_zero(mg_hydro_capacity)
     def pre_selection(self, eleclimit, year, time_step, prioritization, auto_densification=0):
 
         choice = int(prioritization)
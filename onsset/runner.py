@@ -8,7 +8,8 @@ import geopandas as gpd
 import geojson
 import pandas as pd
 from onsset import (SET_ELEC_ORDER, SET_LCOE_GRID, SET_MIN_GRID_DIST, SET_GRID_PENALTY,
-                    SET_MV_CONNECT_DIST, SET_WINDVEL, SET_WINDCF, SettlementProcessor, Technology)
+                    SET_MV_CONNECT_DIST, SET_WINDVEL, SET_WINDCF, SettlementProcessor, Technology,
+                    HybridDispatchCache, read_environmental_data)
 
 try:
     from onsset.specs import (SPE_COUNTRY, SPE_ELEC, SPE_ELEC_MODELLED,
@@ -102,7 +103,8 @@ def calibration(specs_path, csv_path, specs_path_calib, calibrated_csv_path):
     onsseter.df.to_csv(settlements_out_csv, index=False)
 
 
-def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv_path):
+def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv_path, hybrid_cache_folder=None,
+             hybrid_dispatch_cache=False):
     """
 
     Arguments
@@ -111,6 +113,13 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
     calibrated_csv_path : str
     results_folder : str
     summary_folder : str
+    pv_path : str
+    hybrid_cache_folder : str, optional
+        Folder where the hybrid lookup tables are stored and reused between runs with the same inputs
+    hybrid_dispatch_cache : bool, optional
+        If True, the PV-hybrid lookup table is solved from a grid of hourly dispatch results (HybridDispatchCache)
+        instead of the differential evolution optimization. This is much faster, but the interpolated
+        configurations give LCOEs up to about 1% off the optimized ones, so it is off by default
 
     """
 
@@ -195,6 +204,10 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
         # Carbon cost represents the cost in USD/tonCO2eq, which is converted and added to the diesel price
         diesel_price = float(scenario_parameters.iloc[0]['DieselPrice'] + (carbon_cost / 1000000) * 256.9131097 * 9.9445485)
 
+        # The hourly dispatch of the PV-hybrid configurations does not change between the years, so it is only
+        # simulated once and reused by the lookup table of each year
+        dispatch_cache = None
+
         for year in yearsofanalysis:
 
             time_step = time_steps[year]
@@ -321,9 +334,15 @@ def scenario(specs_path, calibrated_csv_path, results_folder, summary_folder, pv
             onsseter.diesel_cost_columns(sa_diesel_cost, mg_diesel_cost, year)
 
             if mg_hybrid_lookup_table:
-                hybrid_lcoe, hybrid_capacity, hybrid_investment = \
+                if hybrid_dispatch_cache and dispatch_cache is None:
+                    ghi_curve, temp = read_environmental_data(pv_path)
+                    dispatch_cache = HybridDispatchCache(ghi_curve, temp, mg_pv_hybrid_params)
+
+                hybrid_lcoe, hybrid_capacity, hybrid_investment, hybrid_lookup_table = \
                     onsseter.pv_hybrids_lcoe_lookuptable(year, time_step, end_year,
-                                                         mg_pv_hybrid_params, pv_path=pv_path)
+                                                         mg_pv_hybrid_params, pv_path=pv_path,
+                                                         dispatch_cache=dispatch_cache,
+                                                         cache_folder=hybrid_cache_folder)
             else:
                 hybrid_lcoe, hybrid_capacity, hybrid_investment = \
                     onsseter.pv_hybrids_lcoe(year, time_step, end_year,
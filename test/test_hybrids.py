@@ -0,0 +1,602 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from onsset.hybrids import (HybridDispatchCache, HybridLookupTable, HybridLookupTableCache, HybridSurrogate,
+                            ResourceDownloader, TokenBucket, calc_load_curve, calculate_hybrid_lcoe,
+                            calculate_hybrid_lcoe_annuity, cell_seed, differential_evolution_jit, dispatch_batch,
+                            find_least_cost_option, find_least_cost_option_batch, find_least_cost_option_specs,
+                            grid_bisection_search, hybrid_lcoe_factors, optimize_mini_grid_cells, pv_generation,
+                            pv_hybrid_specs_record, read_environmental_data, read_resource_columns, ResourceLibrary,
+                            select_typical_days, smallest_feasible_diesel, warm_start_population, year_simulation)
+from onsset.hybrids_wind import (WIND_POWER_CURVE, calculate_hybrid_lcoe_wind, calculate_hybrid_lcoe_wind_annuity,
+                                 find_least_cost_option_wind, wind_generation)
+from onsset.onsset import SettlementProcessor, build_hybrid_lookup_table
+
+from pytest import fixture, approx, raises
+
+
+class TestHybrids:
+
+    @fixture
+    def setup_resource(self):
+        """Synthetic hourly GHI (W/m2) and temperature (C) for one year, shaped like read_environmental_data output
+        """
+        hours = np.arange(8760)
+        hour_of_day = hours % 24
+        day = hours // 24
+        cloudiness = 0.7 + 0.3 * np.cos(day * 0.9)
+        ghi = np.clip(np.sin((hour_of_day - 6) / 12 * np.pi), 0, None) * 1000 * cloudiness
+        temp = 22 + 6 * np.sin((hour_of_day - 9) / 24 * 2 * np.pi)
+
+        return ghi.reshape(-1, 1), temp.reshape(-1, 1)
+
+    @fixture
+    def setup_args(self, setup_resource):
+        ghi, temp = setup_resource
+        load_curve = calc_load_curve(3, 10000.)
+        hour_numbers = (np.arange(8760) % 24).astype(float)
+
+        lcoe_factors = hybrid_lcoe_factors(2030, 2020, 0.08, 25)
+
+        return (temp, ghi, hour_numbers, load_curve, load_curve.max(), 0.93, 1, 0.93, 0.8, 0.6, 660, 142, 80, 0.015,
+                261, 0.1, 20, 539, 10, 25, 314, 0.02, 0.5, 2500, lcoe_factors)
+
+    @fixture
+    def setup_pv_hybrid_specs(self):
+        """The same specifications as in setup_args, as the mg_pv_hybrid_specs dict of the runner
+        """
+        return {'inv_eff': 0.93, 'n_dis': 1, 'n_chg': 0.93, 'dod_max': 0.8, 'pv_cost': 660, 'charge_controller': 142,
+                'pv_inverter': 80, 'pv_om': 0.015, 'diesel_cost': 261, 'diesel_om': 0.1, 'battery_inverter_life': 20,
+                'battery_inverter_cost': 539, 'diesel_life': 10, 'pv_life': 25, 'battery_cost': 314, 'lpsp_max': 0.02,
+                'diesel_limit': 0.5, 'full_life_cycles': 2500, 'discount_rate': 0.08}
+
+    @fixture
+    def setup_specs(self, setup_pv_hybrid_specs):
+        """The same specifications as in setup_args, as a record
+        """
+        return pv_hybrid_specs_record(setup_pv_hybrid_specs)
+
+    @fixture
+    def setup_configurations(self):
+        return np.array([[0., 0., 5.],
+                         [10., 20., 3.],
+                         [15., 40., 1.],
+                         [5., 10., 0.5]])
+
+    @fixture
+    def setup_server(self):
+        """Local stand-in for the renewables.ninja API, which answers the first request with the rate limit reached
+        """
+        requests_made = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests_made.append(self.path)
+                if len(requests_made) == 1:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                    self.end_headers()
+                    return
+
+                query = parse_qs(urlparse(self.path).query)
+                lat, lon = float(query['lat'][0]), float(query['lon'][0])
+                data = {str(h): {'local_time': '2020-01-01 {:02d}:00'.format(h % 24), 'irradiance_direct': lat / 100,
+                                 'irradiance_diffuse': h / 1000, 'temperature': lon} for h in range(48)}
+                body = json.dumps({'data': data}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield 'http://127.0.0.1:{}/api/'.format(server.server_port), requests_made
+        server.shutdown()
+
+    def test_find_least_cost_option_batch(self, setup_args, setup_configurations):
+        """The batched evaluation returns the same LCOE as evaluating each configuration separately
+        """
+        actual = find_least_cost_option_batch(setup_configurations, *setup_args)
+
+        expected = [find_least_cost_option(c, *setup_args)[0] for c in setup_configurations]
+
+        assert actual == approx(expected)
+
+    def test_year_simulation_trace(self, setup_resource):
+        """Hourly curves are only stored when a trace is requested, and the annual results do not depend on it
+        """
+        ghi, temp = setup_resource
+        load_curve = calc_load_curve(3, 10000.)
+        hour_numbers = (np.arange(8760) % 24).astype(float)
+        net_load, pv_gen = pv_generation(temp, ghi, 10., load_curve, 0.93)
+
+        args = (16., 3., net_load, hour_numbers, 0.93, 1, 0.93, load_curve.sum(), 2500, 0.8)
+        actual = year_simulation(*args)
+        traced = year_simulation(*args, True)
+
+        assert actual[:5] == approx(traced[:5])
+        assert len(actual[5]) == 0 and len(actual[6]) == 0
+        assert len(traced[5]) == 8760 and len(traced[6]) == 8760
+
+    def test_year_simulation_hour_of_year(self):
+        """Each hour of the year is simulated with its own net load, not with the net load of the same hour of the
+        first day
+        """
+        hour_numbers = (np.arange(8760) % 24).astype(float)
+        net_load = np.zeros(8760)
+        net_load[24:48] = 1.
+
+        # Without battery or diesel generator, all the demand of the second day is unmet
+        unmet_demand_share = year_simulation(0., 0., net_load, hour_numbers, 0.93, 1, 0.93, net_load.sum(), 2500,
+                                             0.8)[2]
+
+        assert unmet_demand_share == approx(1.)
+
+    def test_calculate_hybrid_lcoe_annuity(self):
+        """The closed-form LCOE gives the same results as stepping through each year of the project
+        """
+        load_curve = calc_load_curve(2, 10000.)
+
+        for start_year, end_year, battery_life in [(2020, 2030, 7), (2025, 2050, 20), (2020, 2045, 3)]:
+            lcoe_factors = hybrid_lcoe_factors(end_year, start_year, 0.08, 25)
+
+            expected = calculate_hybrid_lcoe(0.6, end_year, start_year, 10000., 1500., 12., 660, 25, 0.015, 142, 80,
+                                             4., 261, 0.1, 10, 30., 314, battery_life, 539, 20, load_curve, 0.08)
+            actual = calculate_hybrid_lcoe_annuity(0.6, 10000., 1500., 12., 660, 25, 0.015, 142, 80, 4., 261, 0.1,
+                                                   10, 30., 314, battery_life, 539, 20, load_curve.max(),
+                                                   lcoe_factors)
+
+            assert actual == approx(expected, rel=1e-12)
+
+    def test_calculate_hybrid_lcoe_wind_annuity(self):
+        """The closed-form wind LCOE gives the same results as stepping through each year of the project, also when a
+        component life does not divide the project life
+        """
+        load_curve = calc_load_curve(2, 10000.)
+
+        for start_year, end_year, discount_rate, battery_life, wind_life in [(2020, 2030, 0.08, 7, 20),
+                                                                            (2025, 2050, 0.05, 20, 15),
+                                                                            (2020, 2045, 0.12, 3, 25)]:
+            lcoe_factors = hybrid_lcoe_factors(end_year, start_year, discount_rate, 25)
+
+            expected = calculate_hybrid_lcoe_wind(0.6, end_year, start_year, 10000., 1500., 12., 1500, wind_life,
+                                                  0.02, 142, 4., 261, 0.1, 10, 30., 314, battery_life, 539, 20,
+                                                  load_curve, discount_rate)
+            actual = calculate_hybrid_lcoe_wind_annuity(0.6, 10000., 1500., 12., 1500, wind_life, 0.02, 142, 4., 261,
+                                                        0.1, 10, 30., 314, battery_life, 539, 20, load_curve.max(),
+                                                        lcoe_factors)
+
+            assert actual == approx(expected, rel=1e-12)
+
+    def test_year_simulation_pruning(self, setup_resource):
+        """Pruning stops infeasible configurations early, but gives the same results for feasible ones
+        """
+        ghi, temp = setup_resource
+        load_curve = calc_load_curve(3, 10000.)
+        hour_numbers = (np.arange(8760) % 24).astype(float)
+        net_load, pv_gen = pv_generation(temp, ghi, 10., load_curve, 0.93)
+
+        # Without a diesel generator and with a small battery, much of the demand is unmet
+        infeasible = (4., 0., net_load, hour_numbers, 0.93, 1, 0.93, load_curve.sum(), 2500, 0.8)
+        full = year_simulation(*infeasible)
+        pruned = year_simulation(*infeasible, False, 0.02, 0.5)
+
+        assert full[2] > pruned[2] > 0.02
+
+        feasible = (16., 5., net_load, hour_numbers, 0.93, 1, 0.93, load_curve.sum(), 2500, 0.8)
+        full = year_simulation(*feasible)
+        pruned = year_simulation(*feasible, False, 0.02, 0.5)
+
+        assert full[:5] == pruned[:5]
+
+    def test_select_typical_days(self, setup_resource):
+        """The representative days are in chronological order and together stand for the whole year
+        """
+        ghi, temp = setup_resource
+
+        hours, hour_weights = select_typical_days([ghi, temp], 12)
+
+        assert len(hours) == len(hour_weights) <= 12 * 24
+        assert (np.diff(hours) > 0).all()
+        assert (hours % 24 == np.arange(len(hours)) % 24).all()
+        assert hour_weights.sum() == 8760
+
+    def test_find_least_cost_option_weighted(self, setup_args, setup_configurations):
+        """Weighting every hour of the full year by one gives the same results as not weighting it, and a reduced year
+        of typical days gives results close to the full year
+        """
+        temp, ghi, hour_numbers, load_curve = setup_args[:4]
+        hours, hour_weights = select_typical_days([ghi, temp], 24)
+        reduced_args = (temp[hours], ghi[hours], hour_numbers[hours], load_curve[hours]) + setup_args[4:]
+
+        for configuration in setup_configurations:
+            full = find_least_cost_option(configuration, *setup_args)
+            weighted = find_least_cost_option(configuration, *setup_args, np.ones(8760))
+            reduced = find_least_cost_option(configuration, *reduced_args, hour_weights)
+
+            assert weighted == full
+            assert reduced[2] == approx(full[2], abs=0.02)
+
+    def test_differential_evolution_jit(self, setup_args, setup_specs):
+        """The compiled optimizer finds a feasible configuration, and gives the same result for the same seed
+        """
+        temp, ghi, hour_numbers, load_curve, peak_load = setup_args[:5]
+        specs = setup_specs
+        lcoe_factors = setup_args[-1]
+        min_bounds = np.array([0, 0, 0.5])
+        max_bounds = np.array([5 * peak_load, 5 * load_curve.sum() / 365, peak_load])
+
+        x, lcoe, n_evaluations = differential_evolution_jit(temp, ghi, hour_numbers, load_curve, peak_load, 0.6, specs,
+                                                            lcoe_factors, min_bounds, max_bounds, 1, 5, 20)
+        x_again, lcoe_again, n_evaluations_again = differential_evolution_jit(temp, ghi, hour_numbers, load_curve,
+                                                                              peak_load, 0.6, specs, lcoe_factors,
+                                                                              min_bounds, max_bounds, 1, 5, 20)
+
+        assert lcoe < 99
+        assert (x == x_again).all() and lcoe == lcoe_again and n_evaluations == n_evaluations_again
+        assert lcoe == find_least_cost_option_specs(x, temp, ghi, hour_numbers, load_curve, peak_load, 0.6, specs,
+                                                    lcoe_factors)[0]
+        assert lcoe == find_least_cost_option(x, *setup_args)[0]
+
+    def test_differential_evolution_jit_warm_start(self, setup_args, setup_specs):
+        """A population started around a known optimum keeps it, and the grid search cannot be warm-started
+        """
+        temp, ghi, hour_numbers, load_curve, peak_load = setup_args[:5]
+        lcoe_factors = setup_args[-1]
+        min_bounds = np.array([0, 0, 0.5])
+        max_bounds = np.array([5 * peak_load, 5 * load_curve.sum() / 365, peak_load])
+        search_args = (temp, ghi, hour_numbers, load_curve, peak_load, 0.6, setup_specs, lcoe_factors, min_bounds,
+                       max_bounds)
+
+        x, lcoe, _ = differential_evolution_jit(*search_args, 1, 5, 20)
+        init = warm_start_population([x], min_bounds, max_bounds, 10)
+        x_warm, lcoe_warm, n_evaluations = differential_evolution_jit(*search_args, 2, 5, 0, init=init)
+
+        assert n_evaluations == 10
+        assert lcoe_warm == approx(lcoe) and x_warm == approx(x)
+
+        with raises(ValueError):
+            SettlementProcessor.optimize_mini_grid(ghi, temp, 10000., 3, 0.6, 2020, 2030, 2030, 10, {},
+                                                   optimizer='bisection', warm_start=[x])
+
+    def test_optimize_mini_grid_cells_resume(self, setup_args, setup_specs):
+        """A cell gives the same result whether it is optimized with the other cells or alone, as when a table is
+        resumed from a partly filled cache
+        """
+        temp, ghi, hour_numbers = setup_args[:3]
+        lcoe_factors = setup_args[-1]
+        cells = np.array([[3, 1800., 0.5], [3, 2000., 0.7]])
+        seeds = np.array([cell_seed(3, cell) for cell in cells])
+
+        together = optimize_mini_grid_cells(cells, ghi, temp, hour_numbers, 10000., setup_specs, lcoe_factors, seeds,
+                                            5)
+        alone = optimize_mini_grid_cells(cells[1:], ghi, temp, hour_numbers, 10000., setup_specs, lcoe_factors,
+                                         seeds[1:], 5)
+
+        assert cell_seed(3, (3, 2000., 0.7)) == seeds[1] != cell_seed(4, (3, 2000., 0.7))
+        assert (together[1] == alone[0]).all()
+
+    def test_grid_bisection_search(self, setup_args, setup_specs):
+        """The bisection finds the smallest diesel capacity meeting the reliability constraint, and the grid search
+        built on it a feasible configuration
+        """
+        temp, ghi, hour_numbers, load_curve, peak_load = setup_args[:5]
+        lcoe_factors = setup_args[-1]
+        search_args = (temp, ghi, hour_numbers, load_curve, peak_load, 0.6, setup_specs, lcoe_factors)
+
+        diesel, lcoe, n_evaluations = smallest_feasible_diesel(10., 5., *search_args, 0.5, peak_load, peak_load, 8)
+        feasible = find_least_cost_option(np.array([10., 5., diesel]), *setup_args)
+        smaller = find_least_cost_option(np.array([10., 5., diesel - (peak_load - 0.5) / 2 ** 8]), *setup_args)
+
+        assert n_evaluations == 9
+        assert feasible[0] == lcoe < 99
+        assert feasible[1] <= 0.02 < smaller[1]
+
+        min_bounds = np.array([0, 0, 0.5])
+        max_bounds = np.array([5 * peak_load, 5 * load_curve.sum() / 365, peak_load])
+        x, lcoe, n_evaluations = grid_bisection_search(*search_args, min_bounds, max_bounds)
+
+        assert lcoe < 99
+        assert lcoe == find_least_cost_option(x, *setup_args)[0]
+
+    def test_warm_start_population(self):
+        """The warm-start population contains the seeds, clipped to the bounds, and lies within the bounds
+        """
+        min_bounds = np.array([0, 0, 0.5])
+        max_bounds = np.array([10, 40, 5])
+        seeds = [[5., 20., 2.], [12., 10., 1.]]
+
+        population = warm_start_population(seeds, min_bounds, max_bounds, 20)
+
+        assert population.shape == (20, 3)
+        assert (population[0] == [5., 20., 2.]).all() and (population[1] == [10., 10., 1.]).all()
+        assert (population >= min_bounds).all() and (population <= max_bounds).all()
+
+    def test_dispatch_batch(self, setup_args, setup_configurations):
+        """The dispatch results are the same as those behind the LCOE of find_least_cost_option
+        """
+        temp, ghi, hour_numbers, load_curve = setup_args[:4]
+
+        actual = dispatch_batch(setup_configurations, temp, ghi, hour_numbers, load_curve, 0.93, 1, 0.93, 0.8, 2500)
+
+        # Without constraints, no configuration is pruned
+        args = setup_args[:-4] + (np.inf, np.inf) + setup_args[-2:]
+        for configuration, dispatch in zip(setup_configurations, actual):
+            expected = find_least_cost_option(configuration, *args)
+            assert dispatch[1:4] == approx([expected[2], expected[1], expected[7]])
+
+    def test_hybrid_dispatch_cache(self, setup_resource, setup_pv_hybrid_specs):
+        """The dispatch is only simulated once per tier and GHI, and gives a feasible least-cost configuration for any
+        diesel price and study period
+        """
+        ghi, temp = setup_resource
+        specs = setup_pv_hybrid_specs
+        cache = HybridDispatchCache(ghi, temp, specs, n_grid=6)
+        annual_ghi = ghi.sum() / 1000
+
+        cheap = cache.optimize(3, annual_ghi, 0.5, 2020, 2030, specs)
+        expensive = cache.optimize(3, annual_ghi, 1.5, 2025, 2030, specs)
+
+        assert len(cache.results) == 1
+        assert cheap[0] < expensive[0] < 99
+
+    def test_single_precision(self, setup_args, setup_configurations):
+        """The hybrid simulation with float32 resource data and load curve gives the same results as with float64,
+        within single precision accuracy
+        """
+        temp, ghi, hour_numbers = setup_args[:3]
+        load_curve = calc_load_curve(3, 10000., np.float32)
+        args = (temp.astype(np.float32), ghi.astype(np.float32), hour_numbers, load_curve) + setup_args[4:]
+
+        net_load, pv_gen = pv_generation(args[0], args[1], 10., load_curve, 0.93)
+        assert net_load.dtype == np.float32 and pv_gen.dtype == np.float32
+
+        for configuration in setup_configurations:
+            expected = find_least_cost_option(configuration, *setup_args)
+            actual = find_least_cost_option(configuration, *args)
+
+            assert actual[0] == approx(expected[0], rel=1e-4)
+            assert actual[1:3] == approx(expected[1:3], rel=1e-4, abs=1e-6)
+
+    def test_build_hybrid_lookup_table(self, setup_resource, setup_pv_hybrid_specs):
+        """Every cell of the lookup table is solved, and the seeding per cell makes the table reproducible and the same
+        as solving the cell serially
+        """
+        specs = setup_pv_hybrid_specs
+        cells = [(3, 1800., 0.5), (3, 2000., 0.7)]
+
+        first = build_hybrid_lookup_table(cells, setup_resource, 2025, 5, 2030, specs, processes=1, seed=3)
+        second = build_hybrid_lookup_table(cells, setup_resource, 2025, 5, 2030, specs, processes=1, seed=3)
+
+        assert sorted(first) == sorted(cells)
+        for cell in cells:
+            assert first[cell] == approx(second[cell])
+            assert first[cell][0] < 99
+
+        ghi_curve, temp = setup_resource
+        serial = SettlementProcessor.optimize_mini_grid(ghi_curve * ((ghi_curve.sum() / 1000) / 2000.), temp, 10000, 3,
+                                                        0.7, 2020, 2030, 2025, 5, specs, seed=cell_seed(3, cells[1]))
+        assert first[cells[1]] == approx(serial)
+
+    def test_hybrid_lookup_table_cache(self, tmp_path):
+        """A partially built table is read back with its solved cells only, and any change in the inputs, including the
+        contents of the resource file, gives a different table
+        """
+        resource_path = tmp_path / 'resource.csv'
+        resource_path.write_text('1,2,3\n')
+        tiers, ghi_range, diesel_range = [1, 2], np.array([1800., 1900.]), np.array([0.5, 0.6, 0.7])
+        specs = {'pv_cost': 660, 'discount_rate': 0.08}
+
+        cache = HybridLookupTableCache(tmp_path, resource_path, tiers, ghi_range, diesel_range, specs=specs)
+        cache.add((1, 1900., 0.6), (0.3, 1000., 5., 200.))
+        cache.save()
+
+        resumed = HybridLookupTableCache(tmp_path, resource_path, tiers, ghi_range, diesel_range, specs=specs)
+        assert resumed.solved() == {(1, 1900., 0.6): approx((0.3, 1000., 5., 200.))}
+        assert not resumed.complete
+
+        other_specs = HybridLookupTableCache(tmp_path, resource_path, tiers, ghi_range, diesel_range,
+                                             specs=dict(specs, pv_cost=600))
+        resource_path.write_text('1,2,4\n')
+        other_resource = HybridLookupTableCache(tmp_path, resource_path, tiers, ghi_range, diesel_range, specs=specs)
+        assert other_specs.path != cache.path and other_resource.path != cache.path
+        assert other_specs.solved() == {} and other_resource.solved() == {}
+
+    def test_hybrid_lookup_table_query(self):
+        """The nearest cell is the one the settlement values round to, values outside the table are clipped to its
+        edges, and the interpolation is bilinear except next to infeasible cells
+        """
+        table = HybridLookupTable([1, 2], [1800., 1900.], [0.5, 0.6])
+        for (t, g, d) in table.cells:
+            table.add((t, g, d), (t + g / 1000 + d, 100 * t, 10 * t, g * d))
+        table.add((2, 1900., 0.6), (99, 0, 0, 0))
+
+        nearest = table.query([1, 1, 2], [1830., 2500., 1700.], [0.57, 0.2, 0.6])
+        assert nearest[0] == approx([1 + 1.8 + 0.6, 1 + 1.9 + 0.5, 2 + 1.8 + 0.6])
+
+        interpolated = table.query([1, 2], [1850., 1840.], [0.55, 0.52], interpolate=True)
+        assert interpolated[0] == approx([1 + 1.85 + 0.55, 2 + 1.8 + 0.5])
+        assert interpolated[3] == approx([1850 * 0.55, 1800 * 0.5])
+
+    def test_hybrid_lookup_table_build_adaptive(self):
+        """On a smooth lcoe surface only part of the cells are solved, the interpolated cells are within the tolerance,
+        and the edge of an infeasible region is solved exactly
+        """
+        def solve(t, g, d):
+            if g < 1500 and d > 1.2:
+                return 99, 0, 0, 0
+            lcoe = t * (0.1 + 100 / g + 0.2 * d ** 2)
+            return lcoe, 1000 * lcoe, 10., 100 * d
+
+        ghi_range, diesel_range = np.arange(1000., 2300., 100.), np.round(np.arange(0.5, 1.85, 0.1), 1)
+        table = HybridLookupTable([1, 3], ghi_range, diesel_range)
+        n_solved = table.build_adaptive(solve, tolerance=0.01)
+
+        expected = np.array([[[solve(t, g, d) for d in diesel_range] for g in ghi_range] for t in [1, 3]])
+        expected = np.moveaxis(expected, -1, 0)
+        feasible = expected[0] < 99
+
+        assert n_solved < 0.6 * len(table.cells)
+        assert table.complete
+        assert np.array_equal(table.table[0] < 99, feasible)
+        assert np.all(np.abs(table.table[0] - expected[0])[feasible] <= 0.01 * expected[0][feasible])
+
+    def test_hybrid_surrogate(self, tmp_path):
+        """The surrogate predicts a smooth lcoe within the tolerance over the input space, with the infeasible region
+        where it is, and is the same after being saved and loaded
+        """
+        def solve(tier, resource, diesel_price, pv_cost):
+            if diesel_price > 1.3 and resource < 1700:
+                return 99, 0, 0, 0
+            lcoe = tier * (0.1 + 100 / resource + 0.2 * diesel_price + pv_cost / 5000)
+            return lcoe, 1000 * lcoe, 10., 100 * diesel_price
+
+        bounds = {'resource': (1500, 2200), 'diesel_price': (0.5, 1.5), 'pv_cost': (400, 900)}
+        surrogate = HybridSurrogate(bounds, 2025, 2030, tiers=[1, 3])
+        surrogate.fit(solve, n_samples=60)
+
+        assert surrogate.cv_error[3]['lcoe_max'] < 0.02
+
+        tier, ghi, diesel, pv_cost = np.array([1, 3, 3]), np.array([1800., 2000., 1550.]), \
+            np.array([0.7, 1.2, 1.45]), 650.
+        predicted = surrogate.predict(tier, ghi, diesel, pv_cost=pv_cost, battery_cost=314)
+
+        expected = [solve(*x, pv_cost) for x in zip(tier, ghi, diesel)]
+        assert predicted[0, :2] == approx([e[0] for e in expected[:2]], rel=0.01)
+        assert predicted[0, 2] == 99
+
+        surrogate.save(tmp_path / 'surrogate.npz')
+        loaded = HybridSurrogate.load(tmp_path / 'surrogate.npz')
+        assert loaded.predict(tier, ghi, diesel, pv_cost=pv_cost) == approx(predicted)
+
+    def test_read_environmental_data_cache(self, tmp_path, setup_resource):
+        """The resource file is parsed once into a memory-mapped .npy file, which is parsed again when the file changes,
+        and a column cannot be requested twice
+        """
+        ghi, temp = setup_resource
+        path = tmp_path / 'pv.csv'
+
+        def write(ghi):
+            with open(path, 'w') as f:
+                f.write('header\ntime,x,T2m,G(h)\n')
+                f.writelines('{},0,{},{}\n'.format(i, t, g) for i, (t, g) in enumerate(zip(temp[:, 0], ghi[:, 0])))
+
+        write(ghi)
+        expected = read_environmental_data(path, skiprows=1, cache=False)
+        parsed = read_environmental_data(path, skiprows=1)
+        cached = read_environmental_data(path, skiprows=1)
+
+        assert isinstance(cached[0], np.memmap)
+        for e, p, c in zip(expected, parsed, cached):
+            assert e.shape == (8760, 1)
+            assert np.array_equal(e, p) and np.array_equal(e, c)
+
+        write(ghi * 2)
+        changed_ghi, _ = read_environmental_data(path, skiprows=1)
+        assert changed_ghi == approx(expected[0] * 2)
+
+        with raises(ValueError):
+            read_resource_columns(path, [3, 3], skiprows=1)
+
+        # A truncated or outdated meta file is replaced when the csv-file is parsed again
+        for meta_path in tmp_path.glob('pv.csv.*.json'):
+            meta_path.write_text('{"size": 1')
+        assert read_environmental_data(path, skiprows=1)[0] == approx(expected[0] * 2)
+        for meta_path in tmp_path.glob('pv.csv.*.json'):
+            meta_path.write_text('{"size": 1, "mtime_ns": 1}')
+        assert read_environmental_data(path, skiprows=1)[0] == approx(expected[0] * 2)
+
+    def test_resource_library(self, tmp_path, setup_resource):
+        """Each point gets the profiles of the nearest site, as memory-mapped views with the read_environmental_data
+        shape
+        """
+        ghi, temp = setup_resource
+        sites = np.array([[32.5, -25.9], [35.5, -19.8], [40.5, -12.9], [179.9, 0.]])
+        library = ResourceLibrary.create(tmp_path, sites, lambda i: (ghi * (1 + i / 10), temp + i))
+
+        assert list(library.nearest([32.6, 40., 33., -179.9], [-25., -13., -20., 0.])) == [0, 2, 1, 3]
+
+        ghi_curve, temp_curve = ResourceLibrary(tmp_path).profile(2)
+        assert isinstance(ghi_curve, np.memmap)
+        assert ghi_curve.shape == temp_curve.shape == (8760, 1)
+        assert ghi_curve == approx(ghi * 1.2)
+        assert temp_curve == approx(temp + 2)
+
+    def test_resource_downloader(self, tmp_path, setup_server):
+        """The locations are downloaded once, after waiting for the rate limit, even when given twice, and stored in a
+        resource library
+        """
+        api_base, requests_made = setup_server
+        latitudes, longitudes = [-25.9, -19.8, -12.9], [32.5, 35.5, 40.5]
+
+        downloader = ResourceDownloader('token', tmp_path / 'cache', rate=100, per=1, burst=10, api_base=api_base)
+        library = downloader.download_library(latitudes, longitudes, tmp_path / 'library')
+
+        assert len(requests_made) == 4
+        assert list(library.nearest([40.4], [-13.])) == [2]
+        ghi, temp = library.profile(2)
+        assert ghi[:, 0] == approx(-129 + np.arange(48))
+        assert temp[:, 0] == approx(40.5)
+
+        ResourceDownloader('token', tmp_path / 'cache', api_base=api_base).download(latitudes, longitudes)
+        assert len(requests_made) == 4
+
+        paths = ResourceDownloader('token', tmp_path / 'other', api_base=api_base).download([-8.1, -8.1], [33.1, 33.1])
+        assert len(requests_made) == 5
+        assert paths[0] == paths[1]
+        assert sorted(p.name for p in (tmp_path / 'other').iterdir()) == [os.path.basename(paths[0])]
+
+    def test_token_bucket(self):
+        """After the burst, the requests are spread at the rate of the bucket
+        """
+        bucket = TokenBucket(rate=50, per=1, burst=2)
+        start = time.monotonic()
+        for _ in range(7):
+            bucket.acquire()
+        assert 0.09 < time.monotonic() - start < 0.5
+
+    def test_wind_generation(self):
+        """The power curve is interpolated between the integer wind speeds, and the turbines are cut out above 25 m/s
+        """
+        wind = np.array([0., 3.5, 4.25, 10., 15.9, 24.6, 25., 26.]).reshape(-1, 1)
+        load = np.full(len(wind), 100.)
+
+        net_load, wind_gen = wind_generation(wind, 300., load, 0.93)
+
+        expected = np.interp(wind[:, 0], np.arange(len(WIND_POWER_CURVE)), WIND_POWER_CURVE, right=0) / 2
+        assert wind_gen == approx(expected)
+        assert wind_gen[-1] == 0
+        assert net_load == approx(load - expected)
+
+    def test_optimize_wind_mini_grid(self):
+        """The sizing search finds a feasible configuration cheaper than the middle of the solution space, and the
+        same one for the same seed
+        """
+        wind = np.random.default_rng(0).weibull(2, 8760).reshape(-1, 1) * 6
+        specs = {'inv_eff': 0.93, 'n_dis': 1, 'n_chg': 0.93, 'dod_max': 0.8, 'wind_cost': 3750,
+                 'charge_controller': 142, 'wind_om': 0.02, 'diesel_cost': 261, 'diesel_om': 0.1,
+                 'battery_inverter_life': 20, 'battery_inverter_cost': 539, 'diesel_life': 10, 'wind_life': 20,
+                 'battery_cost': 314, 'lpsp_max': 0.02, 'diesel_limit': 0.5, 'full_life_cycles': 2500,
+                 'discount_rate': 0.08}
+
+        result = SettlementProcessor.optimize_wind_mini_grid(wind, 10000, 3, 0.8, 2020, 2030, 2025, 5, specs, seed=1)
+        again = SettlementProcessor.optimize_wind_mini_grid(wind, 10000, 3, 0.8, 2020, 2030, 2025, 5, specs, seed=1)
+
+        load_curve = calc_load_curve(3, 10000.)
+        midpoint = np.array([2.5 * load_curve.max(), 2.5 * 10000 / 365, (0.5 + load_curve.max()) / 2])
+        midpoint_lcoe = find_least_cost_option_wind(midpoint, wind, (np.arange(8760) % 24).astype(float), load_curve,
+                                                    load_curve.max(), 0.93, 1, 0.93, 0.8, 0.8, 3750, 142, 0.02, 261,
+                                                    0.1, 20, 539, 10, 20, 314, 0.02, 0.5, 2500,
+                                                    hybrid_lcoe_factors(2030, 2020, 0.08, 20))[0]
+
+        assert result[0] < min(midpoint_lcoe, 99)
+        assert result == approx(again)
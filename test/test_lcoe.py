@@ -0,0 +1,143 @@
+import numpy as np
+
+from onsset import LCOEResult, Technology
+
+from pandas import Series
+from pytest import fixture, approx
+
+
+class TestGetLcoe:
+
+    @fixture
+    def setup_technology(self) -> Technology:
+        Technology.set_default_values(base_year=2020, start_year=2020, end_year=2030)
+        technology = Technology(tech_life=7, base_to_peak_load_ratio=0.85, distribution_losses=0.05,
+                                connection_cost_per_hh=100, capacity_factor=0.5, om_costs=0.015,
+                                capital_cost={20: 4300, float("inf"): 3000}, mini_grid=True,
+                                grid_capacity_investment=500)
+
+        return technology
+
+    def test_get_lcoe_year_by_year(self, setup_technology):
+        """The lcoe and investment equal the costs and generation discounted year by year, with a reinvestment when the
+        technology life ends before the end year and a salvage value in the final year
+        """
+        technology = setup_technology
+        energy = Series([20000., 500000.])
+        people = Series([200., 3000.])
+        fuel_cost = Series([0.1, 0.2])
+
+        lcoe, investment, capacity = technology.get_lcoe(energy, people, 5, 2025, 2035, people, energy,
+                                                         Series([99, 99]), Series([1., 2.]), fuel_cost=fuel_cost,
+                                                         capacity_factor=0.5)
+
+        generation, peak_load, td_investment = technology.td_network_cost(people, people, Series([99, 99]), energy,
+                                                                          energy, 5, Series([1., 2.]))[:3]
+        cap_cost = np.where(peak_load / 0.5 < 20, 4300, 3000)
+        total_investment = td_investment + peak_load / 0.5 * cap_cost
+        om = cap_cost * 0.015 * peak_load / 0.5
+
+        # Investment in 2025 and again in 2032, salvage of the reinvestment at the end of 2035
+        years = np.arange(16)
+        discount = 1.08 ** years
+        invested = np.isin(years, [5, 12])
+        running = years >= 5
+        salvage = total_investment * (1 - 4 / 7)
+        costs = np.outer(total_investment, invested) + np.outer(om + generation * fuel_cost, running)
+        costs[:, -1] -= salvage
+        expected_lcoe = (costs / discount).sum(axis=1) / (np.outer(generation, running) / discount).sum(axis=1)
+        expected_investment = ((total_investment + peak_load * 500)[:, None] * invested / discount).sum(axis=1)
+
+        assert lcoe == approx(expected_lcoe)
+        assert investment == approx(expected_investment)
+        assert capacity == approx(peak_load / 0.5)
+
+    def test_get_lcoe_result(self, setup_technology):
+        """The result holds one contiguous array per quantity, and the lcoe, investment and capacity of hybrid
+        mini-grids include those of the generation from the hybrid lookup table
+        """
+        technology = setup_technology
+        energy = Series([20000., 500000.], index=[10, 20])
+        people = Series([200., 3000.], index=[10, 20])
+        args = (energy, people, 5, 2025, 2035, people, energy, 99, 1.)
+
+        result = technology.get_lcoe(*args, get_max_dist=True)
+        lcoe, investment, capacity, peak_load = result
+
+        assert isinstance(result, LCOEResult)
+        assert len(result) == 2
+        assert lcoe.flags['C_CONTIGUOUS'] and lcoe.dtype == np.float64
+        assert capacity == approx(peak_load / 0.9)
+
+        technology.hybrid = True
+        technology.hybrid_fuel = Series([0.2, 0.3], index=[10, 20])
+        technology.hybrid_investment = Series([1000., 2000.], index=[10, 20])
+        technology.hybrid_capacity = Series([5., 50.], index=[10, 20], name=2)
+        hybrid_lcoe, hybrid_investment, hybrid_capacity = technology.get_lcoe(*args)
+
+        assert hybrid_lcoe == approx(lcoe + [0.2, 0.3])
+        assert hybrid_investment == approx(investment + [1000., 2000.])
+        assert hybrid_capacity == approx([5., 50.])
+
+    def test_td_network_cost_new_network(self, setup_technology):
+        """For settlements without a previous network, the fused kernel gives the cost of the network from
+        distribution_network and transmission_network
+        """
+        technology = setup_technology
+        people = np.array([200., 3000., 40000.])
+        energy = np.array([20000., 500000., 8000000.])
+        area = np.array([1., 2., 10.])
+        distance = np.array([5., 20., 60.])
+
+        generation, peak_load, td_investment, hv, mv, lv, transformers, connections = \
+            technology.td_network_cost(people, people, 99, energy, energy, 5, area, distance, 1)
+
+        mv_km, lv_km, no_of_transformers, consumption, peak, nodes = \
+            technology.distribution_network(people, energy, 5, area)
+        hv_km, mv_connection_km, hv_mv_subs, _ = technology.transmission_network(peak, distance, 1)
+
+        assert generation == approx(consumption)
+        assert peak_load == approx(peak)
+        assert lv == approx(lv_km * technology.lv_line_cost)
+        assert td_investment == approx(hv_km * technology.hv_line_cost + mv_connection_km * technology.mv_line_cost +
+                                       lv_km * technology.lv_line_cost + mv_km * technology.mv_line_cost +
+                                       no_of_transformers * technology.service_transf_cost +
+                                       nodes * technology.connection_cost_per_hh +
+                                       hv_mv_subs * technology.hv_mv_sub_station_cost)
+
+    def test_get_capital_cost(self):
+        """Each capacity gets the cost of the lowest limit above it, whatever the order of the limits, and the tiers
+        follow a change of the cost table
+        """
+        technology = Technology(capital_cost={1: 4470, float("inf"): 6950, 0.02: 9620, 0.1: 6380, 0.05: 8780},
+                                standalone=True)
+
+        capacity = np.array([0., 0.02, 0.03, 0.07, 0.5, 1., 30.])
+        assert technology.get_capital_cost(capacity) == approx([9620, 8780, 8780, 6380, 4470, 6950, 6950])
+
+        technology.capital_cost = {10: 3000}
+        assert technology.get_capital_cost(capacity) == approx([3000, 3000, 3000, 3000, 3000, 3000, 0])
+
+    def test_get_lcoes(self, setup_technology):
+        """Each row of the batched result equals the lcoe of the technology on its own, whether or not the
+        technologies share their network
+        """
+        technology = setup_technology
+        other = Technology(tech_life=20, base_to_peak_load_ratio=0.85, distribution_losses=0.05,
+                           connection_cost_per_hh=100, capacity_factor=0.5, om_costs=0.02,
+                           capital_cost={float("inf"): 2500}, mini_grid=True)
+        energy = Series([20000., 500000., 0.])
+        people = Series([200., 3000., 0.])
+        args = (energy, people, 5, 2025, 2035, people, energy, 99, Series([1., 2., 3.]))
+        technology_args = [dict(capacity_factor=0.5), dict(capacity_factor=0.3),
+                           dict(capacity_factor=0.5, additional_mv_line_length=Series([5., 10., 15.]))]
+
+        lcoes = Technology.get_lcoes([technology, other, technology], *args, technology_args=technology_args,
+                                     fuel_cost=0.1)
+
+        assert lcoes.lcoe.shape == (3, 3)
+        for i, tech in enumerate([technology, other, technology]):
+            lcoe, investment, capacity = tech.get_lcoe(*args, fuel_cost=0.1, **technology_args[i])
+            assert lcoes.lcoe[i] == approx(lcoe)
+            assert lcoes.investment[i] == approx(investment)
+            assert lcoes.capacity[i] == approx(capacity)